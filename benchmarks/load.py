@@ -0,0 +1,386 @@
+"""
+Enrolment day rehearsal: synthetic students and instructors against the app
+on local stand-ins (see benchmarks.standins).
+
+Every student logs in through /login first. Then, for --duration seconds:
+
+- students poll the catalogue (/api/thesis and /api/thesis/changes) at
+  --poll-rate requests per second in total,
+- at --enrol-at seconds every student without a thesis sends
+  /api/thesis/enrol within --burst-spread seconds. A student who gets 409
+  tries another thesis, one who gets 429 comes back after Retry-After,
+- instructors add theses at --instructor-rate per second and drop each one
+  again a second later.
+
+Arrivals are open loop: requests are sent on a precomputed schedule
+(Poisson arrivals, uniform burst), no matter how slow earlier responses
+were. Latency is counted from the scheduled time, so time spent waiting
+for a free client thread counts too. --latency adds a sleep to every
+database call, so requests hold their threads like they do against real
+stores. At the end the stores are checked for double assignments.
+
+Usage:
+    python -m benchmarks.load --students 500 --enrol-at 2 --duration 10
+    python -m benchmarks.load --students 500 --no-admission
+"""
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import create_test_database
+import settings as s
+from benchmarks.run import percentile
+from benchmarks.standins import create_clients
+from create_test_database import PASSWORD
+from db.db_neo4j import Thesis
+from src.app import create_app
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}  # request kind -> seconds
+        self.statuses = {}  # request kind -> Counter
+        self.enrolled = []  # seconds since the start of successful enrolments
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, latency: float, status: str):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(latency)
+            self.statuses.setdefault(kind, Counter())[status] += 1
+
+    def add_enrolled(self, seconds: float):
+        with self._lock:
+            self.enrolled.append(seconds)
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for kind, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            statuses = self.statuses[kind]
+            result[kind] = {
+                'requests': len(latencies),
+                'throughput': round(len(latencies) / elapsed, 1),
+                'latency_ms': {
+                    name: round(percentile(latencies, share) * 1000, 2)
+                    for name, share in (('p50', 0.5), ('p95', 0.95),
+                                        ('p99', 0.99))},
+                'statuses': dict(statuses),
+                'errors': sum(count for status, count in statuses.items()
+                              if not status.isdigit() or int(status) >= 500),
+                'conflicts': statuses.get('409', 0),
+                'rejected': statuses.get('429', 0),
+            }
+        return result
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.results = Results()
+        self.clients = create_clients(args.latency)
+        self.app = create_app(self.clients, warm_up=False)
+        # cookies are sent by hand, so one client serves all threads
+        self.http = self.app.test_client(use_cookies=False)
+
+        groups = 4
+        instructors = max(args.students // 10, 1)
+        self.data = create_test_database.generate_university(
+            seed=args.seed, departments=1, groups_per_department=groups,
+            students_per_group=math.ceil(args.students / groups),
+            instructors_per_department=instructors,
+            theses_per_instructor=args.theses_per_instructor,
+            load_min=args.load_min, load_max=args.load_max,
+            enrolled_share=0.0)
+        create_test_database.write_university(
+            self.data, self.clients.mongo, self.clients.graph)
+        self.students = [user for user in self.data['users']
+                         if user['role'] == 'student']
+        self.instructors = [user for user in self.data['users']
+                            if user['role'] == 'instructor']
+        self.names = [row['props']['thesis_name']
+                      for row in self.data['theses']]
+        # popular topics get most of the first choices
+        self.weights = create_test_database.zipf_weights(len(self.names), 1.0)
+        self.cookies = {}  # user id -> session cookie
+        self.started = 0.0
+
+        self._schedule = []  # heap of (monotonic time, sequence, call)
+        self._sequence = itertools.count()
+        self._schedule_lock = threading.Lock()
+        self._pending = 0
+        self._done = threading.Condition()
+
+    # requests
+
+    def login(self, user: dict):
+        response = self.http.post('/login', data={'email': user['email'],
+                                                  'password': PASSWORD})
+        assert response.status_code == 302, response.status_code
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        self.cookies[user['_id']] = cookie
+
+    def request(self, kind: str, scheduled: float, user: dict, method: str,
+                url: str, **kwargs):
+        """
+        :param scheduled: monotonic time the request was due
+        :return: response, None if the app raised
+        """
+        try:
+            # buffered closes streamed bodies like a WSGI server, which
+            # releases their admission slots
+            response = self.http.open(
+                url, method=method, buffered=True,
+                headers={'Cookie': self.cookies[user['_id']]}, **kwargs)
+            status = str(response.status_code)
+        except Exception:
+            response, status = None, 'exception'
+        self.results.add(kind, time.monotonic() - scheduled, status)
+        return response
+
+    def poll(self, scheduled: float):
+        student = self.rnd.choice(self.students)
+        if self.rnd.random() < 0.5:
+            self.request('catalogue', scheduled, student, 'GET',
+                         '/api/thesis?only_unassigned=1&page_size=20')
+        else:
+            since = time.time() - self.args.poll_interval
+            self.request('changes', scheduled, student, 'GET',
+                         f'/api/thesis/changes?since={since}')
+
+    def enrol(self, scheduled: float, student: dict, attempt: int = 1):
+        name = self.rnd.choices(self.names, self.weights)[0]
+        response = self.request('enrol', scheduled, student, 'POST',
+                                '/api/thesis/enrol',
+                                json={'thesis_name': name})
+        if response is None:
+            return
+        if response.status_code == 200:
+            self.results.add_enrolled(time.monotonic() - self.started)
+        elif response.status_code == 409 and attempt < self.args.attempts:
+            self.enrol(time.monotonic(), student, attempt + 1)
+        elif response.status_code == 429 and attempt < self.args.attempts:
+            retry_after = float(response.headers.get('Retry-After', 1))
+            self.at(time.monotonic() + retry_after * self.args.retry_scale,
+                    lambda when: self.enrol(when, student, attempt + 1))
+
+    def add_thesis(self, scheduled: float, number: int):
+        instructor = self.rnd.choice(self.instructors)
+        name = f'Load test thesis {number}'
+        response = self.request('add', scheduled, instructor, 'POST',
+                                '/api/thesis/add', json={
+                                    'thesis_name': name,
+                                    'description': 'Added by the load test',
+                                    'year': 4, 'difficulty': 3,
+                                    'tags': 'load, tag-1'})
+        if response is not None and response.status_code == 200:
+            self.at(time.monotonic() + 1.0, lambda when: self.request(
+                'drop', when, instructor, 'POST', '/api/thesis/drop_by_id',
+                json={'instructor_id': str(instructor['_id']),
+                      'thesis_id': name}))
+
+    # schedule
+
+    def at(self, when: float, call: Callable[[float], None]):
+        """
+        run call(when) in a client thread at the monotonic time
+        """
+        with self._schedule_lock:
+            heapq.heappush(self._schedule, (when, next(self._sequence), call))
+        with self._done:
+            self._pending += 1
+            self._done.notify_all()
+
+    def arrivals(self, rate: float, start: float, end: float) -> List[float]:
+        """
+        :return: times of Poisson arrivals with the rate per second
+        """
+        times = []
+        if rate <= 0:
+            return times
+        when = start + self.rnd.expovariate(rate)
+        while when < end:
+            times.append(when)
+            when += self.rnd.expovariate(rate)
+        return times
+
+    def run(self) -> dict:
+        args = self.args
+        for user in self.students + self.instructors:
+            self.login(user)
+
+        self.started = start = time.monotonic()
+        end = start + args.duration
+        for when in self.arrivals(args.poll_rate, start, end):
+            self.at(when, self.poll)
+        for number, when in enumerate(self.arrivals(
+                args.instructor_rate, start, end)):
+            self.at(when, lambda scheduled, number=number:
+                    self.add_thesis(scheduled, number))
+        for student in self.students:
+            when = start + args.enrol_at + self.rnd.uniform(
+                0, args.burst_spread)
+            self.at(when, lambda scheduled, student=student:
+                    self.enrol(scheduled, student))
+
+        with ThreadPoolExecutor(args.threads) as executor:
+            while True:
+                with self._schedule_lock:
+                    item = self._schedule[0] if self._schedule else None
+                if item is None:
+                    with self._done:
+                        if self._pending == 0:
+                            break
+                        self._done.wait(0.05)
+                    continue
+                delay = item[0] - time.monotonic()
+                if delay > 0:
+                    time.sleep(min(delay, 0.01))
+                    continue
+                with self._schedule_lock:
+                    when, _, call = heapq.heappop(self._schedule)
+                executor.submit(self.call, call, when)
+        elapsed = time.monotonic() - start
+
+        return {
+            'students': len(self.students),
+            'admission_control': s.ADMISSION_CONTROL,
+            'elapsed': round(elapsed, 2),
+            'requests': self.results.summary(elapsed),
+            'enrolled': len(self.results.enrolled),
+            'goodput': enrol_goodput(self.results.enrolled),
+            'violations': check_assignments(self.clients),
+        }
+
+    def call(self, call: Callable[[float], None], when: float):
+        try:
+            call(when)
+        finally:
+            with self._done:
+                self._pending -= 1
+                self._done.notify_all()
+
+
+def enrol_goodput(enrolled: List[float]) -> dict:
+    """
+    :return: successful enrolments per second of the burst
+    """
+    if not enrolled:
+        return {'per_second': 0.0, 'seconds': 0.0}
+    seconds = max(max(enrolled) - min(enrolled), 1e-3)
+    return {'per_second': round(len(enrolled) / seconds, 1),
+            'seconds': round(seconds, 2)}
+
+
+def check_assignments(clients) -> List[str]:
+    """
+    compare the thesis of every student in mongodb with the student of
+    every thesis in Neo4j and the instructor counters with their load
+    :return: descriptions of the violations
+    """
+    violations = []
+    theses = {thesis['thesis_name']: thesis for thesis in
+              Thesis.find_all(clients.graph)}
+    owners = {}
+    for thesis in theses.values():
+        if thesis.get('student_id'):
+            owners.setdefault(thesis['student_id'], []).append(
+                thesis['thesis_name'])
+    for student_id, names in owners.items():
+        if len(names) > 1:
+            violations.append(f'student {student_id} holds {names}')
+
+    for user in clients.mongo.users.find({'role': 'student',
+                                          'thesis_id': {'$ne': None}}):
+        thesis = theses.get(user['thesis_id'])
+        if thesis is None or thesis.get('student_id') != str(user['_id']):
+            violations.append(f'student {user["_id"]} has thesis '
+                              f'"{user["thesis_id"]}" in mongodb only')
+        owners.pop(str(user['_id']), None)
+    for student_id, names in owners.items():
+        violations.append(f'theses {names} of student {student_id} are '
+                          f'missing in mongodb')
+
+    graph = clients.graph.graph._graph
+    for instructor_id, instructor in graph.instructors.items():
+        enrolled = sum(1 for name, owner in graph.thesis_instructor.items()
+                       if owner == instructor_id
+                       and graph.theses[name].get('student_id'))
+        if enrolled != instructor.get('theses_enrolled', 0):
+            violations.append(f'instructor {instructor_id} counts '
+                              f'{instructor.get("theses_enrolled", 0)} '
+                              f'enrolled theses, has {enrolled}')
+        if instructor.get('load') is not None and \
+                enrolled > instructor['load']:
+            violations.append(f'instructor {instructor_id} has {enrolled} '
+                              f'students over the load {instructor["load"]}')
+    return violations
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Enrolment day load test')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--theses-per-instructor', type=int, default=12)
+    parser.add_argument('--load-min', type=int, default=8)
+    parser.add_argument('--load-max', type=int, default=14)
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds of polling and instructor traffic')
+    parser.add_argument('--enrol-at', type=float, default=2.0,
+                        help='seconds after the start the enrolment opens')
+    parser.add_argument('--burst-spread', type=float, default=1.0,
+                        help='seconds over which the students enrol')
+    parser.add_argument('--attempts', type=int, default=5,
+                        help='enrolment attempts of a student')
+    parser.add_argument('--retry-scale', type=float, default=1.0,
+                        help='factor of Retry-After before a retry')
+    parser.add_argument('--poll-rate', type=float, default=50.0,
+                        help='catalogue requests per second')
+    parser.add_argument('--poll-interval', type=float, default=10.0,
+                        help='seconds between the change polls of a page')
+    parser.add_argument('--instructor-rate', type=float, default=1.0,
+                        help='theses added per second')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds added to every database call')
+    parser.add_argument('--threads', type=int, default=200,
+                        help='client threads sending the requests')
+    parser.add_argument('--no-admission', action='store_true',
+                        help='turn admission control off')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the result as JSON')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.no_admission:
+        s.ADMISSION_CONTROL = False
+    result = LoadTest(args).run()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    for kind, stats in result['requests'].items():
+        latency = stats['latency_ms']
+        print(f'{kind:10} {stats["requests"]:6} req '
+              f'{stats["throughput"]:8.1f} req/s  p50 {latency["p50"]:.1f}ms'
+              f'  p95 {latency["p95"]:.1f}ms  p99 {latency["p99"]:.1f}ms  '
+              f'errors {stats["errors"]}  409 {stats["conflicts"]}  '
+              f'429 {stats["rejected"]}')
+    print(f'enrolled {result["enrolled"]} of {result["students"]} students, '
+          f'{result["goodput"]["per_second"]}/s over '
+          f'{result["goodput"]["seconds"]}s')
+    print(f'violations: {len(result["violations"])}')
+    for violation in result['violations']:
+        print(f'  {violation}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Memory and mapping throughput of thesis rows read back from Neo4j.
+
+A synthetic result of --theses records ({'t': node properties}, the shape
+of a py2neo cursor) is mapped in several ways:
+
+- dict: dict(record['t']), what the list endpoints do,
+- object: a plain class keeping the properties in its __dict__, like the
+  models did before __slots__,
+- init: Thesis(...) through __init__, with validation, a new id and
+  timestamps,
+- model: db.mapper.map_models, Thesis.from_record in slots,
+- tuple: db.mapper.map_tuples of all the model fields.
+
+For every way the best of --repeat runs is reported in records per second,
+with the memory held by the mapped list (tracemalloc, the property values
+themselves are shared with the records and not counted).
+
+Usage:
+    python -m benchmarks.models --theses 100000
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from typing import Callable
+
+from db.db_neo4j import Thesis, ThesisStatus
+from db.mapper import map_models, map_tuples
+
+
+class DictThesis:
+    def __init__(self, properties: dict):
+        self.__dict__.update(properties)
+
+
+def make_records(count: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    now = time.time()
+    records = []
+    for number in range(count):
+        properties = {
+            'id': f'{rnd.getrandbits(128):032x}',
+            'thesis_name': f'Thesis {number}',
+            'description': f'Research topic number {number}.',
+            'year': rnd.randint(1, 6), 'difficulty': rnd.randint(1, 5),
+            'creation_ts': now - rnd.randint(0, 90 * 24 * 3600),
+            'status': ThesisStatus.CREATED}
+        properties['update_ts'] = properties['creation_ts']
+        if rnd.random() < 0.3:
+            properties['student_id'] = f'{rnd.getrandbits(96):024x}'
+            properties['student_enrol_ts'] = now
+            properties['status'] = ThesisStatus.ENROLLED
+        records.append({'t': properties})
+    return records
+
+
+def from_init(records: list) -> list:
+    theses = []
+    for record in records:
+        node = record['t']
+        theses.append(Thesis(
+            node['thesis_name'], node['description'], node['year'],
+            node['difficulty'], score=node.get('score'),
+            creation_ts=node.get('creation_ts'),
+            student_enrol_ts=node.get('student_enrol_ts'),
+            update_ts=node.get('update_ts'),
+            student_id=node.get('student_id')))
+    return theses
+
+
+MAPPINGS = {
+    'dict': lambda records: [dict(record['t']) for record in records],
+    'object': lambda records: [DictThesis(record['t']) for record in records],
+    'init': from_init,
+    'model': lambda records: map_models(records, Thesis),
+    'tuple': lambda records: map_tuples(records, Thesis.FIELDS),
+}
+
+
+def measure(mapping: Callable[[list], list], records: list,
+            repeat: int) -> dict:
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        mapping(records)
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = mapping(records)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return {'seconds': round(best, 4),
+            'records_per_second': round(len(records) / best),
+            'bytes': held, 'bytes_per_record': round(held / len(records), 1)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--theses', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mapping', action='append', choices=list(MAPPINGS),
+                        help='mappings to run, by default all')
+    parser.add_argument('--output', help='write the result as JSON')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    records = make_records(args.theses)
+    result = {name: measure(MAPPINGS[name], records, args.repeat)
+              for name in args.mapping or MAPPINGS}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    for name, stats in result.items():
+        print(f'{name:8} {stats["records_per_second"]:10} rec/s  '
+              f'{stats["bytes"] / 2 ** 20:8.1f} MB  '
+              f'{stats["bytes_per_record"]:7.1f} B/rec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Endpoint benchmarks of the app on top of local stand-ins (see
+benchmarks.standins).
+
+Every scenario sends requests through the Flask test client to the app
+created by src.app.create_app, so routing, sessions, caches and the data
+layer are all measured; only the databases are replaced. Results are
+written as JSON, compare two runs to spot regressions between commits.
+
+Usage:
+    python -m benchmarks.run                        # all scenarios
+    python -m benchmarks.run --scenario catalogue --requests 1000
+    python -m benchmarks.run --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, List
+
+import create_test_database
+from benchmarks.standins import create_clients, round_trips
+from db.admission import RateLimiter
+from create_test_database import PASSWORD
+from src.app import create_app
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'results')
+
+DATASET = {'seed': 0, 'departments': 4, 'groups_per_department': 4,
+           'students_per_group': 50, 'instructors_per_department': 5,
+           'theses_per_instructor': 10, 'load_min': 10, 'load_max': 20,
+           'enrolled_share': 0.1}
+
+
+class Bench:
+    def __init__(self, requests: int, dataset: dict = DATASET):
+        self.requests = requests
+        self.rnd = random.Random(dataset['seed'])
+        self.clients = create_clients()
+        self.app = create_app(self.clients, warm_up=False)
+        # one test client stands for many users, only the pools apply
+        self.app.extensions['rate_limiter'] = RateLimiter(1e9, 10 ** 9, 1)
+        self.data = create_test_database.generate_university(**dataset)
+        create_test_database.write_university(
+            self.data, self.clients.mongo, self.clients.graph)
+
+        self.students = [user for user in self.data['users']
+                         if user['role'] == 'student']
+        self.instructors = [user for user in self.data['users']
+                            if user['role'] == 'instructor']
+        self.added = []  # (instructor, thesis_name) created by "add"
+
+    def login(self, user: dict):
+        client = self.app.test_client()
+        response = client.post('/login', data={'email': user['email'],
+                                               'password': PASSWORD})
+        assert response.status_code == 302, response.status_code
+        return client
+
+    def measure(self, calls: List[Callable]) -> dict:
+        """
+        :param calls: each sends one request and returns the response
+        """
+        latencies = []
+        statuses = Counter()
+        before = round_trips(self.clients)
+        started = time.perf_counter()
+        for call in calls:
+            request_started = time.perf_counter()
+            response = call()
+            latencies.append(time.perf_counter() - request_started)
+            statuses[str(response.status_code)] += 1
+        elapsed = time.perf_counter() - started
+        after = round_trips(self.clients)
+        return summarize(latencies, elapsed, statuses, {
+            store: (after[store] - before[store]) / max(len(calls), 1)
+            for store in after})
+
+
+def scenario_login(bench: Bench) -> dict:
+    users = bench.rnd.sample(bench.students,
+                             min(bench.requests, len(bench.students)))
+    clients = [bench.app.test_client() for _ in users]
+    return bench.measure([
+        lambda client=client, user=user: client.post('/login', data={
+            'email': user['email'], 'password': PASSWORD})
+        for client, user in zip(clients, users)])
+
+
+def scenario_catalogue(bench: Bench) -> dict:
+    client = bench.login(bench.rnd.choice(bench.students))
+    params = []
+    for _ in range(bench.requests):
+        year = bench.rnd.choice(['', '1', '2', '3', '4', '5', '6'])
+        params.append(f'only_unassigned=1&page_size=20&year={year}')
+    return bench.measure([lambda query=query: client.get(f'/api/thesis?{query}')
+                          for query in params])
+
+
+def scenario_enrol(bench: Bench) -> dict:
+    free = [row['props']['thesis_name'] for row in bench.data['theses']
+            if not row['props'].get('student_id')]
+    students = [user for user in bench.students if not user.get('thesis_id')]
+    count = min(bench.requests, len(free), len(students))
+    clients = [bench.login(user) for user in students[:count]]
+    names = bench.rnd.sample(free, count)
+    return bench.measure([
+        lambda client=client, name=name: client.post(
+            '/api/thesis/enrol', json={'thesis_name': name})
+        for client, name in zip(clients, names)])
+
+
+def scenario_add(bench: Bench) -> dict:
+    instructor = bench.rnd.choice(bench.instructors)
+    client = bench.login(instructor)
+    names = [f'Benchmark thesis {n}' for n in range(bench.requests)]
+    bench.added = [(client, instructor, name) for name in names]
+    return bench.measure([
+        lambda name=name: client.post('/api/thesis/add', json={
+            'thesis_name': name, 'description': 'Added by the benchmark',
+            'year': 4, 'difficulty': 3, 'tags': 'benchmark, tag-1'})
+        for name in names])
+
+
+def scenario_delete(bench: Bench) -> dict:
+    if not bench.added:
+        scenario_add(bench)
+    return bench.measure([
+        lambda client=client, instructor=instructor, name=name: client.post(
+            '/api/thesis/drop_by_id', json={
+                'instructor_id': str(instructor['_id']), 'thesis_id': name})
+        for client, instructor, name in bench.added])
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'catalogue': scenario_catalogue,
+    'enrol': scenario_enrol,
+    'add': scenario_add,
+    'delete': scenario_delete,
+}
+
+
+def percentile(values: list, share: float) -> float:
+    """
+    nearest-rank percentile of sorted values
+    """
+    if not values:
+        return 0.0
+    index = max(int(round(share * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies: list, elapsed: float, statuses: Counter,
+              trips: dict) -> dict:
+    latencies = sorted(latencies)
+    milliseconds = {
+        'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+    return {
+        'requests': len(latencies),
+        'statuses': dict(statuses),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {key: round(value * 1000, 3)
+                       for key, value in milliseconds.items()},
+        'round_trips': {store: round(value, 2)
+                        for store, value in trips.items()},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(scenarios: List[str], requests: int) -> dict:
+    bench = Bench(requests)
+    return {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'dataset': DATASET,
+        'requests': requests,
+        'scenarios': {name: SCENARIOS[name](bench) for name in scenarios},
+    }
+
+
+def compare(base: dict, current: dict) -> List[str]:
+    """
+    :return: lines with the change of every metric between two runs
+    """
+    lines = [f'{base["commit"]} -> {current["commit"]}']
+    for name, result in current['scenarios'].items():
+        old = base['scenarios'].get(name)
+        if old is None:
+            lines.append(f'{name}: no base result')
+            continue
+        metrics = [('p50', old['latency_ms']['p50'], result['latency_ms']['p50']),
+                   ('p99', old['latency_ms']['p99'], result['latency_ms']['p99']),
+                   ('rps', old['throughput'], result['throughput'])]
+        metrics += [(f'{store} trips', old['round_trips'].get(store, 0), value)
+                    for store, value in result['round_trips'].items()]
+        lines.append(f'{name}: ' + ', '.join(
+            f'{metric} {before} -> {after} ({change(before, after)})'
+            for metric, before, after in metrics))
+    return lines
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return 'new' if after else '='
+    return f'{(after - before) / before * 100:+.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Endpoint benchmarks')
+    parser.add_argument('--scenario', action='append',
+                        choices=list(SCENARIOS),
+                        help='scenario to run, may be repeated, default all')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--output', help='result file, default '
+                        'benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', help='earlier result file to compare to')
+    args = parser.parse_args()
+
+    result = run(args.scenario or list(SCENARIOS), args.requests)
+    output = args.output or os.path.join(RESULTS_DIR,
+                                         f'{result["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+    for name, scenario in result['scenarios'].items():
+        latency = scenario['latency_ms']
+        print(f'{name:10} {scenario["requests"]:6} req '
+              f'{scenario["throughput"]:9.1f} req/s  p50 {latency["p50"]:.2f}ms'
+              f'  p99 {latency["p99"]:.2f}ms  round trips '
+              f'{scenario["round_trips"]}  {scenario["statuses"]}')
+    print(f'written to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            print('\n'.join(compare(json.load(f), result)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+"""
+Local stand-ins for mongodb and Neo4j used by the benchmarks.
+
+mongodb is replaced by mongomock behind the real DatabaseClient. Neo4j is
+replaced by InMemoryGraph below: it answers the named query templates of
+db.queries from Python dicts, so the real GraphDatabaseClient and model
+classes run unchanged on top of it. Only the templates used by the app, the
+bulk import and the test data generator are implemented; any other query
+raises NotImplementedError.
+
+Both stand-ins count round trips, so a benchmark can report how many
+database calls every request makes. They are safe to call from many
+threads: every call runs under the lock of its store, after an optional
+sleep standing for the network and server latency.
+"""
+import threading
+import time
+from bisect import bisect_right, insort, bisect_left
+from typing import Optional
+
+import mongomock
+
+from db import metrics, queries
+from db.clients import Clients
+from db.db_mongo import DatabaseClient
+from db.db_neo4j import GraphDatabaseClient, EnrolState
+
+
+class Cursor:
+    """
+    the part of the py2neo cursor used by the data layer
+    """
+
+    def __init__(self, records: list):
+        self.records = records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def data(self) -> list:
+        return self.records
+
+    def evaluate(self):
+        if not self.records:
+            return None
+        return next(iter(self.records[0].values()))
+
+
+class Transaction:
+    def __init__(self, graph: 'InMemoryGraph'):
+        self.graph = graph
+        self._finished = False
+
+    def run(self, text: str, parameters: Optional[dict] = None) -> Cursor:
+        return self.graph.run(text, parameters)
+
+    def commit(self):
+        self._finished = True
+
+    def rollback(self):
+        self._finished = True
+
+    def finished(self) -> bool:
+        return self._finished
+
+
+class InMemoryGraph:
+    def __init__(self, latency: float = 0.0):
+        """
+        :param latency: seconds every query sleeps before it runs
+        """
+        self.latency = latency
+        self._lock = threading.RLock()
+        self.round_trips = 0
+        self.theses = {}  # thesis_name -> props
+        self.thesis_names = []  # sorted, for pages
+        self.thesis_instructor = {}  # thesis_name -> instructor id
+        self.thesis_tags = {}  # thesis_name -> tag names
+        self.tombstones = {}  # thesis_name -> (instructor id, deletion ts)
+        self.instructors = {}  # id -> props
+        self.instructor_department = {}  # id -> department id
+        self.groups = {}  # id -> props
+        self.group_department = {}  # id -> department id
+        self.departments = {}  # department_id -> props
+
+    def begin(self) -> Transaction:
+        return Transaction(self)
+
+    def run(self, text: str, parameters: Optional[dict] = None) -> Cursor:
+        name = queries.name_of(text)
+        # variants of one query ("thesis.page:year,tag") share the handler
+        handler = getattr(self, 'q_' + (name or '').partition(':')[0]
+                          .replace('.', '_'), None)
+        if handler is None:
+            raise NotImplementedError(f'query "{name}" has no stand-in')
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.round_trips += 1
+            return Cursor(handler(**(parameters or {})))
+
+    # helpers
+
+    def _add_thesis(self, instructor_id: str, props: dict, tags: list):
+        name = props['thesis_name']
+        self.theses[name] = dict(props)
+        insort(self.thesis_names, name)
+        self.thesis_instructor[name] = instructor_id
+        self.thesis_tags[name] = list(tags)
+        instructor = self.instructors[instructor_id]
+        instructor['theses_offered'] = instructor.get('theses_offered', 0) + 1
+        if props.get('student_id'):
+            instructor['theses_enrolled'] = \
+                instructor.get('theses_enrolled', 0) + 1
+
+    def _delete_thesis(self, name: str):
+        thesis = self.theses.pop(name)
+        del self.thesis_names[bisect_left(self.thesis_names, name)]
+        instructor = self.instructors[self.thesis_instructor.pop(name)]
+        del self.thesis_tags[name]
+        instructor['theses_offered'] -= 1
+        if thesis.get('student_id'):
+            instructor['theses_enrolled'] -= 1
+
+    # query templates
+
+    def q_ping(self):
+        return [{'1': 1}]
+
+    def q_thesis_by_name(self, thesis_name):
+        thesis = self.theses.get(thesis_name)
+        return [{'t': dict(thesis)}] if thesis else []
+
+    def q_thesis_all(self):
+        return [{'t': dict(thesis)} for thesis in self.theses.values()]
+
+    def q_thesis_all_with_tags(self):
+        return [{'t': dict(thesis), 'tags': list(self.thesis_tags[name])}
+                for name, thesis in self.theses.items()]
+
+    def q_thesis_create(self, instructor_id, props, tags):
+        if instructor_id not in self.instructors:
+            return []
+        self._add_thesis(instructor_id, props, tags)
+        return [{'t': dict(self.theses[props['thesis_name']])}]
+
+    def q_thesis_enrol(self, thesis_name, student_id, ts, status):
+        thesis = self.theses.get(thesis_name)
+        if thesis is None:
+            return []
+        instructor = self.instructors[self.thesis_instructor[thesis_name]]
+        if thesis.get('student_id') == student_id:
+            state = EnrolState.ENROLLED
+        elif thesis.get('student_id'):
+            state = EnrolState.TAKEN
+        elif instructor.get('load') is not None and \
+                instructor.get('theses_enrolled', 0) >= instructor['load']:
+            state = EnrolState.FULL
+        else:
+            state = EnrolState.FREE
+            thesis.update(student_id=student_id, student_enrol_ts=ts,
+                          update_ts=ts, status=status)
+            instructor['theses_enrolled'] = \
+                instructor.get('theses_enrolled', 0) + 1
+        return [{'state': state}]
+
+    def q_matching_assign(self, rows, ts, status):
+        claimed = []
+        for row in rows:
+            thesis = self.theses.get(row['thesis_name'])
+            if thesis is None or thesis.get('student_id'):
+                continue
+            instructor = self.instructors[
+                self.thesis_instructor[row['thesis_name']]]
+            if instructor.get('load') is not None and \
+                    instructor.get('theses_enrolled', 0) >= instructor['load']:
+                continue
+            thesis.update(student_id=row['student_id'], student_enrol_ts=ts,
+                          update_ts=ts, status=status)
+            instructor['theses_enrolled'] = \
+                instructor.get('theses_enrolled', 0) + 1
+            claimed.append({'student_id': row['student_id']})
+        return claimed
+
+    def q_matching_unassign(self, rows, ts, status):
+        for row in rows:
+            if self.theses[row['thesis_name']].get('student_id') == \
+                    row['student_id']:
+                self.q_thesis_release(row['thesis_name'], row['student_id'],
+                                      ts, status)
+        return []
+
+    def q_thesis_release(self, thesis_name, student_id, ts, status):
+        thesis = self.theses.get(thesis_name)
+        if thesis is None or thesis.get('student_id') != student_id:
+            return [{'count(*)': 0}]
+        thesis.pop('student_id')
+        thesis.pop('student_enrol_ts', None)
+        thesis.update(status=status, update_ts=ts)
+        self.instructors[self.thesis_instructor[thesis_name]][
+            'theses_enrolled'] -= 1
+        return [{'count(*)': 1}]
+
+    def q_thesis_page(self, limit, cursor=None, thesis_name=None, year=None,
+                      difficulty_min=None, difficulty_max=None,
+                      only_unassigned=False, instructor_id=None, department_id=None, tag=None):
+        start = bisect_right(self.thesis_names, cursor) if cursor else 0
+        result = []
+        for name in self.thesis_names[start:]:
+            thesis = self.theses[name]
+            instructor = self.thesis_instructor[name]
+            # thesis.page matches the instructor of the thesis
+            if instructor is None or \
+                    (thesis_name is not None and name != thesis_name) or \
+                    (year is not None and thesis.get('year') != year) or \
+                    (difficulty_min is not None and
+                     thesis.get('difficulty', 0) < difficulty_min) or \
+                    (difficulty_max is not None and
+                     thesis.get('difficulty', 0) > difficulty_max) or \
+                    (only_unassigned and thesis.get('student_id')) or \
+                    (instructor_id is not None and
+                     instructor != instructor_id) or \
+                    (department_id is not None and department_id !=
+                     self.instructor_department.get(instructor)) or \
+                    (tag is not None and tag not in self.thesis_tags[name]):
+                continue
+            result.append({'t': dict(thesis), 'instructor_id': instructor})
+            if len(result) >= limit:
+                break
+        return result
+
+    def q_instructor_by_id(self, id):
+        instructor = self.instructors.get(id)
+        return [{'i': dict(instructor)}] if instructor else []
+
+    def q_instructor_create(self, department_id, props):
+        if department_id not in self.departments:
+            return []
+        self.instructors[props['id']] = dict(props)
+        self.instructor_department[props['id']] = department_id
+        return [{'i': dict(props)}]
+
+    def q_instructor_theses(self, id):
+        return [{'t': dict(self.theses[name])}
+                for name, instructor in self.thesis_instructor.items()
+                if instructor == id]
+
+    def q_instructor_counters(self, id):
+        instructor = self.instructors.get(id)
+        if instructor is None:
+            return []
+        return [{'load': instructor.get('load'),
+                 'theses_offered': instructor.get('theses_offered', 0),
+                 'theses_enrolled': instructor.get('theses_enrolled', 0)}]
+
+    def q_instructor_delete_thesis(self, thesis_name, instructor_id, ts,
+                                   expired):
+        deleted = self.thesis_instructor.get(thesis_name) == instructor_id
+        if deleted:
+            self._delete_thesis(thesis_name)
+            self.tombstones[thesis_name] = (instructor_id, ts)
+        for name, (_, deleted_ts) in list(self.tombstones.items()):
+            if deleted_ts < expired:
+                del self.tombstones[name]
+        return [{'deleted': int(deleted)}]
+
+    def q_counters_instructor_ids(self):
+        return [{'id': id} for id in sorted(self.instructors)]
+
+    def q_counters_rebuild(self, ids, check):
+        result = []
+        for id in ids:
+            instructor = self.instructors.get(id)
+            if instructor is None:
+                continue
+            names = [name for name, instructor_id
+                     in self.thesis_instructor.items() if instructor_id == id]
+            offered = len(names)
+            enrolled = sum(1 for name in names
+                           if self.theses[name].get('student_id'))
+            drifted = instructor.get('theses_offered', 0) != offered or \
+                instructor.get('theses_enrolled', 0) != enrolled
+            if drifted and not check:
+                instructor.update(theses_offered=offered,
+                                  theses_enrolled=enrolled)
+            result.append({'id': id, 'drifted': drifted})
+        return result
+
+    def q_group_by_id(self, id):
+        group = self.groups.get(id)
+        return [{'g': dict(group)}] if group else []
+
+    def q_group_create(self, department_id, props):
+        if department_id not in self.departments:
+            return []
+        self.groups[props['id']] = dict(props)
+        self.group_department[props['id']] = department_id
+        return [{'g': dict(props)}]
+
+    def q_group_years(self):
+        return [{'id': group_id, 'year': group.get('year')}
+                for group_id, group in self.groups.items()]
+
+    def q_department_by_id(self, department_id):
+        department = self.departments.get(department_id)
+        return [{'d': dict(department)}] if department else []
+
+    def q_department_create(self, props):
+        self.departments[props['department_id']] = dict(props)
+        return [{'d': dict(props)}]
+
+    def q_bulk_check_theses(self, rows):
+        return [{'index': row['index'],
+                 'has_instructor': row['instructor_id'] in self.instructors,
+                 'thesis_exists': row['props']['thesis_name'] in self.theses}
+                for row in rows]
+
+    def q_bulk_create_theses(self, rows):
+        result = []
+        for row in rows:
+            if row['instructor_id'] in self.instructors:
+                self._add_thesis(row['instructor_id'], row['props'],
+                                 row['tags'])
+                result.append({'index': row['index']})
+        return result
+
+    def _thesis_row(self, name: str) -> dict:
+        return {'t': dict(self.theses[name]),
+                'instructor_id': self.thesis_instructor[name],
+                'tags': list(self.thesis_tags[name])}
+
+    def q_thesis_changed(self, since):
+        return [self._thesis_row(name) for name, thesis in self.theses.items()
+                if (thesis.get('update_ts') or 0) >= since]
+
+    def q_thesis_deleted(self, since):
+        return [{'thesis_name': name, 'instructor_id': instructor_id}
+                for name, (instructor_id, ts) in self.tombstones.items()
+                if ts >= since]
+
+    def q_replica_theses_all(self):
+        return [self._thesis_row(name) for name in self.theses]
+
+    def q_replica_instructors(self):
+        return [{'i': dict(instructor),
+                 'department_id': self.instructor_department.get(id)}
+                for id, instructor in self.instructors.items()]
+
+    def q_replica_groups(self):
+        return [{'g': dict(group),
+                 'department_id': self.group_department.get(id)}
+                for id, group in self.groups.items()]
+
+    def q_replica_departments(self):
+        return [{'d': dict(department)}
+                for department in self.departments.values()]
+
+    def q_generator_create_departments(self, rows):
+        for row in rows:
+            self.q_department_create(row)
+        return []
+
+    def q_generator_create_groups(self, rows):
+        for row in rows:
+            self.q_group_create(row['department_id'], row['props'])
+        return []
+
+    def q_generator_create_instructors(self, rows):
+        for row in rows:
+            self.q_instructor_create(row['department_id'], row['props'])
+        return []
+
+    def q_generator_delete_all(self):
+        self.__init__(self.latency)
+        return []
+
+
+class CountingCollection:
+    """
+    proxy of a mongodb collection counting the calls made through it
+    """
+
+    def __init__(self, collection, latency: float = 0.0):
+        self.collection = collection
+        self.latency = latency
+        self.round_trips = 0
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                self.round_trips += 1
+                return attribute(*args, **kwargs)
+        return call
+
+
+def create_graph_client(graph: Optional[InMemoryGraph] = None,
+                        latency: float = 0.0) -> GraphDatabaseClient:
+    client = GraphDatabaseClient.__new__(GraphDatabaseClient)
+    client.graph = metrics.InstrumentedGraph(graph or InMemoryGraph(latency))
+    return client
+
+
+def create_mongo_client(latency: float = 0.0) -> DatabaseClient:
+    client = DatabaseClient(mongo_client=mongomock.MongoClient())
+    client.users = CountingCollection(client.users, latency)
+    return client
+
+
+def create_clients(latency: float = 0.0) -> Clients:
+    """
+    :param latency: seconds every database call takes on top of its work
+    :return: Clients on top of fresh, empty stand-ins
+    """
+    return Clients(mongo_factory=lambda: create_mongo_client(latency),
+                   graph_factory=lambda: create_graph_client(latency=latency))
+
+
+def round_trips(clients: Clients) -> dict:
+    return {'mongo': clients.mongo.users.round_trips,
+            'neo4j': clients.graph.graph.round_trips}
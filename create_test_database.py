@@ -1,47 +1,248 @@
+"""
+Synthetic university generator for local and scale testing.
+
+Writes consistent data into the mongodb `users` collection and the Neo4j
+graph: departments, groups, students, instructors, theses with tags and
+pre-existing enrolments. All writes are batched (insert_many / UNWIND).
+
+Usage:
+    python create_test_database.py                       # small dataset
+    python create_test_database.py --students-per-group 500 --seed 7
+    python create_test_database.py --clean ...           # wipe both stores first
+
+Every generated student has the password `qwerty`, emails are
+student<N>@test.com and instructor<N>@test.com.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from db import queries
+from db.bulk import CREATE_QUERY as CREATE_THESES_QUERY
 from db.db_mongo import DatabaseClient
-from db.db_neo4j import GraphDatabaseClient, Department, Group, UniversityYear, \
-    Degree, Instructor, Thesis
-
-neo_client = GraphDatabaseClient()
-mongo_client = DatabaseClient()
-
-
-def create_user(email: str, password: str, role: str, first_name: str,
-                middle_name: str, last_name: str, group_id: str = '') -> str:
-    new_user = {
-        'email': email, 'password': password, 'role': role,
-        'first_name': first_name, 'middle_name': middle_name,
-        'last_name': last_name, 'thesis_is': ''}
-    if group_id:
-        new_user['group_id'] = group_id
-    return mongo_client.db.users.insert(new_user)
-
-
-# departments
-department = Department('Компютерні науки', 'Інформатика')
-department.create(neo_client)
-
-group = Group('КІ-2', UniversityYear.BACHELOR_SECOND, Degree.BACHELOR)
-group.create(neo_client, department.department_id)
-
-create_user('test_user1@test.com', 'qwerty', 'student', 'Test', 'Test', 'Test', group.id)
-create_user('test_user2@test.com', 'qwerty123', 'student', 'Test123', 'Test123', 'Test123', group.id)
-user_id = create_user('admin_1@test.com', 'qwerty123', 'instructor', 'Instructor1', 'Test123', 'Test123')
-instructor = Instructor(str(user_id), Degree.DOCTOR, 12, '123-c')
-instructor.create(neo_client, department.department_id)
-thesis = Thesis('Lorem Ipsum', 'Some random test here is the most beutiful day in deep learning', UniversityYear.BACHELOR_SECOND, 3)
-instructor.add_thesis(neo_client, thesis, 'deep-learning, statistics')
-thesis = Thesis('Hello world in Java', 'Please create the most spiky hello world in Java', UniversityYear.BACHELOR_THIRD, 5)
-instructor.add_thesis(neo_client, thesis, tags='java')
-
-department = Department('Програмна інженерія', 'Інформатика')
-department.create(neo_client)
-group = Group('ПІ-4', UniversityYear.BACHELOR_FOURTH, Degree.BACHELOR)
-group.create(neo_client, department.department_id)
-create_user('test_user3@test.com', 'qwerty', 'student', 'Test', 'Test', 'Test', group.id)
-create_user('test_user4@test.com', '123456', 'student', 'Snezhanna', 'Mykolayvna', 'Mohyla', group.id)
-user_id = str(create_user('instructor@test.com', 'qwerty123', 'instructor', 'Instructor2', 'Test123', 'Test123'))
-instructor = Instructor(user_id, Degree.PROFESSOR, 10, '201')
-instructor.create(neo_client, department.department_id)
-thesis = Thesis('Lorem Ipsum in London', 'Some random tests here is the most beutiful day in deep learning', UniversityYear.BACHELOR_SECOND, 4)
-instructor.add_thesis(neo_client, thesis, 'deep-learning, statistics')
+from db.db_neo4j import GraphDatabaseClient, Department, Group, Degree, \
+    Instructor, Thesis, ThesisStatus, Relations
+
+PASSWORD = 'qwerty'
+MONGO_BATCH_SIZE = 10000
+NEO4J_BATCH_SIZE = 2000
+
+FIRST_NAMES = ['Олена', 'Андрій', 'Марія', 'Тарас', 'Ірина', 'Олег', 'Anna',
+               'John', 'Sofia', 'Mark', 'Daria', 'Petro']
+LAST_NAMES = ['Коваленко', 'Шевченко', 'Бондар', 'Мельник', 'Ткаченко',
+              'Smith', 'Kravets', 'Lysenko', 'Moroz', 'Savchenko']
+DEGREES = [Degree.CANDIDATE, Degree.DOCTOR, Degree.PROFESSOR]
+TOPIC_WORDS = ['deep learning', 'graph databases', 'compilers', 'statistics',
+               'distributed systems', 'computer vision', 'cryptography',
+               'web services', 'optimisation', 'robotics', 'NLP', 'java']
+
+CREATE_DEPARTMENTS_QUERY = queries.register('generator.create_departments', f'''
+    UNWIND $rows AS row
+    CREATE (d:{Department.node_type})
+    SET d = row
+''')
+
+CREATE_GROUPS_QUERY = queries.register('generator.create_groups', f'''
+    UNWIND $rows AS row
+    MATCH (d:{Department.node_type} {{department_id: row.department_id}})
+    CREATE (g:{Group.node_type})
+    SET g = row.props
+    CREATE (d)-[:{Relations.DEPARTMENT_GROUP}]->(g),
+           (g)-[:{Relations.GROUP_DEPARTMENT}]->(d)
+''')
+
+CREATE_INSTRUCTORS_QUERY = queries.register('generator.create_instructors', f'''
+    UNWIND $rows AS row
+    MATCH (d:{Department.node_type} {{department_id: row.department_id}})
+    CREATE (i:{Instructor.node_type})
+    SET i = row.props
+    CREATE (d)-[:{Relations.DEPARTMENT_INSTRUCTOR}]->(i),
+           (i)-[:{Relations.INSTRUCTOR_DEPARTMENT}]->(d)
+''')
+
+DELETE_ALL_QUERY = queries.register('generator.delete_all', '''
+    MATCH (n)
+    DETACH DELETE n
+''')
+
+
+def batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def zipf_weights(n: int, exponent: float) -> list:
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def seeded_uuid(rnd: random.Random) -> str:
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def make_user(rnd: random.Random, number: int, role: str, **fields) -> dict:
+    user = {
+        '_id': ObjectId(rnd.getrandbits(96).to_bytes(12, 'big')),
+        'email': f'{role}{number}@test.com', 'password': PASSWORD,
+        'role': role,
+        'first_name': rnd.choice(FIRST_NAMES),
+        'middle_name': rnd.choice(FIRST_NAMES),
+        'last_name': rnd.choice(LAST_NAMES),
+    }
+    user.update(fields)
+    return user
+
+
+def generate_university(seed: int = 0, departments: int = 2,
+                        groups_per_department: int = 2,
+                        students_per_group: int = 10,
+                        instructors_per_department: int = 3,
+                        theses_per_instructor: int = 4,
+                        load_min: int = 5, load_max: int = 12,
+                        tag_vocabulary: int = 50, tags_per_thesis: int = 3,
+                        zipf_exponent: float = 1.1,
+                        enrolled_share: float = 0.1) -> dict:
+    """
+    build the whole dataset in memory, nothing is written here
+    :return: dict with lists of departments, groups, instructors, theses
+    (UNWIND rows) and users (mongodb documents)
+    """
+    rnd = random.Random(seed)
+    tags = [f'tag-{n}' for n in range(tag_vocabulary)]
+    tag_weights = zipf_weights(tag_vocabulary, zipf_exponent)
+    now = datetime.now().timestamp()
+
+    data = {'departments': [], 'groups': [], 'instructors': [],
+            'theses': [], 'users': []}
+    students = []
+    student_number = instructor_number = thesis_number = 0
+    for d in range(departments):
+        department = Department(f'Department {d}', f'Faculty {d // 4}')
+        department.department_id = seeded_uuid(rnd)
+        data['departments'].append(department.to_dict())
+
+        for g in range(groups_per_department):
+            year = rnd.randint(1, 6)
+            degree = Degree.BACHELOR if year <= 4 else Degree.MASTER
+            group = Group(f'G-{d}-{g}', year, degree)
+            group.id = seeded_uuid(rnd)
+            data['groups'].append({'department_id': department.department_id,
+                                   'props': group.to_dict()})
+            for _ in range(students_per_group):
+                student_number += 1
+                student = make_user(rnd, student_number, 'student',
+                                    group_id=group.id,
+                                    interests=sorted(set(rnd.choices(
+                                        tags, tag_weights, k=3))))
+                students.append((student, year))
+                data['users'].append(student)
+
+        for _ in range(instructors_per_department):
+            instructor_number += 1
+            user = make_user(rnd, instructor_number, 'instructor')
+            data['users'].append(user)
+            instructor = Instructor(str(user['_id']), rnd.choice(DEGREES),
+                                    rnd.randint(load_min, load_max),
+                                    f'{rnd.randint(1, 4)}{rnd.randint(1, 40):02}')
+            data['instructors'].append({
+                'department_id': department.department_id,
+                'props': instructor.to_dict()})
+
+            for _ in range(theses_per_instructor):
+                thesis_number += 1
+                words = rnd.sample(TOPIC_WORDS, 2)
+                thesis = Thesis(
+                    f'Thesis {thesis_number}: {words[0]} for {words[1]}',
+                    f'Research on {words[0]} applied to {words[1]}.',
+                    rnd.randint(1, 6), rnd.randint(1, 5),
+                    creation_ts=now - rnd.randint(0, 90 * 24 * 3600))
+                thesis.id = seeded_uuid(rnd)
+                data['theses'].append({
+                    'index': thesis_number, 'instructor_id': instructor.id,
+                    'props': thesis.to_dict(),
+                    'tags': sorted(set(rnd.choices(tags, tag_weights,
+                                                   k=tags_per_thesis)))})
+
+    free_by_year = {}
+    for row in data['theses']:
+        free_by_year.setdefault(row['props']['year'], []).append(row)
+    for lst in free_by_year.values():
+        rnd.shuffle(lst)
+    # an instructor supervises at most load students (see thesis.enrol)
+    places = {row['props']['id']: row['props'].get('load', 0)
+              for row in data['instructors']}
+    for student, year in students:
+        if rnd.random() >= enrolled_share or not free_by_year.get(year):
+            continue
+        row = free_by_year[year].pop()
+        if places[row['instructor_id']] < 1:
+            continue
+        places[row['instructor_id']] -= 1
+        props = row['props']
+        props['student_id'] = str(student['_id'])
+        props['student_enrol_ts'] = props['update_ts'] = now
+        props['status'] = ThesisStatus.ENROLLED
+        student['thesis_id'] = props['thesis_name']
+    return data
+
+
+def write_university(data: dict, mongo_client: DatabaseClient,
+                     neo_client: GraphDatabaseClient):
+    for batch in batches(data['users'], MONGO_BATCH_SIZE):
+        mongo_client.users.insert_many(batch, ordered=False)
+
+    for query, rows in ((CREATE_DEPARTMENTS_QUERY, data['departments']),
+                        (CREATE_GROUPS_QUERY, data['groups']),
+                        (CREATE_INSTRUCTORS_QUERY, data['instructors']),
+                        (CREATE_THESES_QUERY, data['theses'])):
+        for batch in batches(rows, NEO4J_BATCH_SIZE):
+            neo_client.run_query(query, {'rows': batch})
+
+
+def clean(mongo_client: DatabaseClient, neo_client: GraphDatabaseClient):
+    mongo_client.users.delete_many({})
+    neo_client.run_query(DELETE_ALL_QUERY)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic university dataset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--departments', type=int, default=2)
+    parser.add_argument('--groups-per-department', type=int, default=2)
+    parser.add_argument('--students-per-group', type=int, default=10)
+    parser.add_argument('--instructors-per-department', type=int, default=3)
+    parser.add_argument('--theses-per-instructor', type=int, default=4)
+    parser.add_argument('--load-min', type=int, default=5)
+    parser.add_argument('--load-max', type=int, default=12)
+    parser.add_argument('--tag-vocabulary', type=int, default=50)
+    parser.add_argument('--tags-per-thesis', type=int, default=3)
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--enrolled-share', type=float, default=0.1,
+                        help='share of students already enrolled')
+    parser.add_argument('--clean', action='store_true',
+                        help='delete all users and graph nodes first')
+    args = vars(parser.parse_args())
+    do_clean = args.pop('clean')
+
+    mongo_client = DatabaseClient()
+    neo_client = GraphDatabaseClient()
+    if do_clean:
+        clean(mongo_client, neo_client)
+
+    started = time.perf_counter()
+    data = generate_university(**args)
+    generated = time.perf_counter()
+    write_university(data, mongo_client, neo_client)
+    written = time.perf_counter()
+
+    print(', '.join(f'{len(rows)} {name}' for name, rows in data.items()))
+    print(f'generated in {generated - started:.2f}s, '
+          f'written in {written - generated:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
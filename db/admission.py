@@ -0,0 +1,175 @@
+"""
+Admission control for request bursts, e.g. a whole department enrolling
+at Department.enrol_ts.
+
+Every pool serves at most `concurrency` requests at a time. Further requests
+wait in a bounded FIFO queue and get the slot of a finishing request in
+arrival order. A request is rejected with AdmissionRejectedException when
+the queue is full or after waiting max_wait seconds, so the load above
+capacity is shed at the door instead of piling up in Neo4j, and the
+admitted requests still finish in time. Per-user token buckets keep a single
+client from filling the queue.
+"""
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+from db import metrics
+from db.cache import LRUCache
+from db.exceptions import AdmissionRejectedException
+
+# weight of the latest request in the average service time
+SERVICE_TIME_WEIGHT = 0.1
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int, max_users: int,
+                 timer: Callable[[], float] = time.monotonic):
+        """
+        :param rate: tokens added per second
+        :param burst: size of the bucket
+        :param max_users: buckets kept, the least recently used are dropped
+        """
+        self.rate = rate
+        self.burst = burst
+        self.timer = timer
+        self.buckets = LRUCache(max_users)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """
+        take a token from the bucket of the key
+        :return: 0 if there was one, otherwise seconds until there is one
+        """
+        now = self.timer()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.burst, now)
+                self.buckets.set(key, bucket)
+            bucket.tokens = min(self.burst, bucket.tokens +
+                                (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0.0
+            return (1 - bucket.tokens) / self.rate
+
+
+class Waiter:
+    __slots__ = ('event', 'admitted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class AdmissionPool:
+    def __init__(self, name: str, concurrency: int, max_queue: int,
+                 max_wait: float, timer: Callable[[], float] = time.monotonic):
+        """
+        :param concurrency: requests served at the same time
+        :param max_queue: requests waiting at most, later ones are rejected
+        :param max_wait: seconds a request waits before it is rejected
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.timer = timer
+        self.active = 0
+        self.queue = deque()
+        self.service_time = 0.05  # seconds, moving average
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        """
+        wait for a slot
+        :return: position the request had in the queue, 0 if it was admitted
+        at once
+        :raise AdmissionRejectedException: the queue is full or the request
+        waited max_wait seconds
+        """
+        started = self.timer()
+        with self._lock:
+            if self.active < self.concurrency and not self.queue:
+                self.active += 1
+                self._update_gauges()
+                metrics.ADMISSION_WAIT.observe(0.0, self.name, 'admitted')
+                return 0
+            if len(self.queue) >= self.max_queue:
+                metrics.ADMISSION_WAIT.observe(0.0, self.name, 'queue_full')
+                raise AdmissionRejectedException(
+                    'Too many requests, try again later',
+                    self.retry_after(len(self.queue)))
+            waiter = Waiter()
+            self.queue.append(waiter)
+            position = len(self.queue)
+            self._update_gauges()
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            # the slot may have been handed over right after the timeout
+            if not waiter.admitted:
+                self.queue.remove(waiter)
+                self._update_gauges()
+                metrics.ADMISSION_WAIT.observe(
+                    self.timer() - started, self.name, 'timeout')
+                raise AdmissionRejectedException(
+                    'Too many requests, try again later',
+                    self.retry_after(len(self.queue)))
+        metrics.ADMISSION_WAIT.observe(self.timer() - started, self.name,
+                                       'admitted')
+        return position
+
+    def release(self, service_time: float):
+        """
+        free the slot of a finished request, the first waiting request
+        takes it over
+        """
+        with self._lock:
+            self.service_time += SERVICE_TIME_WEIGHT * \
+                (service_time - self.service_time)
+            if self.queue:
+                waiter = self.queue.popleft()
+                waiter.admitted = True
+                waiter.event.set()
+            else:
+                self.active -= 1
+            self._update_gauges()
+
+    @contextmanager
+    def admit(self):
+        """
+        serve the block in a slot of the pool
+        :return: position in the queue, see acquire
+        """
+        position = self.acquire()
+        started = self.timer()
+        try:
+            yield position
+        finally:
+            self.release(self.timer() - started)
+
+    def retry_after(self, queued: int) -> float:
+        """
+        :return: estimated seconds until the queue has drained, with jitter
+        so rejected clients do not come back at the same instant
+        """
+        drain = (queued + 1) * self.service_time / self.concurrency
+        return max(drain, 1.0) * random.uniform(1.0, 1.5)
+
+    def _update_gauges(self):
+        metrics.ADMISSION_QUEUE_DEPTH.set(len(self.queue), self.name)
+        metrics.ADMISSION_IN_FLIGHT.set(self.active, self.name)
@@ -0,0 +1,212 @@
+"""
+Bulk thesis import with UNWIND-batched writes.
+
+Usage:
+    python -m db.bulk theses.csv [--batch-size 500] [--instructor-id ID]
+    python -m db.bulk theses.jsonl
+
+CSV files must have a header with the columns thesis_name, description,
+year, difficulty, tags (comma separated) and instructor_id; JSONL files hold
+one object with the same keys per line.
+"""
+import argparse
+import csv
+import json
+import time
+from typing import Iterable, List, Optional
+
+from db import events, queries
+from db.clients import relay_writes
+from db.db_mongo import DatabaseClient
+from db.db_neo4j import GraphDatabaseClient, Thesis, Instructor, Relations, \
+    parse_tags
+from db.exceptions import IncorrectArgumentException
+
+CHECK_QUERY = queries.register('bulk.check_theses', f'''
+    UNWIND $rows AS row
+    OPTIONAL MATCH (i:{Instructor.node_type} {{id: row.instructor_id}})
+    OPTIONAL MATCH (t:{Thesis.node_type} {{thesis_name: row.props.thesis_name}})
+    RETURN row.index AS index, i IS NOT NULL AS has_instructor,
+           t IS NOT NULL AS thesis_exists
+''')
+
+CREATE_QUERY = queries.register('bulk.create_theses', f'''
+    UNWIND $rows AS row
+    MATCH (i:{Instructor.node_type} {{id: row.instructor_id}})
+    CREATE (t:{Thesis.node_type})
+    SET t = row.props
+    CREATE (i)-[:{Relations.INSTRUCTOR_THESIS}]->(t),
+           (t)-[:{Relations.THESIS_INSTRUCTOR}]->(i)
+    SET i.theses_offered = coalesce(i.theses_offered, 0) + 1,
+        i.theses_enrolled = coalesce(i.theses_enrolled, 0) +
+            CASE WHEN t.student_id IS NULL THEN 0 ELSE 1 END
+    FOREACH (name IN row.tags |
+        MERGE (tag:Tag {{name: name}})
+        CREATE (t)-[:{Relations.THESIS_TAG}]->(tag),
+               (tag)-[:{Relations.TAG_THESIS}]->(t))
+    RETURN row.index AS index
+''')
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # list of (row number, message)
+        self.elapsed = 0.0
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': [{'row': row, 'error': message}
+                       for row, message in self.errors],
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def prepare_row(index: int, row: dict) -> dict:
+    """
+    validate one input row and convert it into UNWIND parameters
+    :raise IncorrectArgumentException: when the row is not a valid thesis
+    """
+    for key in ('thesis_name', 'instructor_id'):
+        if not row.get(key):
+            raise IncorrectArgumentException(f'"{key}" field is required')
+    try:
+        year = int(row.get('year'))
+        difficulty = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+        raise IncorrectArgumentException(
+            '"year" and "difficulty" fields must be integers')
+    thesis = Thesis(thesis_name=row['thesis_name'],
+                    description=row.get('description', ''),
+                    year=year, difficulty=difficulty)
+    return {
+        'index': index,
+        'instructor_id': str(row['instructor_id']),
+        'props': thesis.to_dict(),
+        'tags': parse_tags(row.get('tags')),
+    }
+
+
+def import_batch(client: GraphDatabaseClient, batch: List[dict],
+                 report: ImportReport) -> List[dict]:
+    """
+    write one batch in a single transaction
+    :return: imported rows
+    """
+    tx = client.graph.begin()
+    try:
+        checks = client.run_query(CHECK_QUERY, {'rows': batch}, tx).data()
+        rejected = set()
+        for check in checks:
+            if not check['has_instructor']:
+                report.errors.append((check['index'], 'instructor not found'))
+                rejected.add(check['index'])
+            elif check['thesis_exists']:
+                report.errors.append((check['index'], 'thesis already exists'))
+                rejected.add(check['index'])
+        rows = [row for row in batch if row['index'] not in rejected]
+        if rows:
+            client.run_query(CREATE_QUERY, {'rows': rows}, tx).data()
+        tx.commit()
+    except Exception as e:
+        if not tx.finished():
+            tx.rollback()
+        report.errors.extend((row['index'], f'batch failed: {e}')
+                             for row in batch)
+        return []
+    report.imported += len(rows)
+    if rows:
+        events.emit(events.THESES_IMPORTED, rows=rows)
+    return rows
+
+
+def import_theses(client: GraphDatabaseClient, rows: Iterable[dict],
+                  batch_size: int = 500,
+                  instructor_id: Optional[str] = None,
+                  owner_id: Optional[str] = None) -> ImportReport:
+    """
+    import theses with their instructor links and tags
+    :param rows: dicts with thesis_name, description, year, difficulty,
+    tags and instructor_id keys, row numbers in the report start from 1
+    :param batch_size: number of theses written per transaction
+    :param instructor_id: default instructor for rows without one
+    :param owner_id: instructor importing their own theses, rows without
+    instructor_id are theirs and rows of other instructors are rejected
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+    seen_names = set()
+    batch = []
+    for index, row in enumerate(rows, start=1):
+        if owner_id:
+            if row.get('instructor_id') and \
+                    str(row['instructor_id']) != str(owner_id):
+                report.errors.append(
+                    (index, 'theses of other instructors cannot be imported'))
+                continue
+            row = dict(row, instructor_id=owner_id)
+        elif instructor_id and not row.get('instructor_id'):
+            row = dict(row, instructor_id=instructor_id)
+        try:
+            prepared = prepare_row(index, row)
+        except IncorrectArgumentException as e:
+            report.errors.append((index, str(e)))
+            continue
+        name = prepared['props']['thesis_name']
+        if name in seen_names:
+            report.errors.append((index, 'duplicate thesis_name in input'))
+            continue
+        seen_names.add(name)
+
+        batch.append(prepared)
+        if len(batch) >= batch_size:
+            import_batch(client, batch, report)
+            batch = []
+    if batch:
+        import_batch(client, batch, report)
+
+    report.errors.sort()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def read_rows(path: str) -> Iterable[dict]:
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk thesis import')
+    parser.add_argument('path', help='.csv or .jsonl file')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--instructor-id',
+                        help='instructor for rows without instructor_id')
+    args = parser.parse_args()
+
+    relay_writes(DatabaseClient().invalidation)
+    report = import_theses(GraphDatabaseClient(), read_rows(args.path),
+                           args.batch_size, args.instructor_id)
+    for row, message in report.errors:
+        print(f'row {row}: {message}')
+    print(f'imported {report.imported}, failed {report.failed} in '
+          f'{report.elapsed:.2f}s ({report.rows_per_second:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
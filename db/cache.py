@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class LRUCache:
+    """
+    thread safe dict-like cache with a maximum size, per-entry time to live
+    and least recently used eviction
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable] = None,
+                 timer: Callable[[], float] = time.monotonic,
+                 lock: Optional[threading.RLock] = None):
+        """
+        :param max_size: maximum number of entries
+        :param ttl: seconds an entry lives after it has been set, None -
+        entries never expire
+        :param on_evict: called with (key, value) for every entry removed by
+        expiration or eviction, not for explicit pop
+        :param timer: monotonic clock, replaced in tests
+        :param lock: lock shared with other caches that are updated together
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.timer = timer
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = lock or threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at is not None and expires_at <= self.timer():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                self._evicted(key, value)
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = self.timer() + self.ttl if self.ttl else None
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                old_key, (_, old_value) = self._data.popitem(last=False)
+                self.evictions += 1
+                self._evicted(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evicted(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+
+class UserSessionCache:
+    """
+    cache of users by id and of session id -> user id, with a reverse index
+    user id -> session ids so all sessions of one user are dropped without
+    scanning the whole cache
+    """
+
+    def __init__(self, max_users: int, max_sessions: int,
+                 ttl: Optional[float] = None,
+                 timer: Callable[[], float] = time.monotonic):
+        # one lock for both caches and the index, so evictions triggered
+        # inside the session cache never wait for another lock
+        self._lock = threading.RLock()
+        self.users = LRUCache(max_users, ttl, timer=timer, lock=self._lock)
+        self.sessions = LRUCache(max_sessions, ttl,
+                                 on_evict=self._session_evicted, timer=timer,
+                                 lock=self._lock)
+        self.user_sessions = {}  # user_id -> set of session ids
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        return self.users.get(user_id)
+
+    def put_user(self, user: dict):
+        self.users.set(user['_id'], user)
+
+    def drop_user(self, user_id: str):
+        self.users.pop(user_id)
+
+    def get_user_by_session(self, session_id: str) -> Optional[dict]:
+        user_id = self.sessions.get(session_id)
+        if user_id is None:
+            return None
+        return self.users.get(user_id)
+
+    def put_session(self, session_id: str, user_id: str):
+        with self._lock:
+            previous = self.sessions.pop(session_id)
+            if previous is not None and previous != user_id:
+                self._unindex(session_id, previous)
+            self.sessions.set(session_id, user_id)
+            self.user_sessions.setdefault(user_id, set()).add(session_id)
+
+    def drop_session(self, session_id: str):
+        with self._lock:
+            user_id = self.sessions.pop(session_id)
+            if user_id is not None:
+                self._unindex(session_id, user_id)
+
+    def drop_user_sessions(self, user_id: str):
+        with self._lock:
+            for session_id in self.user_sessions.pop(user_id, ()):
+                self.sessions.pop(session_id)
+
+    def _session_evicted(self, session_id, user_id):
+        self._unindex(session_id, user_id)
+
+    def _unindex(self, session_id, user_id):
+        session_ids = self.user_sessions.get(user_id)
+        if session_ids is not None:
+            session_ids.discard(session_id)
+            if not session_ids:
+                del self.user_sessions[user_id]
+
+    def stats(self) -> dict:
+        return {'users': self.users.stats(),
+                'sessions': self.sessions.stats()}
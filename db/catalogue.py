@@ -0,0 +1,102 @@
+"""
+Versioned cache of serialised thesis catalogue responses.
+
+The catalogue version is the time of the latest write to the catalogue
+(see db.events) and is the ETag of catalogue responses. The writer
+broadcasts it through the invalidation channel and every worker keeps the
+newest version it has seen, so workers agree on it after a write. ETags are
+still per worker in between: each worker starts with its own version and
+local bumps (GraphReplica polls) are not published, so a client switching
+workers may get a full response instead of 304 until the next write.
+Command line writers publish their writes with db.clients.relay_writes.
+"""
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from db import events
+from db.cache import LRUCache
+from db.invalidation import InvalidationChannel
+
+# invalidation message kind, the key is the new version
+CATALOGUE = 'catalogue'
+
+
+class CatalogueCache:
+    def __init__(self, max_size: int,
+                 channel: Optional[InvalidationChannel] = None):
+        """
+        :param max_size: maximum number of cached responses
+        :param channel: channel to share version changes with other workers
+        """
+        self.version = time.time_ns()
+        self.responses = LRUCache(max_size)  # key -> (version, body)
+        self.channel = channel or InvalidationChannel()
+        self._lock = threading.Lock()
+
+        events.subscribe(self.on_event)
+        self.channel.subscribe(self.on_invalidation)
+
+    def etag(self, version: int) -> str:
+        return str(version)
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        """
+        :return: serialised response stored for this version, None if there
+        is nothing or the response belongs to an older version
+        """
+        item = self.responses.get(key)
+        if item is None or item[0] != version:
+            return None
+        return item[1]
+
+    def get_or_build(self, key: str, build: Callable[[], bytes]):
+        """
+        :param build: serialises the response, called on a cache miss
+        :return: (etag, body)
+        """
+        # read the version before building, so a write that happens while
+        # the response is built leaves it stale instead of current
+        version = self.version
+        body = self.get(key, version)
+        if body is None:
+            body = build()
+            self.responses.set(key, (version, body))
+        return self.etag(version), body
+
+    def get_or_stream(self, key: str,
+                      stream: Callable[[], Iterable[bytes]]):
+        """
+        same as get_or_build for a body sent as it is serialised, it is
+        cached once the whole body has been sent
+        :param stream: returns the chunks of the body, called on a cache miss
+        :return: (etag, iterable of chunks)
+        """
+        version = self.version
+        body = self.get(key, version)
+        if body is not None:
+            return self.etag(version), [body]
+        return self.etag(version), self._tee(key, version, stream())
+
+    def _tee(self, key: str, version: int, chunks: Iterable[bytes]):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.responses.set(key, (version, b''.join(parts)))
+
+    def bump(self) -> int:
+        with self._lock:
+            self.version = max(self.version + 1, time.time_ns())
+            return self.version
+
+    def on_event(self, event: str, payload: dict):
+        self.channel.publish(CATALOGUE, str(self.bump()))
+
+    def on_invalidation(self, kind: str, key: str):
+        if kind != CATALOGUE:
+            return
+        with self._lock:
+            # a remote version not newer than ours is older than our last
+            # bump, responses cached since were built after its write
+            self.version = max(self.version, int(key))
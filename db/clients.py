@@ -0,0 +1,219 @@
+"""
+Lazily created, per-process database clients.
+
+Nothing connects when the app module is imported: each client is created on
+first use in the process that uses it. When a worker is forked from a
+process that already has clients, the worker notices the new pid and
+creates its own, as pymongo and py2neo connection pools must not be shared
+across fork.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import settings as s
+from db import events, queries
+from db.catalogue import CatalogueCache
+from db.db_mongo import DatabaseClient
+from db.db_neo4j import GraphDatabaseClient, Group, Thesis
+from db.invalidation import InvalidationChannel
+from db.recommend import Recommender
+from db.replica import GraphReplica
+from db.schema import ensure_schema
+from db.search import SearchIndex
+from db.stream import StreamHub
+
+PING = queries.register('ping', 'RETURN 1')
+
+
+def relay_writes(channel: InvalidationChannel) -> Callable[[], None]:
+    """
+    publish the writes of a command line tool (db.bulk, db.matching) to the
+    web workers, which only hear about other processes through the channel:
+    their catalogue version, stream clients, search indexes and recommenders
+    follow; call it before writing
+    :return: function to stop publishing
+    """
+    # bumps the version on every event and broadcasts it
+    catalogue = CatalogueCache(1, channel)
+    # no listeners here, the hub only forwards the stream events
+    hub = StreamHub(1, 0, channel)
+    events.subscribe(hub.on_event)
+    relay = events.Relay(channel)
+    relay.subscribe(receive=False)
+
+    def stop():
+        for listener in (catalogue.on_event, hub.on_event, relay.on_event):
+            events.unsubscribe(listener)
+    return stop
+
+
+def create_graph_client() -> GraphDatabaseClient:
+    client = GraphDatabaseClient()
+    if s.NEO4J_ENSURE_SCHEMA:
+        ensure_schema(client)
+    return client
+
+
+class Clients:
+    def __init__(self, mongo_factory: Optional[Callable] = None,
+                 graph_factory: Optional[Callable] = None):
+        """
+        :param mongo_factory: creates the DatabaseClient, replaced by
+        benchmarks and tests with a stand-in
+        :param graph_factory: creates the GraphDatabaseClient
+        """
+        self.mongo_factory = mongo_factory or DatabaseClient
+        self.graph_factory = graph_factory or create_graph_client
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        for name in ('_catalogue', '_search', '_recommender', '_replica',
+                     '_stream', '_relay'):
+            if getattr(self, name, None) is not None:
+                events.unsubscribe(getattr(self, name).on_event)
+        self._pid = os.getpid()
+        self._mongo = None
+        self._graph = None
+        self._catalogue = None
+        self._search = None
+        self._recommender = None
+        self._replica = None
+        self._stream = None
+        self._relay = None
+        self._executor = None
+
+    def _get(self, name: str, factory: Callable):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        value = getattr(self, name)
+        if value is None:
+            with self._lock:
+                value = getattr(self, name)
+                if value is None:
+                    value = factory()
+                    setattr(self, name, value)
+        return value
+
+    @property
+    def mongo(self) -> DatabaseClient:
+        return self._get('_mongo', self.mongo_factory)
+
+    @property
+    def graph(self) -> GraphDatabaseClient:
+        graph = self._get('_graph', self.graph_factory)
+        # a process writing theses forwards its events to the others
+        self.relay
+        return graph
+
+    @property
+    def relay(self) -> events.Relay:
+        """
+        exchange of db.events with the other workers
+        """
+        def build():
+            relay = events.Relay(self.mongo.invalidation)
+            relay.subscribe()
+            return relay
+        return self._get('_relay', build)
+
+    @property
+    def catalogue(self) -> CatalogueCache:
+        return self._get('_catalogue', lambda: CatalogueCache(
+            s.CATALOGUE_CACHE_MAX_SIZE, self.mongo.invalidation))
+
+    @property
+    def search(self) -> SearchIndex:
+        def build():
+            index = SearchIndex(lambda: Thesis.find_all_with_tags(self.graph))
+            index.subscribe()
+            index.build(Thesis.find_all_with_tags(self.graph))
+            return index
+        return self._get('_search', build)
+
+    @property
+    def recommender(self) -> Recommender:
+        def build():
+            recommender = Recommender(
+                lambda: self.search.theses(),
+                lambda: Group.find_years(self.graph),
+                s.RECOMMEND_CACHE_MAX_SIZE)
+            recommender.subscribe()
+            # interests changed in another worker
+            self.mongo.invalidation.subscribe(recommender.on_invalidation)
+            # thesis changes of other processes arrive through the relay
+            self.relay
+            return recommender
+        return self._get('_recommender', build)
+
+    def recommender_if_built(self) -> Optional[Recommender]:
+        """
+        :return: the recommender of this process, None if it has not been
+        built yet, e.g. to drop cached state without building it first
+        """
+        if self._pid != os.getpid():
+            return None
+        return self._recommender
+
+    @property
+    def replica(self) -> Optional[GraphReplica]:
+        """
+        in-memory copy of the graph for reads, None unless GRAPH_REPLICA
+        """
+        if not s.GRAPH_REPLICA:
+            return None
+
+        def build():
+            replica = GraphReplica(
+                self.graph, s.GRAPH_REPLICA_POLL_INTERVAL,
+                s.GRAPH_REPLICA_RELOAD_INTERVAL,
+                # responses cached before a poll may miss its changes
+                on_change=lambda: self.catalogue.bump())
+            replica.start()
+            return replica
+        return self._get('_replica', build)
+
+    @property
+    def stream(self) -> StreamHub:
+        """
+        fan-out of catalogue changes to /api/thesis/stream
+        """
+        def build():
+            hub = StreamHub(s.STREAM_BUFFER_SIZE, s.STREAM_MAX_LISTENERS,
+                            self.mongo.invalidation)
+            hub.subscribe()
+            return hub
+        return self._get('_stream', build)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        pool running the writes of db.dual_write.DualWrite
+        """
+        return self._get('_executor', lambda: ThreadPoolExecutor(
+            s.DUAL_WRITE_POOL_SIZE, thread_name_prefix='dual-write'))
+
+    def warm_up(self) -> dict:
+        """
+        create the clients and open one connection to each store, run it
+        in every worker after fork (e.g. gunicorn post_fork hook)
+        :return: seconds spent per store
+        """
+        timings = {}
+        started = time.perf_counter()
+        self.mongo.db.command('ping')
+        timings['mongo'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.graph.run_query(PING).evaluate()
+        timings['neo4j'] = time.perf_counter() - started
+
+        self.catalogue
+        # changes made before the first stream opens are not missed
+        self.stream
+        return timings
@@ -0,0 +1,72 @@
+"""
+Rebuild of the instructor counters.
+
+Instructor nodes carry theses_offered and theses_enrolled, kept up to date
+by the queries which create, enrol, release and delete theses. This job
+recomputes them from the SUPERVISES relationships, e.g. after data has been
+written around those queries or to repair drift.
+
+Usage:
+    python -m db.counters [--check] [--batch-size 1000]
+"""
+import argparse
+
+from db import queries
+from db.db_neo4j import GraphDatabaseClient, Instructor, Thesis, Relations
+
+INSTRUCTOR_IDS_QUERY = queries.register('counters.instructor_ids', f'''
+    MATCH (i:{Instructor.node_type})
+    RETURN i.id AS id
+    ORDER BY id
+''')
+
+REBUILD_QUERY = queries.register('counters.rebuild', f'''
+    UNWIND $ids AS id
+    MATCH (i:{Instructor.node_type} {{id: id}})
+    OPTIONAL MATCH (i)-[:{Relations.INSTRUCTOR_THESIS}]->(t:{Thesis.node_type})
+    WITH i, count(t) AS offered, count(t.student_id) AS enrolled
+    WITH i, offered, enrolled,
+         coalesce(i.theses_offered, 0) <> offered OR
+         coalesce(i.theses_enrolled, 0) <> enrolled AS drifted
+    FOREACH (_ IN CASE WHEN drifted AND NOT $check THEN [1] ELSE [] END |
+        SET i.theses_offered = offered, i.theses_enrolled = enrolled)
+    RETURN i.id AS id, drifted
+''')
+
+
+def rebuild_counters(client: GraphDatabaseClient, batch_size: int = 1000,
+                     check: bool = False) -> list:
+    """
+    recompute the counters of all instructors, one transaction per batch
+    :param check: only find the instructors with wrong counters
+    :return: ids of the instructors whose counters were wrong
+    """
+    ids = [record['id']
+           for record in client.run_query(INSTRUCTOR_IDS_QUERY).data()]
+    drifted = []
+    for start in range(0, len(ids), batch_size):
+        params = {'ids': ids[start:start + batch_size], 'check': check}
+        drifted.extend(record['id'] for record in
+                       client.run_query(REBUILD_QUERY, params).data()
+                       if record['drifted'])
+    return drifted
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recompute the thesis counters of instructors')
+    parser.add_argument('--check', action='store_true',
+                        help='only report instructors with wrong counters')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    drifted = rebuild_counters(GraphDatabaseClient(), args.batch_size,
+                               args.check)
+    for instructor_id in drifted:
+        print(instructor_id)
+    action = 'wrong' if args.check else 'fixed'
+    print(f'{len(drifted)} instructors with {action} counters')
+
+
+if __name__ == '__main__':
+    main()
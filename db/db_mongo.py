@@ -1,16 +1,52 @@
 from bson.objectid import ObjectId
-from pymongo import MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 
 import settings as s
+from db import metrics
+from db.cache import UserSessionCache
+from db.exceptions import EnrolmentConflictException
+from db.invalidation import create_channel, USER, USER_SESSIONS
 
 
 class DatabaseClient:
-    def __init__(self, host=s.MONGODB_HOSTNAME, database=s.MONGODB_NAME, users_collection=s.MONGODB_USERS_COLLECTION):
-        self.db = MongoClient(host=host).get_database(database)
-        self.users = self.db.get_collection(users_collection)
-
-        self.users_cache = dict()
-        self.sessions_cache = dict()
+    def __init__(self, host=s.MONGODB_HOSTNAME, database=s.MONGODB_NAME, users_collection=s.MONGODB_USERS_COLLECTION,
+                 mongo_client=None):
+        """
+        :param mongo_client: pymongo compatible client to use instead of
+        connecting to host, e.g. mongomock in benchmarks
+        """
+        if mongo_client is None:
+            mongo_client = MongoClient(
+                host=host, port=s.MONGODB_PORT,
+                maxPoolSize=s.MONGODB_MAX_POOL_SIZE,
+                minPoolSize=s.MONGODB_MIN_POOL_SIZE,
+                connectTimeoutMS=s.MONGODB_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=s.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=s.MONGODB_SOCKET_TIMEOUT_MS,
+                waitQueueTimeoutMS=s.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+                connect=False)
+        self.db = mongo_client.get_database(database)
+        self.users = metrics.InstrumentedCollection(
+            self.db.get_collection(users_collection))
+
+        self.cache = UserSessionCache(s.USER_CACHE_MAX_SIZE,
+                                      s.SESSION_CACHE_MAX_SIZE,
+                                      s.USER_CACHE_TTL)
+        self.invalidation = create_channel(
+            s.CACHE_INVALIDATION, self.db,
+            directory=s.CACHE_INVALIDATION_SOCKET_DIR,
+            collection=s.MONGODB_INVALIDATION_COLLECTION,
+            size=s.MONGODB_INVALIDATION_COLLECTION_SIZE)
+        self.invalidation.subscribe(self.on_invalidation)
+
+    def on_invalidation(self, kind, user_id):
+        """
+        apply an invalidation published by another worker
+        """
+        if kind == USER:
+            self.cache.drop_user(user_id)
+        elif kind == USER_SESSIONS:
+            self.cache.drop_user_sessions(user_id)
 
     def cache_user(self, user):
         user.pop('password', None)
@@ -18,7 +54,7 @@ class DatabaseClient:
 
         user['_id'] = str(user['_id'])
 
-        self.users_cache[user['_id']] = user
+        self.cache.put_user(user)
 
     def user_check_password(self, email, password):
         query = {'email': email, 'password': password}
@@ -32,16 +68,15 @@ class DatabaseClient:
         if not session_id:
             return None
 
-        if session_id in self.sessions_cache:
-            user_id = self.sessions_cache[session_id]
-            user = self.users_cache[user_id]
-
+        user = self.cache.get_user_by_session(session_id)
+        if user is not None:
             return user
 
         query = {'session_id': session_id}
         user = self.users.find_one(query)
         if user:
             self.cache_user(user)
+            self.cache.put_session(session_id, user['_id'])
         return user
 
     def user_write_session(self, user_id, session_id):
@@ -50,28 +85,131 @@ class DatabaseClient:
 
         self.users.find_one_and_update(query, update)
         if session_id:
-            self.sessions_cache[session_id] = user_id
+            self.cache.put_session(session_id, user_id)
         else:
-            keys_to_delete = []
-            for key, value in self.sessions_cache.items():
-                if value == user_id:
-                    keys_to_delete.append(key)
-            for key in keys_to_delete:
-                del self.sessions_cache[key]
+            self.cache.drop_user_sessions(user_id)
+            self.invalidation.publish(USER_SESSIONS, user_id)
         return True
 
     def user_enrol_thesis(self, user_id, thesis_id):
-        query = {'_id': ObjectId(user_id)}
+        """
+        set the thesis of the user unless the user already has another one
+        :return: True if the thesis has been set, False if the user already
+        had it, so there is nothing to undo
+        :raise EnrolmentConflictException: the user is enrolled elsewhere
+        """
+        query = {'_id': ObjectId(user_id), 'thesis_id': {'$in': [None, '']}}
         update = {'$set': {'thesis_id': thesis_id}}
 
         user = self.users.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if user is None:
+            # refresh the cached copy, it missed the thesis of the user
+            user = self.users.find_one({'_id': ObjectId(user_id)})
+            if user:
+                self.cache_user(user)
+                if user.get('thesis_id') == thesis_id:
+                    return False
+            raise EnrolmentConflictException(
+                'The student is already enrolled for another thesis')
         self.cache_user(user)
+        self.invalidation.publish(USER, user['_id'])
         return True
 
+    def user_unenrol_thesis(self, user_id, thesis_id):
+        """
+        undo user_enrol_thesis, only if the user still has this thesis
+        """
+        query = {'_id': ObjectId(user_id), 'thesis_id': thesis_id}
+        update = {'$unset': {'thesis_id': ''}}
+
+        user = self.users.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if user:
+            self.cache_user(user)
+            self.invalidation.publish(USER, user['_id'])
+        return user is not None
+
+    def user_drop_thesis(self, thesis_id):
+        """
+        unset the thesis of the student enrolled for it, used when the
+        thesis is deleted
+        :return: id of the student, None if nobody has the thesis
+        """
+        query = {'thesis_id': thesis_id}
+        update = {'$unset': {'thesis_id': ''}}
+
+        user = self.users.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        if user is None:
+            return None
+        self.cache_user(user)
+        self.invalidation.publish(USER, user['_id'])
+        return user['_id']
+
+    def users_in_group(self, group_id):
+        """
+        :return: students of the group with the fields used for
+        recommendations (see db.recommend)
+        """
+        if not group_id:
+            return []
+        query = {'group_id': group_id, 'role': 'student'}
+        projection = ['group_id', 'interests', 'difficulty']
+        return list(self.users.find(query, projection))
+
+    def user_set_preferences(self, user_id, thesis_names, ts):
+        """
+        store the ranked thesis preferences of the student for the batch
+        assignment (see db.matching)
+        :param ts: submission time, earlier submissions are served first
+        """
+        query = {'_id': ObjectId(user_id)}
+        update = {'$set': {'preferences': thesis_names, 'preferences_ts': ts}}
+
+        user = self.users.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+        self.cache_user(user)
+        self.invalidation.publish(USER, user['_id'])
+        return user
+
+    def users_with_preferences(self, group_ids):
+        """
+        :return: students of the groups with the fields used by the batch
+        assignment
+        """
+        query = {'group_id': {'$in': group_ids}, 'role': 'student'}
+        projection = ['group_id', 'thesis_id', 'preferences', 'preferences_ts']
+        return list(self.users.find(query, projection))
+
+    def users_enrol_theses(self, assignments):
+        """
+        user_enrol_thesis for many students in one bulk write
+        :param assignments: user id -> thesis id
+        :return: ids of the users which have been enrolled, users already
+        enrolled for another thesis are left as they are
+        """
+        if not assignments:
+            return set()
+        requests = [UpdateOne({'_id': ObjectId(user_id),
+                               'thesis_id': {'$in': [None, '']}},
+                              {'$set': {'thesis_id': thesis_id}})
+                    for user_id, thesis_id in assignments.items()]
+        result = self.users.bulk_write(requests, ordered=False)
+
+        if result.modified_count == len(requests):
+            enrolled = set(assignments)
+        else:
+            ids = [ObjectId(user_id) for user_id in assignments]
+            enrolled = {str(user['_id']) for user in self.users.find(
+                {'_id': {'$in': ids}}, ['thesis_id'])
+                if user.get('thesis_id') == assignments[str(user['_id'])]}
+        for user_id in enrolled:
+            self.cache.drop_user(user_id)
+            self.invalidation.publish(USER, user_id)
+        return enrolled
+
     def user_profile_update(self, user_id, params):
         query = {'_id': ObjectId(user_id)}
         update = {'$set': params}
 
         user = self.users.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
         self.cache_user(user)
+        self.invalidation.publish(USER, user['_id'])
         return user
\ No newline at end of file
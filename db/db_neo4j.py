@@ -1,19 +1,44 @@
+import time
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 
-from py2neo import Graph, Node, Relationship, NodeMatcher
+from py2neo import Graph, NodeMatcher
+from py2neo.database import ClientError
 
+from db import events, metrics, queries, slow_queries
+from db.mapper import Model, iter_batches, map_models, BATCH_SIZE
 from db.exceptions import ObjectExistsException, IncorrectArgumentException, \
-    ObjectDoesNotExist
-from settings import NEO4J_HOSTNAME, NEO4J_USER, NEO4J_PORT, NEO4J_PASSWORD
+    ObjectDoesNotExist, EnrolmentConflictException
+from settings import NEO4J_HOSTNAME, NEO4J_USER, NEO4J_PORT, NEO4J_PASSWORD, \
+    NEO4J_MAX_CONNECTIONS, NEO4J_SLOW_QUERY_MS, THESIS_TOMBSTONE_TTL
+
+
+CONSTRAINT_VIOLATION = 'Neo.ClientError.Schema.ConstraintValidationFailed'
+
+# update_ts is written by the app servers, readers of changes since a time
+# tolerate their clocks differing by this many seconds
+CLOCK_SKEW = 5.0
 
 
 class GraphDatabaseClient:
+    slow_query_ms = 0
+    slow_queries = None
+
     def __init__(self, hostname: str = NEO4J_HOSTNAME, port: int = NEO4J_PORT,
-                 user: str = NEO4J_USER, password: str = NEO4J_PASSWORD):
+                 user: str = NEO4J_USER, password: str = NEO4J_PASSWORD,
+                 slow_query_ms: float = NEO4J_SLOW_QUERY_MS):
+        """
+        :param slow_query_ms: queries running longer are written to the slow
+        query log with their plan (see db.slow_queries), 0 - no log
+        """
         url = f'bolt://{hostname}:{port}/db/data/'
-        self.graph = Graph(url, username=user, password=password)
+        self.graph = metrics.InstrumentedGraph(
+            Graph(url, username=user, password=password,
+                  max_connections=NEO4J_MAX_CONNECTIONS))
+        self.slow_query_ms = slow_query_ms
+        if slow_query_ms:
+            self.slow_queries = slow_queries.get_log()
 
     def find(self, node_type: str, properties: Optional[dict] = None):
         matcher = NodeMatcher(self.graph)
@@ -25,6 +50,36 @@ class GraphDatabaseClient:
         matcher = NodeMatcher(self.graph)
         return matcher.match(node_type, **properties).first()
 
+    def run_query(self, name: str, parameters: Optional[dict] = None,
+                  tx=None):
+        """
+        run a registered query template (see db.queries)
+        :param tx: transaction to run the query in, by default the query
+        runs in its own transaction
+        :return: py2neo cursor
+        """
+        runner = self.graph if tx is None else tx
+        started = time.perf_counter()
+        cursor = runner.run(queries.get(name), parameters or {})
+        elapsed = time.perf_counter() - started
+        if self.slow_queries is not None and \
+                elapsed * 1000 >= self.slow_query_ms:
+            self.slow_queries.report(self.graph, name, parameters, elapsed)
+        return cursor
+
+    def run_unique(self, name: str, parameters: dict, node_type: str,
+                   object_info: dict):
+        """
+        run a query creating a node, a uniqueness constraint violation (see
+        db.schema) is reported as ObjectExistsException
+        """
+        try:
+            return self.run_query(name, parameters).data()
+        except ClientError as e:
+            if e.code == CONSTRAINT_VIOLATION:
+                raise ObjectExistsException(node_type, object_info) from e
+            raise
+
 
 class ThesisStatus:
     CREATED = 0
@@ -64,8 +119,37 @@ class Relations:
     TAG_THESIS = 'TAGS'
 
 
-class Thesis:
+def parse_tags(tags) -> list:
+    """
+    :param tags: comma separated string or list of tag names
+    :return: unique lowercase tag names
+    """
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return sorted({x.strip().lower() for x in tags if x.strip()})
+
+
+class EnrolState:
+    """
+    outcomes of the enrolment query
+    """
+    FREE = 'free'
+    ENROLLED = 'enrolled'  # the student already has the thesis
+    TAKEN = 'taken'
+    FULL = 'full'  # the instructor has no capacity left
+
+
+class Thesis(Model):
     node_type = 'Thesis'
+    # left behind by a deleted thesis for THESIS_TOMBSTONE_TTL seconds
+    tombstone_type = 'ThesisTombstone'
+    # node properties, to_dict leaves out the empty ones
+    FIELDS = ('id', 'student_id', 'thesis_name', 'description', 'year',
+              'difficulty', 'tags', 'student_info', 'score', 'creation_ts',
+              'update_ts', 'student_enrol_ts', 'status')
+    __slots__ = FIELDS
 
     def __init__(self, thesis_name: str, description: str,
                  year: int, difficulty: int, tags: Optional[list] = None,
@@ -113,50 +197,181 @@ class Thesis:
         self.student_enrol_ts = student_enrol_ts
         self.status = ThesisStatus.CREATED
 
-    def to_dict(self) -> dict:
-        fields_values = {key: value for key, value in vars(self).items()
-                         if key[:2] != '__' and key not in
-                         ['node_type', 'instructor_id'] and value}
-        return fields_values
-
     def find(self, client: GraphDatabaseClient):
-        thesis = client.find_one(self.node_type, dict(thesis_name=self.thesis_name))
-        return thesis
+        return client.run_query(
+            THESIS_BY_NAME, {'thesis_name': self.thesis_name}).evaluate()
 
-    def create(self, client: GraphDatabaseClient, instructor_id: str):
-        instructor = client.find_one(Instructor.node_type,
-                                     {'id': instructor_id})
-        if instructor is None:
+    def create(self, client: GraphDatabaseClient, instructor_id: str,
+               tags=None):
+        """
+        create the thesis supervised by the instructor
+        :param tags: comma separated string or list of tag names
+        """
+        if self.find(client) is not None:
+            raise ObjectExistsException(self.node_type, self.to_dict())
+        tag_names = parse_tags(tags)
+        params = {'instructor_id': instructor_id, 'props': self.to_dict(),
+                  'tags': tag_names}
+        result = client.run_unique(THESIS_CREATE, params, self.node_type,
+                                   self.to_dict())
+        if not result:
             raise ObjectDoesNotExist(Instructor.node_type,
                                      {'id': instructor_id})
-        if self.find(client) is None:
-            thesis_node = Node(self.node_type)
-            thesis_node.update(self.to_dict())
-            client.graph.create(thesis_node)
-            rel = Relationship(instructor, Relations.INSTRUCTOR_THESIS,
-                               thesis_node)
-            client.graph.create(rel)
-            rel = Relationship(thesis_node, Relations.THESIS_INSTRUCTOR,
-                               instructor)
-            client.graph.create(rel)
-
-            return thesis_node
-        else:
-            raise ObjectExistsException(self.node_type, self.to_dict())
+        thesis_node = result[0]['t']
+
+        events.emit(events.THESIS_CREATED, thesis=dict(thesis_node),
+                    instructor_id=instructor_id, tags=tag_names)
+        return thesis_node
+
+    @staticmethod
+    def find_all(client: GraphDatabaseClient) -> list:
+        """
+        :return: all thesis as dicts
+        """
+        return list(Thesis.iter_all(client))
+
+    @staticmethod
+    def iter_all(client: GraphDatabaseClient):
+        """
+        :return: generator of thesis dicts, read from the cursor while the
+        caller consumes them
+        """
+        for record in client.run_query(THESIS_ALL):
+            yield dict(record['t'])
+
+    @staticmethod
+    def iter_models(client: GraphDatabaseClient,
+                    batch_size: int = BATCH_SIZE):
+        """
+        :return: generator of lists of at most batch_size Thesis models of
+        all theses, see db.mapper
+        """
+        for batch in iter_batches(client.run_query(THESIS_ALL), batch_size):
+            yield map_models(batch, Thesis)
+
+    @staticmethod
+    def find_all_with_tags(client: GraphDatabaseClient):
+        """
+        :return: generator of (thesis dict, tag names) pairs
+        """
+        for record in client.run_query(THESIS_ALL_WITH_TAGS):
+            yield dict(record['t']), record['tags']
 
     @staticmethod
     def thesis_enrol(client: GraphDatabaseClient, thesis_name: str, student_id):
-        thesis = client.find_one(Thesis.node_type, {'thesis_name': thesis_name})
-        if thesis is None:
+        """
+        enrol the student for the thesis if nobody has taken it yet and the
+        instructor has capacity left (Instructor.load), the checks and the
+        updates of the thesis and the instructor counters are done in one
+        query under the node write locks
+        :return: True if the student has been enrolled, False if the student
+        already had the thesis, so there is nothing to undo
+        :raise ObjectDoesNotExist: there is no thesis with such name
+        :raise EnrolmentConflictException: another student has the thesis
+        or the instructor is fully loaded
+        """
+        params = {'thesis_name': thesis_name, 'student_id': student_id,
+                  'ts': datetime.now().timestamp(),
+                  'status': ThesisStatus.ENROLLED}
+        state = client.run_query(THESIS_ENROL, params).evaluate()
+        if state is None:
             raise ObjectDoesNotExist(Thesis.node_type, {'thesis_name': thesis_name})
-        thesis['student_id'] = student_id
-        thesis['student_enrol_ts'] = datetime.now().timestamp()
-        thesis['update_ts'] = thesis['student_enrol_ts']
-        client.graph.push(thesis)
+        if state == EnrolState.TAKEN:
+            raise EnrolmentConflictException(
+                f'Thesis "{thesis_name}" is already taken by another student')
+        if state == EnrolState.FULL:
+            raise EnrolmentConflictException(
+                f'The instructor of thesis "{thesis_name}" has no places left')
+        if state == EnrolState.ENROLLED:
+            return False
+        events.emit(events.THESIS_ENROLLED, thesis_name=thesis_name,
+                    student_id=student_id, ts=params['ts'])
+        return True
+
+    @staticmethod
+    def thesis_release(client: GraphDatabaseClient, thesis_name: str,
+                       student_id):
+        """
+        undo thesis_enrol, only if the thesis still belongs to the student
+        :return: True if the thesis has been released
+        """
+        params = {'thesis_name': thesis_name, 'student_id': student_id,
+                  'ts': datetime.now().timestamp(),
+                  'status': ThesisStatus.CREATED}
+        released = client.run_query(THESIS_RELEASE, params).evaluate()
+        if released:
+            events.emit(events.THESIS_RELEASED, thesis_name=thesis_name,
+                        student_id=student_id, ts=params['ts'])
+        return bool(released)
 
+    @staticmethod
+    def find_changes(client: GraphDatabaseClient,
+                     since: float) -> Tuple[list, list]:
+        """
+        theses created, updated, enrolled, released or deleted since the time
+        :param since: timestamp, compared with update_ts
+        :return: list of thesis dicts with instructor_id and tags, list of
+        (thesis_name, instructor_id) of the deleted theses
+        """
+        params = {'since': since}
+        changed = []
+        for record in client.run_query(THESIS_CHANGED, params):
+            thesis = dict(record['t'])
+            thesis['instructor_id'] = record['instructor_id']
+            thesis['tags'] = record['tags']
+            changed.append(thesis)
+        deleted = [(record['thesis_name'], record['instructor_id']) for
+                   record in client.run_query(THESIS_DELETED, params)]
+        return changed, deleted
 
-class Instructor:
+    @staticmethod
+    def find_page(client: GraphDatabaseClient, year: Optional[int] = None,
+                  difficulty_min: Optional[int] = None,
+                  difficulty_max: Optional[int] = None,
+                  tag: Optional[str] = None, only_unassigned: bool = False,
+                  instructor_id: Optional[str] = None,
+                  department_id: Optional[str] = None,
+                  thesis_name: Optional[str] = None,
+                  cursor: Optional[str] = None,
+                  page_size: int = 50) -> Tuple[list, Optional[str]]:
+        """
+        get one page of the thesis catalogue, filtered on the server side
+        :param cursor: thesis_name of the last thesis of the previous page,
+        pages are ordered by thesis_name
+        :param page_size: maximum number of thesis in the page
+        :return: list of thesis and the cursor of the next page (None if
+        this is the last page)
+        """
+        filters = {
+            'cursor': cursor, 'thesis_name': thesis_name, 'year': year,
+            'difficulty_min': difficulty_min,
+            'difficulty_max': difficulty_max,
+            'only_unassigned': True if only_unassigned else None,
+            'instructor_id': instructor_id, 'department_id': department_id,
+            'tag': tag.strip().lower() if tag else None,
+        }
+        params = {key: value for key, value in filters.items()
+                  if value is not None}
+        # one extra row tells whether there is a next page
+        params['limit'] = page_size + 1
+        query = thesis_page_query([key for key in THESIS_PAGE_FILTERS
+                                   if key in params])
+        records = client.run_query(query, params).data()
+
+        result = []
+        for record in records[:page_size]:
+            thesis = dict(record['t'])
+            thesis['instructor_id'] = record['instructor_id']
+            result.append(thesis)
+        next_cursor = result[-1]['thesis_name'] \
+            if len(records) > page_size else None
+        return result, next_cursor
+
+
+class Instructor(Model):
     node_type = 'Instructor'
+    FIELDS = ('id', 'degree', 'load', 'classroom')
+    __slots__ = FIELDS
 
     def __init__(self, id: str, degree: Optional[str] = None,
                  load: Optional[int] = None, classroom: Optional[str] = None):
@@ -165,79 +380,75 @@ class Instructor:
         self.load = load
         self.classroom = classroom
 
-    def to_dict(self) -> dict:
-        fields_values = {key: value for key, value in vars(self).items()
-                         if key[:2] != '__' and key != 'node_type' and value}
-        return fields_values
-
     def find(self, client: GraphDatabaseClient):
-        instructor = client.find_one(self.node_type, dict(id=self.id))
-        return instructor
+        return client.run_query(INSTRUCTOR_BY_ID, {'id': self.id}).evaluate()
 
     def create(self, client: GraphDatabaseClient, department_id: str):
-        params = {'department_id': department_id}
-        department = client.find_one(Department.node_type, params)
-        if department is None:
-            raise ObjectDoesNotExist(Department.node_type, params)
-        if self.find(client) is None:
-            node = Node(Instructor.node_type)
-            node.update(self.to_dict())
-            client.graph.create(node)
-            rel = Relationship(department, Relations.DEPARTMENT_INSTRUCTOR, node)
-            client.graph.create(rel)
-            rel = Relationship(node, Relations.INSTRUCTOR_DEPARTMENT, department)
-            client.graph.create(rel)
-        else:
+        if self.find(client) is not None:
             raise ObjectExistsException(self.node_type, self.to_dict())
+        params = {'department_id': department_id, 'props': self.to_dict()}
+        if not client.run_unique(INSTRUCTOR_CREATE, params, self.node_type,
+                                 self.to_dict()):
+            raise ObjectDoesNotExist(Department.node_type,
+                                     {'department_id': department_id})
 
     def add_thesis(self, client: GraphDatabaseClient, thesis: Thesis, tags: str):
-        thesis_node = thesis.create(client, self.id)
-
-        if not tags:
-            return
-
-        tags = [x.strip() for x in tags.lower().split(',')]
-        for name in set(tags):
-            tag = Node('Tag', name=name)
-            client.graph.merge(tag, "Thesis", "name")
-            rel = Relationship(thesis_node, Relations.THESIS_TAG, tag)
-            client.graph.create(rel)
-            rel = Relationship(tag, Relations.TAG_THESIS, thesis_node)
-            client.graph.create(rel)
+        return thesis.create(client, self.id, tags)
 
     def get_thesis(self, client: GraphDatabaseClient):
         """
         get all thesis for currect instructor
         :return: list of thesis
         """
-        query = f'MATCH (:{Instructor.node_type} ' + '{id: "' + self.id + '"}'+ ')-' \
-            f'[:{Relations.INSTRUCTOR_THESIS}]->(t:{Thesis.node_type})' \
-            f'RETURN t'
-        result = client.graph.run(query).data()
-        return list(map(lambda x: dict(x['t']), result))
+        return list(self.iter_theses(client))
+
+    def iter_theses(self, client: GraphDatabaseClient):
+        """
+        :return: generator of the thesis dicts of the instructor, see
+        Thesis.iter_all
+        """
+        for record in client.run_query(INSTRUCTOR_THESES, {'id': self.id}):
+            yield dict(record['t'])
+
+    def get_counters(self, client: GraphDatabaseClient) -> Optional[dict]:
+        """
+        counters maintained by the thesis queries, no relationships are
+        traversed
+        :return: load, theses_offered, theses_enrolled and remaining (None if
+        the load is not limited), None if there is no such instructor
+        """
+        result = client.run_query(INSTRUCTOR_COUNTERS, {'id': self.id}).data()
+        if not result:
+            return None
+        counters = dict(result[0])
+        counters['remaining'] = None if counters['load'] is None else \
+            max(counters['load'] - counters['theses_enrolled'], 0)
+        return counters
 
     def delete_thesis(self, client: GraphDatabaseClient, thesis_name: str):
         """
-        delete thesis by its name
+        delete thesis by its name, a tombstone is left for
+        Thesis.find_changes and expired tombstones are removed
         """
-        query = f'MATCH (a: {Thesis.node_type}' + '{thesis_name: "' + \
-                thesis_name + '"})' + f'-[:{Relations.THESIS_INSTRUCTOR}]->(i:Instructor ' + \
-                '{id: "' + self.id + '"}) RETURN a'
-        thesis_node = client.graph.run(query).to_subgraph()
-        if thesis_node is None:
-            raise ObjectDoesNotExist(
-                Thesis.node_type, {'thesis_name': thesis_node, 'instructor_id': self.id})
-        client.graph.delete(thesis_node)
+        ts = datetime.now().timestamp()
+        params = {'thesis_name': thesis_name, 'instructor_id': self.id,
+                  'ts': ts, 'expired': ts - THESIS_TOMBSTONE_TTL}
+        deleted = client.run_query(INSTRUCTOR_DELETE_THESIS, params).evaluate()
+        if not deleted:
+            raise ObjectDoesNotExist(Thesis.node_type, params)
+        events.emit(events.THESIS_DELETED, thesis_name=thesis_name,
+                    instructor_id=self.id)
 
 
-class Group:
+class Group(Model):
     node_type = 'Group'
+    FIELDS = ('id', 'name', 'year', 'degree')
+    __slots__ = FIELDS
 
     def __init__(self, name: str, year: int, degree: str):
         self.id = str(uuid.uuid4())
         self.name = name
-        print(1 > year > 6)
-        if 1 > year > 6:
+        if 1 > year or year > 6:
             raise IncorrectArgumentException(
                 'Group: "year" field must be in range [1, 6]')
         self.year = year
@@ -247,31 +458,29 @@ class Group:
                 f' {Degree.MASTER}]')
         self.degree = degree
 
-    def to_dict(self) -> dict:
-        fields_values = {key: value for key, value in vars(self).items()
-                         if key[:2] != '__' and key not in
-                         ['node_type', 'department_id'] and value}
-        return fields_values
-
     def create(self, client: GraphDatabaseClient, department_id: str):
-        params = {'department_id': department_id}
-        department = client.find_one(Department.node_type, params)
-        if department is None:
-            raise ObjectDoesNotExist(Department.node_type, params)
-        if client.find_one(self.node_type, self.to_dict()) is None:
-            group = Node(self.node_type)
-            group.update(self.to_dict())
-            client.graph.create(group)
-            rel = Relationship(department, Relations.DEPARTMENT_GROUP, group)
-            client.graph.create(rel)
-            rel = Relationship(group, Relations.GROUP_DEPARTMENT, department)
-            client.graph.create(rel)
-        else:
+        if client.run_query(GROUP_BY_ID, {'id': self.id}).evaluate():
             raise ObjectExistsException(self.node_type, self.to_dict())
+        params = {'department_id': department_id, 'props': self.to_dict()}
+        if not client.run_unique(GROUP_CREATE, params, self.node_type,
+                                 self.to_dict()):
+            raise ObjectDoesNotExist(Department.node_type,
+                                     {'department_id': department_id})
+
+    @staticmethod
+    def find_years(client: GraphDatabaseClient) -> dict:
+        """
+        :return: group id -> university year of all groups
+        """
+        return {record['id']: record['year']
+                for record in client.run_query(GROUP_YEARS).data()}
 
 
-class Department:
+class Department(Model):
     node_type = 'Department'
+    FIELDS = ('department_id', 'name', 'faculty', 'enrol_ts', 'predefence_ts',
+              'defence_ts')
+    __slots__ = FIELDS
 
     def __init__(self, name: str, faculty: str, enrol_ts: Optional[int] = None,
                  predefence_ts: Optional[int] = None,
@@ -279,22 +488,199 @@ class Department:
         self.department_id = str(uuid.uuid4())
         self.name = name
         self.faculty = faculty
-        if enrol_ts is not None:
-            self.enrol_ts = enrol_ts
-        if predefence_ts is not None:
-            self.predefence_ts = predefence_ts
-        if defence_ts is not None:
-            self.defence_ts = defence_ts
-
-    def to_dict(self) -> dict:
-        fields_values = {key: value for key, value in vars(self).items()
-                         if key[:2] != '__' and key != 'node_type' and value}
-        return fields_values
+        self.enrol_ts = enrol_ts
+        self.predefence_ts = predefence_ts
+        self.defence_ts = defence_ts
 
     def create(self, client: GraphDatabaseClient):
-        if client.find_one(self.node_type, self.to_dict()) is None:
-            node = Node(self.node_type)
-            node.update(self.to_dict())
-            client.graph.create(node)
-        else:
+        params = {'department_id': self.department_id}
+        if client.run_query(DEPARTMENT_BY_ID, params).evaluate():
             raise ObjectExistsException(self.node_type, self.to_dict())
+        client.run_unique(DEPARTMENT_CREATE, {'props': self.to_dict()},
+                          self.node_type, self.to_dict())
+
+
+# Query templates, see db.queries
+
+THESIS_BY_NAME = queries.register('thesis.by_name', f'''
+    MATCH (t:{Thesis.node_type} {{thesis_name: $thesis_name}})
+    RETURN t
+''')
+
+THESIS_ALL = queries.register('thesis.all', f'''
+    MATCH (t:{Thesis.node_type})
+    RETURN t
+''')
+
+THESIS_ALL_WITH_TAGS = queries.register('thesis.all_with_tags', f'''
+    MATCH (t:{Thesis.node_type})
+    OPTIONAL MATCH (t)-[:{Relations.THESIS_TAG}]->(tag:Tag)
+    RETURN t, collect(tag.name) AS tags
+''')
+
+THESIS_CREATE = queries.register('thesis.create', f'''
+    MATCH (i:{Instructor.node_type} {{id: $instructor_id}})
+    CREATE (t:{Thesis.node_type})
+    SET t = $props
+    CREATE (i)-[:{Relations.INSTRUCTOR_THESIS}]->(t),
+           (t)-[:{Relations.THESIS_INSTRUCTOR}]->(i)
+    SET i.theses_offered = coalesce(i.theses_offered, 0) + 1
+    FOREACH (name IN $tags |
+        MERGE (tag:Tag {{name: name}})
+        CREATE (t)-[:{Relations.THESIS_TAG}]->(tag),
+               (tag)-[:{Relations.TAG_THESIS}]->(t))
+    RETURN t
+''')
+
+# setting _lock takes the write locks before student_id and the counters
+# are read, so concurrent enrolments for the thesis or for theses of the
+# same instructor are serialised instead of overwriting each other
+THESIS_ENROL = queries.register('thesis.enrol', f'''
+    MATCH (t:{Thesis.node_type} {{thesis_name: $thesis_name}})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    SET t._lock = true, i._lock = true
+    WITH t, i, CASE
+        WHEN t.student_id = $student_id THEN '{EnrolState.ENROLLED}'
+        WHEN t.student_id IS NOT NULL THEN '{EnrolState.TAKEN}'
+        WHEN coalesce(i.theses_enrolled, 0) >= i.load THEN '{EnrolState.FULL}'
+        ELSE '{EnrolState.FREE}' END AS state
+    FOREACH (_ IN CASE WHEN state = '{EnrolState.FREE}' THEN [1] ELSE [] END |
+        SET t.student_id = $student_id, t.student_enrol_ts = $ts,
+            t.update_ts = $ts, t.status = $status,
+            i.theses_enrolled = coalesce(i.theses_enrolled, 0) + 1)
+    REMOVE t._lock, i._lock
+    RETURN state
+''')
+
+THESIS_RELEASE = queries.register('thesis.release', f'''
+    MATCH (t:{Thesis.node_type} {{thesis_name: $thesis_name}})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    WHERE t.student_id = $student_id
+    REMOVE t.student_id, t.student_enrol_ts
+    SET t.status = $status, t.update_ts = $ts,
+        i.theses_enrolled = coalesce(i.theses_enrolled, 1) - 1
+    RETURN count(*)
+''')
+
+THESIS_CHANGED = queries.register('thesis.changed', f'''
+    MATCH (t:{Thesis.node_type})
+    WHERE t.update_ts >= $since
+    OPTIONAL MATCH (t)-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    OPTIONAL MATCH (t)-[:{Relations.THESIS_TAG}]->(tag:Tag)
+    RETURN t, i.id AS instructor_id, collect(tag.name) AS tags
+''')
+
+THESIS_DELETED = queries.register('thesis.deleted', f'''
+    MATCH (d:{Thesis.tombstone_type})
+    WHERE d.update_ts >= $since
+    RETURN d.thesis_name AS thesis_name, d.instructor_id AS instructor_id
+''')
+
+# conditions of the thesis.page filters, a page query has only those of the
+# given filters, so Neo4j can plan index seeks for them instead of scanning
+# every thesis to evaluate "$x IS NULL OR ..."
+THESIS_PAGE_FILTERS = {
+    'cursor': 't.thesis_name > $cursor',
+    'thesis_name': 't.thesis_name = $thesis_name',
+    'year': 't.year = $year',
+    'difficulty_min': 't.difficulty >= $difficulty_min',
+    'difficulty_max': 't.difficulty <= $difficulty_max',
+    'only_unassigned': 't.student_id IS NULL',
+    'instructor_id': 'i.id = $instructor_id',
+    'department_id': f'(i)-[:{Relations.INSTRUCTOR_DEPARTMENT}]->(:{Department.node_type} {{department_id: $department_id}})',
+    'tag': f'(t)-[:{Relations.THESIS_TAG}]->(:Tag {{name: $tag}})',
+}
+
+THESIS_PAGE_QUERY = f'''
+    MATCH (t:{Thesis.node_type})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    {{where}}
+    RETURN t, i.id AS instructor_id
+    ORDER BY t.thesis_name
+    LIMIT $limit
+'''
+
+
+def thesis_page_query(filters: list) -> str:
+    """
+    register the page query with the conditions of the filters on first use
+    :param filters: names of the given filters, in THESIS_PAGE_FILTERS order
+    :return: query name, "thesis.page" followed by the filter names
+    """
+    name = 'thesis.page'
+    where = ''
+    if filters:
+        name += ':' + ','.join(filters)
+        where = 'WHERE ' + '\n      AND '.join(THESIS_PAGE_FILTERS[key]
+                                                for key in filters)
+    if name not in queries.QUERIES:
+        queries.register(name, THESIS_PAGE_QUERY.format(where=where))
+    return name
+
+
+INSTRUCTOR_BY_ID = queries.register('instructor.by_id', f'''
+    MATCH (i:{Instructor.node_type} {{id: $id}})
+    RETURN i
+''')
+
+INSTRUCTOR_CREATE = queries.register('instructor.create', f'''
+    MATCH (d:{Department.node_type} {{department_id: $department_id}})
+    CREATE (i:{Instructor.node_type})
+    SET i = $props
+    CREATE (d)-[:{Relations.DEPARTMENT_INSTRUCTOR}]->(i),
+           (i)-[:{Relations.INSTRUCTOR_DEPARTMENT}]->(d)
+    RETURN i
+''')
+
+INSTRUCTOR_THESES = queries.register('instructor.theses', f'''
+    MATCH (:{Instructor.node_type} {{id: $id}})-[:{Relations.INSTRUCTOR_THESIS}]->(t:{Thesis.node_type})
+    RETURN t
+''')
+
+INSTRUCTOR_COUNTERS = queries.register('instructor.counters', f'''
+    MATCH (i:{Instructor.node_type} {{id: $id}})
+    RETURN i.load AS load, coalesce(i.theses_offered, 0) AS theses_offered,
+           coalesce(i.theses_enrolled, 0) AS theses_enrolled
+''')
+
+INSTRUCTOR_DELETE_THESIS = queries.register('instructor.delete_thesis', f'''
+    MATCH (t:{Thesis.node_type} {{thesis_name: $thesis_name}})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type} {{id: $instructor_id}})
+    SET i.theses_offered = coalesce(i.theses_offered, 1) - 1,
+        i.theses_enrolled = coalesce(i.theses_enrolled, 0) -
+            CASE WHEN t.student_id IS NULL THEN 0 ELSE 1 END
+    CREATE (:{Thesis.tombstone_type} {{thesis_name: t.thesis_name, id: t.id,
+        instructor_id: i.id, update_ts: $ts}})
+    DETACH DELETE t
+    WITH count(*) AS deleted
+    OPTIONAL MATCH (old:{Thesis.tombstone_type})
+    WHERE old.update_ts < $expired
+    DELETE old
+    RETURN DISTINCT deleted
+''')
+
+GROUP_BY_ID = queries.register('group.by_id', f'''
+    MATCH (g:{Group.node_type} {{id: $id}})
+    RETURN g
+''')
+
+GROUP_CREATE = queries.register('group.create', f'''
+    MATCH (d:{Department.node_type} {{department_id: $department_id}})
+    CREATE (g:{Group.node_type})
+    SET g = $props
+    CREATE (d)-[:{Relations.DEPARTMENT_GROUP}]->(g),
+           (g)-[:{Relations.GROUP_DEPARTMENT}]->(d)
+    RETURN g
+''')
+
+GROUP_YEARS = queries.register('group.years', f'''
+    MATCH (g:{Group.node_type})
+    RETURN g.id AS id, g.year AS year
+''')
+
+DEPARTMENT_BY_ID = queries.register('department.by_id', f'''
+    MATCH (d:{Department.node_type} {{department_id: $department_id}})
+    RETURN d
+''')
+
+DEPARTMENT_CREATE = queries.register('department.create', f'''
+    CREATE (d:{Department.node_type})
+    SET d = $props
+    RETURN d
+''')
@@ -0,0 +1,68 @@
+"""
+Coordinator for requests that write to both mongodb and Neo4j.
+
+The writes of one request are independent of each other, so they are run
+concurrently on a bounded thread pool and the request waits for the slower
+store instead of both in turn. Every write registers a compensation; when
+one of the writes fails, the compensations of the writes that succeeded are
+run, so no store is left with half of the change.
+"""
+import contextvars
+import logging
+from concurrent.futures import Executor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DualWrite:
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.steps = []
+
+    def add(self, name: str, action: Callable,
+            compensation: Optional[Callable] = None) -> 'DualWrite':
+        """
+        :param name: name of the step, key of its result
+        :param action: called without arguments in a pool thread
+        :param compensation: called with the result of the action to undo
+        it, None if the step can not be undone
+        """
+        self.steps.append((name, action, compensation))
+        return self
+
+    def run(self) -> dict:
+        """
+        :return: results of the actions by step name
+        :raise: the exception of the first failed step, after compensating
+        the successful ones
+        """
+        # the actions run in the context of the request, so their database
+        # calls are counted for it (see db.metrics)
+        futures = [(name, self.executor.submit(
+                    contextvars.copy_context().run, action))
+                   for name, action, _ in self.steps]
+        results = {}
+        errors = []
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors.append((name, e))
+
+        if errors:
+            self.compensate(results)
+            raise errors[0][1]
+        return results
+
+    def compensate(self, results: dict):
+        for name, _, compensation in self.steps:
+            if name not in results:
+                continue
+            if compensation is None:
+                logger.error('step "%s" succeeded but can not be undone', name)
+                continue
+            try:
+                compensation(results[name])
+            except Exception:
+                logger.exception('compensation of step "%s" failed', name)
@@ -0,0 +1,83 @@
+"""
+In-process notifications about thesis catalogue changes. Model methods in
+db.db_neo4j emit an event after their write has been committed, caches and
+indexes subscribe to keep themselves up to date.
+
+A Relay forwards the events of a process through the invalidation channel
+(see db.invalidation); the other processes emit them again to the
+listeners subscribed with remote=True.
+"""
+import json
+import logging
+from typing import Callable
+
+from db.invalidation import InvalidationChannel
+
+logger = logging.getLogger(__name__)
+
+THESIS_CREATED = 'thesis_created'  # payload: thesis (dict), instructor_id, tags
+THESIS_ENROLLED = 'thesis_enrolled'  # payload: thesis_name, student_id, ts
+THESIS_RELEASED = 'thesis_released'  # payload: thesis_name, student_id, ts
+THESIS_DELETED = 'thesis_deleted'  # payload: thesis_name, instructor_id
+THESES_IMPORTED = 'theses_imported'  # payload: rows (bulk import rows)
+# relayed without the rows, which may not fit into one message
+
+# invalidation message kind, the key is the JSON encoded [event, payload]
+REMOTE = 'thesis_event'
+
+_listeners = []
+_remote_listeners = []
+
+
+def subscribe(callback: Callable[[str, dict], None], remote: bool = False):
+    """
+    :param callback: called with (event, payload) in the thread that made
+    the change, it must be fast and must not raise
+    :param remote: also call it with the events of other processes, from
+    the thread receiving invalidations
+    """
+    _listeners.append(callback)
+    if remote:
+        _remote_listeners.append(callback)
+
+
+def unsubscribe(callback: Callable[[str, dict], None]):
+    for listeners in (_listeners, _remote_listeners):
+        if callback in listeners:
+            listeners.remove(callback)
+
+
+def emit(event: str, **payload):
+    _dispatch(_listeners, event, payload)
+
+
+def _dispatch(listeners: list, event: str, payload: dict):
+    for callback in list(listeners):
+        try:
+            callback(event, payload)
+        except Exception:
+            logger.exception('listener %r failed on %s', callback, event)
+
+
+class Relay:
+    def __init__(self, channel: InvalidationChannel):
+        self.channel = channel
+
+    def subscribe(self, receive: bool = True):
+        """
+        :param receive: also emit the events of other processes, False for
+        processes that only write (command line tools)
+        """
+        subscribe(self.on_event)
+        if receive:
+            self.channel.subscribe(self.on_invalidation)
+
+    def on_event(self, event: str, payload: dict):
+        if event == THESES_IMPORTED:
+            payload = {}
+        self.channel.publish(REMOTE, json.dumps([event, payload], default=str))
+
+    def on_invalidation(self, kind: str, key: str):
+        if kind == REMOTE:
+            event, payload = json.loads(key)
+            _dispatch(_remote_listeners, event, payload)
@@ -13,3 +13,17 @@ class ObjectDoesNotExist(Exception):
     def __init__(self, type_obj: str, params: dict):
         super().__init__(f'Object <{type_obj}> with fields {params} dose not '
                          f'exist in the database')
+
+
+class EnrolmentConflictException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class AdmissionRejectedException(Exception):
+    def __init__(self, message: str, retry_after: float):
+        """
+        :param retry_after: seconds after which the client should retry
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
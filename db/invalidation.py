@@ -0,0 +1,192 @@
+"""
+Invalidation channels broadcasting cache invalidations between worker
+processes. Every worker keeps its own user/session cache (see db.cache) and
+publishes an invalidation after each write; the other workers drop the
+affected entries when they receive it. Messages are best effort: an entry
+whose invalidation is lost is still bounded by the cache TTL.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, Optional
+
+from pymongo import CursorType
+from pymongo.database import Database
+
+logger = logging.getLogger(__name__)
+
+# message kinds
+USER = 'user'
+USER_SESSIONS = 'user_sessions'
+
+
+class InvalidationChannel:
+    """
+    base channel, also used when the app runs as a single process: messages
+    are dropped since there is nobody else to notify
+    """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def publish(self, kind: str, key: str):
+        pass
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """
+        :param callback: called with (kind, key) for every message published
+        by another process, from a background thread
+        """
+        self.callbacks.append(callback)
+        if len(self.callbacks) == 1:
+            self.listen()
+
+    def listen(self):
+        """
+        start receiving messages, called once on the first subscription
+        """
+        pass
+
+    def dispatch(self, kind: str, key: str):
+        for callback in self.callbacks:
+            try:
+                callback(kind, key)
+            except Exception:
+                logger.exception('failed to apply invalidation')
+
+    def close(self):
+        pass
+
+
+class UnixSocketChannel(InvalidationChannel):
+    """
+    every process binds a datagram socket in a shared directory and
+    publishes by sending a datagram to all other sockets found there
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(
+            directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        self._thread = None
+
+    def publish(self, kind: str, key: str):
+        data = json.dumps([kind, key]).encode()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith('.sock'):
+                continue
+            try:
+                self.sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # the process is gone, remove its socket file
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                logger.warning('invalidation dropped, %s is not reading', path)
+
+    def listen(self):
+        def receive():
+            while True:
+                try:
+                    data = self.sock.recv(65536)
+                except OSError:
+                    return  # closed
+                try:
+                    kind, key = json.loads(data)
+                except ValueError:
+                    logger.warning('malformed invalidation %r', data)
+                    continue
+                self.dispatch(kind, key)
+
+        self._thread = threading.Thread(target=receive, daemon=True,
+                                        name='invalidation-listener')
+        self._thread.start()
+
+    def close(self):
+        self.sock.close()
+        self.sender.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class MongoCappedChannel(InvalidationChannel):
+    """
+    messages are inserted into a capped collection that every process tails
+    with a tailable await cursor
+    """
+
+    def __init__(self, db: Database, collection: str, size: int,
+                 max_await_ms: int = 500):
+        super().__init__()
+        if collection not in db.list_collection_names():
+            db.create_collection(collection, capped=True, size=size)
+        self.collection = db.get_collection(collection)
+        self.origin = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.max_await_ms = max_await_ms
+        self._closed = threading.Event()
+        self._thread = None
+
+    def publish(self, kind: str, key: str):
+        self.collection.insert_one(
+            {'kind': kind, 'key': key, 'origin': self.origin})
+
+    def listen(self):
+        last = self.collection.find_one(sort=[('$natural', -1)])
+        last_id = last['_id'] if last else None
+
+        def receive():
+            nonlocal last_id
+            while not self._closed.is_set():
+                query = {} if last_id is None else {'_id': {'$gt': last_id}}
+                cursor = self.collection.find(
+                    query, cursor_type=CursorType.TAILABLE_AWAIT,
+                    max_await_time_ms=self.max_await_ms)
+                try:
+                    while cursor.alive and not self._closed.is_set():
+                        for message in cursor:
+                            last_id = message['_id']
+                            if message['origin'] != self.origin:
+                                self.dispatch(message['kind'], message['key'])
+                except Exception:
+                    logger.exception('invalidation tailing failed')
+                finally:
+                    cursor.close()
+                # an empty capped collection kills the cursor immediately
+                self._closed.wait(self.max_await_ms / 1000)
+
+        self._thread = threading.Thread(target=receive, daemon=True,
+                                        name='invalidation-listener')
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+
+
+def create_channel(kind: Optional[str], db: Optional[Database] = None,
+                   **options) -> InvalidationChannel:
+    """
+    :param kind: None, 'unix' (options: directory) or 'mongo' (options:
+    collection, size)
+    """
+    if not kind:
+        return InvalidationChannel()
+    if kind == 'unix':
+        return UnixSocketChannel(options['directory'])
+    if kind == 'mongo':
+        return MongoCappedChannel(db, options['collection'], options['size'])
+    raise ValueError(f'Unknown invalidation channel "{kind}"')
+
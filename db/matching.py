@@ -0,0 +1,249 @@
+"""
+Batch assignment of theses to the students of a department.
+
+Instead of racing for theses at Department.enrol_ts, students submit a
+ranked list of preferred theses (see DatabaseClient.user_set_preferences)
+and the assignment is computed for the whole department at once:
+
+* a student may only get a thesis of the year of their group,
+* an instructor supervises at most Instructor.load theses, theses that are
+  already taken count towards the load,
+* students are served in the order they submitted their preferences, each
+  gets the most preferred thesis still free.
+
+With one common priority order this is what student-proposing deferred
+acceptance produces, so the result is stable and nobody gains by lying
+about their preferences. It runs in time linear in the total length of the
+preference lists.
+
+Usage:
+    python -m db.matching DEPARTMENT_ID [--dry-run]
+"""
+import argparse
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from db import events, queries
+from db.clients import relay_writes
+from db.db_mongo import DatabaseClient
+from db.db_neo4j import GraphDatabaseClient, Thesis, Instructor, Group, \
+    Department, Relations, ThesisStatus
+
+WRITE_BATCH_SIZE = 2000
+
+NO_PREFERENCES = 'no preferences submitted'
+NO_GROUP = 'group of the student is not in the department'
+ALL_TAKEN = 'all preferred theses are taken, not eligible or the ' \
+            'instructors are fully loaded'
+CONFLICT = 'enrolled for another thesis while the assignment was written'
+TAKEN = 'the thesis was taken or the instructor fully loaded by an ' \
+        'enrolment while the assignment was written'
+
+DEPARTMENT_THESES = queries.register('matching.department_theses', f'''
+    MATCH (:{Department.node_type} {{department_id: $department_id}})-[:{Relations.DEPARTMENT_INSTRUCTOR}]->(i:{Instructor.node_type})-[:{Relations.INSTRUCTOR_THESIS}]->(t:{Thesis.node_type})
+    RETURN t.thesis_name AS thesis_name, t.year AS year,
+           t.student_id AS student_id, i.id AS instructor_id, i.load AS load
+''')
+
+DEPARTMENT_GROUPS = queries.register('matching.department_groups', f'''
+    MATCH (:{Department.node_type} {{department_id: $department_id}})-[:{Relations.DEPARTMENT_GROUP}]->(g:{Group.node_type})
+    RETURN g.id AS id, g.year AS year
+''')
+
+# takes the write locks of thesis.enrol, so concurrent enrolments through
+# the API wait; per instructor the free theses are granted up to the load
+# left, the counter is raised once by the number granted
+ASSIGN_QUERY = queries.register('matching.assign', f'''
+    UNWIND $rows AS row
+    MATCH (t:{Thesis.node_type} {{thesis_name: row.thesis_name}})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    SET t._lock = true, i._lock = true
+    WITH i, collect({{thesis: t, student_id: row.student_id}}) AS claims
+    WITH i, claims, [claim IN claims WHERE claim.thesis.student_id IS NULL]
+         AS free, CASE WHEN i.load IS NULL THEN size(claims)
+                       ELSE i.load - coalesce(i.theses_enrolled, 0) END
+         AS capacity
+    WITH i, claims,
+         CASE WHEN capacity > 0 THEN free[0..capacity] ELSE [] END AS granted
+    SET i.theses_enrolled = coalesce(i.theses_enrolled, 0) + size(granted)
+    REMOVE i._lock
+    WITH claims, granted
+    UNWIND claims AS claim
+    WITH claim.thesis AS t, claim.student_id AS student_id,
+         claim IN granted AS assigned
+    FOREACH (_ IN CASE WHEN assigned THEN [1] ELSE [] END |
+        SET t.student_id = student_id, t.student_enrol_ts = $ts,
+            t.update_ts = $ts, t.status = $status)
+    REMOVE t._lock
+    WITH student_id, assigned
+    WHERE assigned
+    RETURN student_id
+''')
+
+UNASSIGN_QUERY = queries.register('matching.unassign', f'''
+    UNWIND $rows AS row
+    MATCH (t:{Thesis.node_type} {{thesis_name: row.thesis_name}})-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    WHERE t.student_id = row.student_id
+    REMOVE t.student_id, t.student_enrol_ts
+    SET t.status = $status, t.update_ts = $ts,
+        i.theses_enrolled = coalesce(i.theses_enrolled, 1) - 1
+''')
+
+
+class MatchingReport:
+    def __init__(self):
+        self.assigned = {}  # student id -> thesis_name
+        self.unmatched = []  # list of (student id, reason)
+        self.already_enrolled = 0
+        self.elapsed = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'assigned': len(self.assigned),
+            'already_enrolled': self.already_enrolled,
+            'unmatched': [{'student_id': student_id, 'reason': reason}
+                          for student_id, reason in self.unmatched],
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+def solve(students: List[dict], theses: Dict[str, dict],
+          loads: Dict[str, Optional[int]],
+          report: Optional[MatchingReport] = None) -> MatchingReport:
+    """
+    :param students: dicts with _id, year, preferences (thesis names, best
+    first) and preferences_ts, students with a thesis_id are skipped
+    :param theses: thesis_name -> dict with year, instructor_id, student_id
+    :param loads: instructor id -> maximum number of theses, None - no limit
+    """
+    report = report or MatchingReport()
+    remaining = dict(loads)
+    for thesis in theses.values():
+        if thesis.get('student_id') and remaining.get(thesis['instructor_id']) \
+                is not None:
+            remaining[thesis['instructor_id']] -= 1
+    taken = {name for name, thesis in theses.items() if thesis.get('student_id')}
+
+    queue = []
+    for student in students:
+        if student.get('thesis_id'):
+            report.already_enrolled += 1
+        elif student.get('year') is None:
+            report.unmatched.append((str(student['_id']), NO_GROUP))
+        elif not student.get('preferences'):
+            report.unmatched.append((str(student['_id']), NO_PREFERENCES))
+        else:
+            queue.append(student)
+    # earlier submissions first, the id makes the order deterministic
+    queue.sort(key=lambda x: (x.get('preferences_ts') or 0, str(x['_id'])))
+
+    for student in queue:
+        student_id = str(student['_id'])
+        for name in student['preferences']:
+            thesis = theses.get(name)
+            if thesis is None or name in taken \
+                    or thesis['year'] != student['year']:
+                continue
+            left = remaining.get(thesis['instructor_id'])
+            if left is not None and left <= 0:
+                continue
+            if left is not None:
+                remaining[thesis['instructor_id']] = left - 1
+            taken.add(name)
+            report.assigned[student_id] = name
+            break
+        else:
+            report.unmatched.append((student_id, ALL_TAKEN))
+    return report
+
+
+def load_department(graph: GraphDatabaseClient, mongo: DatabaseClient,
+                    department_id: str):
+    """
+    :return: students (with their group year), theses and instructor loads
+    of the department, the arguments of solve
+    """
+    params = {'department_id': department_id}
+    theses, loads = {}, {}
+    for record in graph.run_query(DEPARTMENT_THESES, params).data():
+        theses[record['thesis_name']] = record
+        loads[record['instructor_id']] = record['load']
+    years = {record['id']: record['year']
+             for record in graph.run_query(DEPARTMENT_GROUPS, params).data()}
+
+    students = mongo.users_with_preferences(list(years))
+    for student in students:
+        student['year'] = years.get(student.get('group_id'))
+    return students, theses, loads
+
+
+def write_assignments(graph: GraphDatabaseClient, mongo: DatabaseClient,
+                      report: MatchingReport):
+    """
+    claim the assigned theses in Neo4j, then the students in mongodb, in
+    batches; a thesis or student taken by a concurrent enrolment is
+    reported as unmatched and its half of the assignment is undone
+    """
+    ts = datetime.now().timestamp()
+    rows = [{'student_id': student_id, 'thesis_name': name}
+            for student_id, name in report.assigned.items()]
+    for start in range(0, len(rows), WRITE_BATCH_SIZE):
+        batch = rows[start:start + WRITE_BATCH_SIZE]
+        claimed = {record['student_id'] for record in graph.run_query(
+            ASSIGN_QUERY, {'rows': batch, 'ts': ts,
+                           'status': ThesisStatus.ENROLLED}).data()}
+        batch = [row for row in batch if row['student_id'] in claimed]
+        enrolled = mongo.users_enrol_theses(
+            {row['student_id']: row['thesis_name'] for row in batch})
+        failed = [row for row in batch if row['student_id'] not in enrolled]
+        if failed:
+            graph.run_query(UNASSIGN_QUERY, {
+                'rows': failed, 'ts': ts, 'status': ThesisStatus.CREATED})
+
+        for row in rows[start:start + WRITE_BATCH_SIZE]:
+            if row['student_id'] not in enrolled:
+                del report.assigned[row['student_id']]
+                report.unmatched.append((
+                    row['student_id'],
+                    CONFLICT if row['student_id'] in claimed else TAKEN))
+        for row in batch:
+            if row['student_id'] in enrolled:
+                events.emit(events.THESIS_ENROLLED,
+                            thesis_name=row['thesis_name'],
+                            student_id=row['student_id'], ts=ts)
+
+
+def match_department(graph: GraphDatabaseClient, mongo: DatabaseClient,
+                     department_id: str, dry_run: bool = False
+                     ) -> MatchingReport:
+    started = time.perf_counter()
+    report = solve(*load_department(graph, mongo, department_id))
+    if not dry_run:
+        write_assignments(graph, mongo, report)
+    report.unmatched.sort()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Assign theses to the students of a department')
+    parser.add_argument('department_id')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='compute the assignment without writing it')
+    args = parser.parse_args()
+
+    mongo = DatabaseClient()
+    if not args.dry_run:
+        relay_writes(mongo.invalidation)
+    report = match_department(GraphDatabaseClient(), mongo,
+                              args.department_id, args.dry_run)
+    for student_id, reason in report.unmatched:
+        print(f'{student_id}: {reason}')
+    print(f'assigned {len(report.assigned)}, unmatched '
+          f'{len(report.unmatched)}, already enrolled '
+          f'{report.already_enrolled} in {report.elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+Request and database call metrics.
+
+The mongodb collections and the py2neo graph are wrapped in proxies which
+time every call that goes to the server. Calls are added to the statistics
+of the current request (a context variable, copied into the pool threads of
+db.dual_write) and to process wide histograms rendered in the Prometheus
+text format. Every worker process exports its own histograms.
+"""
+import contextvars
+import threading
+import time
+from typing import Optional
+
+from db import queries
+
+# seconds
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+# collection methods which do not talk to the server
+LOCAL_COLLECTION_METHODS = {'with_options', 'get_collection'}
+GRAPH_METHODS = {'run', 'create', 'push', 'pull', 'merge', 'delete',
+                 'separate', 'evaluate', 'exists'}
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = \
+                    [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self.series.items())
+        for label_values, (counts, total, count) in items:
+            labels = ','.join(f'{key}="{escape(value)}"' for key, value
+                              in zip(self.labels, label_values))
+            prefix = labels + ',' if labels else ''
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} '
+                             f'{bucket_count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values):
+        with self._lock:
+            self.series[label_values] = value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} gauge']
+        with self._lock:
+            items = sorted(self.series.items())
+        for label_values, value in items:
+            labels = ','.join(f'{key}="{escape(value)}"' for key, value
+                              in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Duration of HTTP requests',
+    ('endpoint', 'method', 'status'), DURATION_BUCKETS)
+DB_CALL_DURATION = Histogram(
+    'db_call_duration_seconds', 'Duration of database calls',
+    ('endpoint', 'store', 'operation'), DURATION_BUCKETS)
+DB_ROUND_TRIPS = Histogram(
+    'db_round_trips_per_request', 'Database calls made by one request',
+    ('endpoint', 'store'), ROUND_TRIP_BUCKETS)
+ADMISSION_WAIT = Histogram(
+    'admission_wait_seconds', 'Time requests waited for admission',
+    ('pool', 'outcome'), DURATION_BUCKETS)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'admission_queue_depth', 'Requests waiting for admission', ('pool',))
+ADMISSION_IN_FLIGHT = Gauge(
+    'admission_in_flight', 'Admitted requests being served', ('pool',))
+METRICS = [REQUEST_DURATION, DB_CALL_DURATION, DB_ROUND_TRIPS,
+           ADMISSION_WAIT, ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT]
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.calls = {}  # store -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def add(self, store: str, seconds: float):
+        with self._lock:
+            stats = self.calls.setdefault(store, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def finish(self, method: str, status: int, stores=('mongo', 'neo4j')):
+        REQUEST_DURATION.observe(time.perf_counter() - self.started,
+                                 self.endpoint, method, status)
+        for store in stores:
+            DB_ROUND_TRIPS.observe(self.calls.get(store, [0])[0],
+                                   self.endpoint, store)
+
+    def server_timing(self) -> str:
+        """
+        :return: value of the Server-Timing header
+        """
+        parts = [f'{store};dur={seconds * 1000:.2f};desc="{count} calls"'
+                 for store, (count, seconds) in sorted(self.calls.items())]
+        parts.append(
+            f'total;dur={(time.perf_counter() - self.started) * 1000:.2f}')
+        return ', '.join(parts)
+
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def start_request(endpoint: Optional[str]) -> RequestStats:
+    stats = RequestStats(endpoint or 'unknown')
+    _current.set(stats)
+    return stats
+
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def end_request():
+    _current.set(None)
+
+
+def record_call(store: str, operation: str, seconds: float):
+    stats = _current.get()
+    endpoint = stats.endpoint if stats is not None else 'none'
+    if stats is not None:
+        stats.add(store, seconds)
+    DB_CALL_DURATION.observe(seconds, endpoint, store, operation)
+
+
+def timed(store: str, operation: str, function):
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record_call(store, operation, time.perf_counter() - started)
+    return call
+
+
+class InstrumentedCollection:
+    """
+    mongodb collection proxy timing every call
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute) or name in LOCAL_COLLECTION_METHODS:
+            return attribute
+        return timed('mongo', name, attribute)
+
+
+def query_operation(text: str) -> str:
+    return queries.name_of(text) or 'cypher'
+
+
+class InstrumentedTransaction:
+    def __init__(self, tx):
+        self._tx = tx
+
+    def run(self, text: str, parameters: Optional[dict] = None, **kwargs):
+        return timed('neo4j', query_operation(text), self._tx.run)(
+            text, parameters, **kwargs)
+
+    def commit(self):
+        return timed('neo4j', 'commit', self._tx.commit)()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._tx, name)
+        if callable(attribute) and name in GRAPH_METHODS:
+            return timed('neo4j', name, attribute)
+        return attribute
+
+
+class InstrumentedGraph:
+    """
+    py2neo Graph proxy timing every call, queries are labelled with their
+    template name (see db.queries)
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def run(self, text: str, parameters: Optional[dict] = None, **kwargs):
+        return timed('neo4j', query_operation(text), self._graph.run)(
+            text, parameters, **kwargs)
+
+    def begin(self, *args, **kwargs):
+        return InstrumentedTransaction(self._graph.begin(*args, **kwargs))
+
+    def __getattr__(self, name):
+        attribute = getattr(self._graph, name)
+        if callable(attribute) and name in GRAPH_METHODS:
+            return timed('neo4j', name, attribute)
+        return attribute
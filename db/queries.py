@@ -0,0 +1,34 @@
+"""
+Registry of named Cypher query templates.
+
+Every statement the data layer sends to Neo4j is registered here under a
+name and only receives values through parameters, so the query text of a
+template never changes and Neo4j reuses its cached execution plan. Run a
+template with GraphDatabaseClient.run_query(name, parameters).
+"""
+from typing import Optional
+
+QUERIES = {}
+_NAMES = {}  # query text -> name
+
+
+def register(name: str, text: str) -> str:
+    """
+    :return: the name, to be kept in a module level constant
+    """
+    if QUERIES.get(name, text) != text:
+        raise ValueError(f'Query "{name}" is already registered')
+    QUERIES[name] = text
+    _NAMES[text] = name
+    return name
+
+
+def get(name: str) -> str:
+    return QUERIES[name]
+
+
+def name_of(text: str) -> Optional[str]:
+    """
+    :return: name of the template with this text, None for other queries
+    """
+    return _NAMES.get(text)
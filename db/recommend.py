@@ -0,0 +1,232 @@
+"""
+Thesis recommendations for students.
+
+Theses are rows of a sparse thesis x tag matrix (idf weighted, rows
+normalised), the interests of students are rows of a student x tag matrix
+over the same vocabulary. One sparse product gives the tag similarity of a
+batch of students to every thesis, year fit and difficulty fit are added as
+dense arrays. The first request of a student scores the whole group of the
+student in one pass and caches the best theses of everybody in it, so the
+enrolment-day peak is served from memory.
+
+The matrix is built from the in-memory search index (db.search), not from
+Neo4j, and rebuilt lazily after the catalogue changes; enrolments only flip
+the availability of one row.
+"""
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from db import events
+from db.cache import LRUCache
+from db.invalidation import USER
+
+# weights of the parts of the score, tag similarity is in [0, 1], year and
+# difficulty fit are in [0, 1]
+TAGS_WEIGHT = 1.0
+YEAR_WEIGHT = 0.5
+DIFFICULTY_WEIGHT = 0.2
+DEFAULT_DIFFICULTY = 3
+# students scored together, bounds the dense score matrix to
+# BATCH_SIZE x number of theses
+BATCH_SIZE = 32
+# best theses kept per student, the cached list is filtered by availability
+# when it is served
+DEPTH = 100
+
+
+class Recommender:
+    def __init__(self, theses: Callable[[], Iterable[Tuple[dict, list]]],
+                 group_years: Callable[[], dict], max_size: int):
+        """
+        :param theses: returns (thesis dict, tag names) pairs of the catalogue
+        :param group_years: returns group id -> university year
+        :param max_size: number of students with cached recommendations
+        """
+        self.load_theses = theses
+        self.load_group_years = group_years
+        self.cache = LRUCache(max_size)  # student id -> (version, rows)
+        self.version = 0
+        self.dirty = True
+        self.group_years = None
+
+        self.names = []
+        self.rows = {}  # thesis_name -> row
+        self.vocabulary = {}  # tag -> column
+        self.tags = None  # sparse thesis x tag matrix
+        self.years = None
+        self.difficulties = None
+        self.available = None
+        self._lock = threading.RLock()
+
+    def subscribe(self):
+        # thesis changes of other workers and command line tools too
+        events.subscribe(self.on_event, remote=True)
+
+    def rebuild(self):
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        # runs under the lock, so no enrolment event is lost between loading
+        # the theses and publishing the new matrix
+        names, years, difficulties, available = [], [], [], []
+        vocabulary = {}
+        rows, columns = [], []
+        for thesis, tags in self.load_theses():
+            row = len(names)
+            names.append(thesis['thesis_name'])
+            years.append(thesis.get('year') or 0)
+            difficulties.append(thesis.get('difficulty') or DEFAULT_DIFFICULTY)
+            available.append(not thesis.get('student_id'))
+            for tag in set(tags or ()):
+                rows.append(row)
+                columns.append(vocabulary.setdefault(tag, len(vocabulary)))
+
+        shape = (len(names), len(vocabulary))
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape)
+        # rare tags say more about a thesis than the popular ones
+        frequency = np.bincount(columns, minlength=shape[1])
+        idf = np.log((1 + shape[0]) / (1 + frequency)) + 1
+        matrix = normalize_rows(matrix @ sparse.diags(idf.astype(np.float32)))
+
+        self.names = names
+        self.rows = {name: row for row, name in enumerate(names)}
+        self.vocabulary = vocabulary
+        self.tags = matrix.T.tocsr()  # tag x thesis, ready for products
+        self.years = np.array(years, dtype=np.float32)
+        self.difficulties = np.array(difficulties, dtype=np.float32)
+        self.available = np.array(available, dtype=bool)
+        self.version += 1
+        self.dirty = False
+
+    def year_of(self, student: dict) -> Optional[int]:
+        group_id = student.get('group_id')
+        if not group_id:
+            return None
+        if self.group_years is None or group_id not in self.group_years:
+            self.group_years = self.load_group_years()
+            # unknown groups are remembered, so they do not reload every time
+            self.group_years.setdefault(group_id, None)
+        return self.group_years[group_id]
+
+    def score(self, students: list) -> np.ndarray:
+        """
+        :param students: student dicts with optional "interests" (tag
+        names), "group_id" and "difficulty" (preferred, 1-5)
+        :return: students x theses scores, taken theses score -inf
+        """
+        rows, columns = [], []
+        for row, student in enumerate(students):
+            for tag in set(student.get('interests') or ()):
+                column = self.vocabulary.get(tag)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        interests = normalize_rows(sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(len(students), len(self.vocabulary))))
+        scores = TAGS_WEIGHT * (interests @ self.tags).toarray()
+
+        years = np.array([self.year_of(student) or np.nan
+                          for student in students], dtype=np.float32)
+        year_fit = 1 / (1 + np.abs(self.years[None, :] - years[:, None]))
+        # students without a group get no year preference
+        scores += YEAR_WEIGHT * np.nan_to_num(year_fit)
+
+        preferred = np.array([student.get('difficulty') or DEFAULT_DIFFICULTY
+                              for student in students], dtype=np.float32)
+        scores += DIFFICULTY_WEIGHT * (
+            1 - np.abs(self.difficulties[None, :] - preferred[:, None]) / 4)
+
+        scores[:, ~self.available] = -np.inf
+        return scores
+
+    def precompute(self, students: list):
+        """
+        score the students in batches and cache their best theses
+        """
+        with self._lock:
+            if self.dirty:
+                self.rebuild()
+            version = self.version
+            depth = min(DEPTH, len(self.names))
+            for start in range(0, len(students), BATCH_SIZE):
+                batch = students[start:start + BATCH_SIZE]
+                if not depth:
+                    best = [np.empty(0, dtype=np.intp)] * len(batch)
+                else:
+                    best = top_rows(self.score(batch), depth)
+                for student, rows in zip(batch, best):
+                    self.cache.set(str(student['_id']), (version, rows))
+
+    def recommend(self, student: dict, limit: int = 20,
+                  group: Optional[Callable[[], list]] = None) -> list:
+        """
+        :param group: returns the students of the group of the student,
+        they are scored together on a cache miss
+        :return: available thesis names, best first
+        """
+        student_id = str(student['_id'])
+        for attempt in range(2):
+            with self._lock:
+                if self.dirty:
+                    self.rebuild()
+                cached = self.cache.get(student_id)
+                if cached is not None and cached[0] == self.version:
+                    rows = [row for row in cached[1] if self.available[row]]
+                    # the cached list may have run out of free theses
+                    if len(rows) >= limit or len(cached[1]) < DEPTH \
+                            or attempt:
+                        return [self.names[row] for row in rows[:limit]]
+            students = [student]
+            if attempt == 0 and group is not None:
+                students += [other for other in group()
+                             if str(other['_id']) != student_id]
+            self.precompute(students)
+        return []
+
+    def forget(self, student_id: str):
+        """
+        drop cached recommendations, e.g. after the interests changed
+        """
+        self.cache.pop(str(student_id))
+
+    def on_invalidation(self, kind: str, key: str):
+        if kind == USER:
+            self.forget(key)
+
+    def on_event(self, event: str, payload: dict):
+        with self._lock:
+            if event in (events.THESIS_ENROLLED, events.THESIS_RELEASED) \
+                    and not self.dirty:
+                row = self.rows.get(payload['thesis_name'])
+                if row is not None:
+                    self.available[row] = event == events.THESIS_RELEASED
+                    return
+            self.dirty = True
+
+
+def normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ matrix).tocsr()
+
+
+def top_rows(scores: np.ndarray, depth: int) -> list:
+    """
+    :return: for every row of scores the column indexes of its best
+    finite scores, best first
+    """
+    if depth < scores.shape[1]:
+        best = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+    else:
+        best = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    result = []
+    for row, columns in zip(scores, best):
+        columns = columns[np.argsort(-row[columns], kind='stable')]
+        result.append(columns[np.isfinite(row[columns])])
+    return result
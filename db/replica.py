@@ -0,0 +1,416 @@
+"""
+In-memory read replica of the thesis graph.
+
+The replica keeps departments, groups, instructors and theses with their
+tags in compact __slots__ records with adjacency indexes (instructor ->
+theses, tag -> theses, sorted thesis names for pages), and answers the read
+side of GraphDatabaseClient from them. Writes still go to Neo4j.
+
+A background thread polls Neo4j for theses with a newer update_ts and for
+tombstones of deleted theses (Thesis.find_changes), changes made in this
+process are applied at once from db.events. Changed departments, groups and
+instructors are picked up by a periodic full reload. Other workers therefore
+see a change after at most one poll interval; enrolment itself is still
+decided by Neo4j.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Iterator, Optional, Tuple
+
+from db import events, queries
+from db.db_neo4j import GraphDatabaseClient, Thesis, Instructor, Group, \
+    Department, Relations, CLOCK_SKEW
+from db.serialize import compile_serializer
+
+logger = logging.getLogger(__name__)
+
+THESES_ALL_QUERY = queries.register('replica.theses_all', f'''
+    MATCH (t:{Thesis.node_type})
+    OPTIONAL MATCH (t)-[:{Relations.THESIS_INSTRUCTOR}]->(i:{Instructor.node_type})
+    OPTIONAL MATCH (t)-[:{Relations.THESIS_TAG}]->(tag:Tag)
+    RETURN t, i.id AS instructor_id, collect(tag.name) AS tags
+''')
+
+INSTRUCTORS_QUERY = queries.register('replica.instructors', f'''
+    MATCH (i:{Instructor.node_type})
+    OPTIONAL MATCH (i)-[:{Relations.INSTRUCTOR_DEPARTMENT}]->(d:{Department.node_type})
+    RETURN i, d.department_id AS department_id
+''')
+
+GROUPS_QUERY = queries.register('replica.groups', f'''
+    MATCH (g:{Group.node_type})
+    OPTIONAL MATCH (g)-[:{Relations.GROUP_DEPARTMENT}]->(d:{Department.node_type})
+    RETURN g, d.department_id AS department_id
+''')
+
+DEPARTMENTS_QUERY = queries.register('replica.departments', f'''
+    MATCH (d:{Department.node_type})
+    RETURN d
+''')
+
+
+class Record:
+    """
+    node properties in slots, properties outside of FIELDS are dropped
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, properties: dict):
+        for name in self.FIELDS:
+            setattr(self, name, properties.get(name))
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.to_dict = compile_serializer(cls.FIELDS, drop_falsy=False)
+
+    def matches(self, properties: dict) -> bool:
+        return all(getattr(self, name, None) == value
+                   for name, value in properties.items())
+
+
+class ThesisRecord(Record):
+    FIELDS = ('id', 'thesis_name', 'description', 'year', 'difficulty',
+              'status', 'score', 'student_id', 'student_info', 'creation_ts',
+              'student_enrol_ts', 'update_ts')
+    __slots__ = FIELDS + ('instructor_id', 'tags')
+
+
+class InstructorRecord(Record):
+    FIELDS = ('id', 'degree', 'load', 'classroom', 'theses_offered',
+              'theses_enrolled')
+    __slots__ = FIELDS + ('department_id',)
+
+
+class GroupRecord(Record):
+    FIELDS = ('id', 'name', 'year', 'degree')
+    __slots__ = FIELDS + ('department_id',)
+
+
+class DepartmentRecord(Record):
+    FIELDS = ('department_id', 'name', 'faculty', 'enrol_ts',
+              'predefence_ts', 'defence_ts')
+    __slots__ = FIELDS
+
+
+def same_records(old: dict, new: dict) -> bool:
+    """
+    :param old: key -> Record
+    :param new: key -> Record
+    :return: True if both have the same records with the same properties
+    """
+    if old.keys() != new.keys():
+        return False
+    return all(old[key].to_dict() == record.to_dict() and
+               getattr(old[key], 'department_id', None) ==
+               getattr(record, 'department_id', None)
+               for key, record in new.items())
+
+
+class GraphReplica:
+    def __init__(self, client: GraphDatabaseClient,
+                 poll_interval: float = 1.0, reload_interval: float = 60.0,
+                 on_change: Optional[Callable[[], None]] = None):
+        """
+        :param poll_interval: seconds between two polls of update_ts
+        :param reload_interval: seconds between two full reloads
+        :param on_change: called after changes from Neo4j have been applied,
+        e.g. to invalidate cached responses built from the replica
+        """
+        self.client = client
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.on_change = on_change
+
+        self.theses = {}  # thesis_name -> ThesisRecord
+        self.names = []  # sorted thesis names
+        self.by_instructor = {}  # instructor id -> set of thesis names
+        self.by_tag = {}  # tag -> set of thesis names
+        self.instructors = {}  # id -> InstructorRecord
+        self.groups = {}  # id -> GroupRecord
+        self.departments = {}  # department_id -> DepartmentRecord
+        self.records = {Thesis.node_type: self.theses,
+                        Instructor.node_type: self.instructors,
+                        Group.node_type: self.groups,
+                        Department.node_type: self.departments}
+
+        self.since = 0.0
+        self.loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # loading
+
+    def start(self):
+        """
+        load the graph and start polling in a daemon thread
+        """
+        self.reload()
+        events.subscribe(self.on_event)
+        self._thread = threading.Thread(target=self._poll_forever,
+                                        name='graph-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        events.unsubscribe(self.on_event)
+
+    def _poll_forever(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if time.monotonic() - self.loaded_at >= self.reload_interval:
+                    self.reload()
+                else:
+                    self.poll()
+            except Exception:
+                logger.exception('replica refresh failed')
+
+    def reload(self):
+        """
+        load everything, theses missing in Neo4j are dropped
+        """
+        started = time.time()
+        departments = {record['d']['department_id']:
+                       DepartmentRecord(record['d']) for record in
+                       self.client.run_query(DEPARTMENTS_QUERY).data()}
+        groups = {}
+        for record in self.client.run_query(GROUPS_QUERY).data():
+            group = GroupRecord(record['g'])
+            group.department_id = record['department_id']
+            groups[group.id] = group
+        instructors = {}
+        for record in self.client.run_query(INSTRUCTORS_QUERY).data():
+            instructor = InstructorRecord(record['i'])
+            instructor.department_id = record['department_id']
+            instructors[instructor.id] = instructor
+        rows = self.client.run_query(THESES_ALL_QUERY).data()
+
+        with self._lock:
+            changed = not (same_records(self.departments, departments) and
+                           same_records(self.groups, groups) and
+                           same_records(self.instructors, instructors))
+            self.departments.clear()
+            self.departments.update(departments)
+            self.groups.clear()
+            self.groups.update(groups)
+            self.instructors.clear()
+            self.instructors.update(instructors)
+            present = set()
+            for row in rows:
+                present.add(row['t']['thesis_name'])
+                changed |= self._put_row(row)
+            for name in set(self.theses) - present:
+                changed |= self._remove(name)
+            self.since = max(self.since, started - CLOCK_SKEW)
+            self.loaded_at = time.monotonic()
+        # a reload finding nothing new keeps the cached responses and ETags
+        if changed:
+            self._changed()
+
+    def poll(self) -> int:
+        """
+        apply the theses updated or deleted since the last poll
+        :return: number of updated or deleted theses
+        """
+        started = time.time()
+        theses, deleted = Thesis.find_changes(self.client, self.since)
+        changed = 0
+        with self._lock:
+            # a thesis deleted and created again is in both lists
+            for name, _ in deleted:
+                changed += self._remove(name)
+            for thesis in theses:
+                changed += self._put_row({
+                    't': thesis, 'instructor_id': thesis.pop('instructor_id'),
+                    'tags': thesis.pop('tags')})
+            self.since = max(self.since, started - CLOCK_SKEW)
+        if changed:
+            self._changed()
+        return changed
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _put_row(self, row: dict) -> bool:
+        current = self.theses.get(row['t']['thesis_name'])
+        if current is not None and \
+                (current.update_ts or 0) >= (row['t'].get('update_ts') or 0) \
+                and current.student_id == row['t'].get('student_id'):
+            return False
+        self.put_thesis(row['t'], row['instructor_id'], row['tags'])
+        return True
+
+    def put_thesis(self, properties: dict, instructor_id: Optional[str],
+                   tags: list):
+        with self._lock:
+            name = properties['thesis_name']
+            if name in self.theses:
+                self._remove(name)
+            thesis = ThesisRecord(properties)
+            thesis.instructor_id = instructor_id
+            thesis.tags = tuple(sorted(tags or ()))
+            self.theses[name] = thesis
+            insort(self.names, name)
+            self.by_instructor.setdefault(instructor_id, set()).add(name)
+            for tag in thesis.tags:
+                self.by_tag.setdefault(tag, set()).add(name)
+
+    def _remove(self, name: str) -> bool:
+        thesis = self.theses.pop(name, None)
+        if thesis is None:
+            return False
+        del self.names[bisect_left(self.names, name)]
+        self.by_instructor[thesis.instructor_id].discard(name)
+        for tag in thesis.tags:
+            self.by_tag[tag].discard(name)
+            if not self.by_tag[tag]:
+                del self.by_tag[tag]
+        return True
+
+    def on_event(self, event: str, payload: dict):
+        with self._lock:
+            if event == events.THESIS_CREATED:
+                self.put_thesis(payload['thesis'], payload['instructor_id'],
+                                payload.get('tags'))
+            elif event == events.THESES_IMPORTED:
+                for row in payload['rows']:
+                    self.put_thesis(row['props'], row['instructor_id'],
+                                    row['tags'])
+            elif event in (events.THESIS_ENROLLED, events.THESIS_RELEASED):
+                thesis = self.theses.get(payload['thesis_name'])
+                if thesis is not None:
+                    # a new record, iter_all may be serialising the old one
+                    enrolled = event == events.THESIS_ENROLLED
+                    properties = thesis.to_dict()
+                    properties.update(
+                        student_id=payload['student_id'] if enrolled else None,
+                        student_enrol_ts=payload['ts'] if enrolled else None,
+                        update_ts=payload['ts'])
+                    self.put_thesis(properties, thesis.instructor_id,
+                                    thesis.tags)
+            elif event == events.THESIS_DELETED:
+                self._remove(payload['thesis_name'])
+
+    # the read side of GraphDatabaseClient
+
+    def find(self, node_type: str, properties: Optional[dict] = None) -> list:
+        """
+        :return: property dicts of the nodes with the label and properties
+        """
+        properties = properties or {}
+        with self._lock:
+            if node_type == Thesis.node_type and 'thesis_name' in properties:
+                candidates = [self.theses.get(properties['thesis_name'])]
+            else:
+                candidates = list(self.records.get(node_type, {}).values())
+            return [record.to_dict() for record in candidates
+                    if record is not None and record.matches(properties)]
+
+    def find_one(self, node_type: str, properties: dict) -> Optional[dict]:
+        result = self.find(node_type, properties)
+        return result[0] if result else None
+
+    def find_all(self) -> list:
+        with self._lock:
+            return [self.theses[name].to_dict() for name in self.names]
+
+    def iter_all(self) -> Iterator[dict]:
+        """
+        same as find_all, the dicts are made one at a time while the caller
+        streams them
+        """
+        with self._lock:
+            records = [self.theses[name] for name in self.names]
+        # a record is never changed once it is in theses, put_thesis and
+        # on_event replace it, so the snapshot serialises consistently
+        return (record.to_dict() for record in records)
+
+    def thesis_tags(self, thesis_name: str) -> list:
+        thesis = self.theses.get(thesis_name)
+        return list(thesis.tags) if thesis is not None else []
+
+    def instructor_theses(self, instructor_id: str) -> list:
+        with self._lock:
+            return [self.theses[name].to_dict() for name in
+                    sorted(self.by_instructor.get(instructor_id, ()))]
+
+    def instructor_counters(self, instructor_id: str) -> Optional[dict]:
+        """
+        same as Instructor.get_counters, counted from the replica
+        """
+        with self._lock:
+            instructor = self.instructors.get(instructor_id)
+            if instructor is None:
+                return None
+            names = self.by_instructor.get(instructor_id, ())
+            enrolled = sum(1 for name in names
+                           if self.theses[name].student_id)
+            load = instructor.load
+        return {'load': load, 'theses_offered': len(names),
+                'theses_enrolled': enrolled,
+                'remaining': None if load is None else max(load - enrolled, 0)}
+
+    def find_page(self, year: Optional[int] = None,
+                  difficulty_min: Optional[int] = None,
+                  difficulty_max: Optional[int] = None,
+                  tag: Optional[str] = None, only_unassigned: bool = False,
+                  instructor_id: Optional[str] = None,
+                  department_id: Optional[str] = None,
+                  thesis_name: Optional[str] = None,
+                  cursor: Optional[str] = None,
+                  page_size: int = 50) -> Tuple[list, Optional[str]]:
+        """
+        same as Thesis.find_page: theses without an instructor are left out
+        as by its MATCH, and the items have the stored properties only (the
+        records keep no None values, which Neo4j does not store either)
+        """
+        tag = tag.strip().lower() if tag else None
+        with self._lock:
+            if thesis_name is not None:
+                names = [thesis_name] if thesis_name in self.theses else []
+            elif tag is not None or instructor_id is not None:
+                # start from the smaller adjacency set
+                sets = []
+                if tag is not None:
+                    sets.append(self.by_tag.get(tag, set()))
+                if instructor_id is not None:
+                    sets.append(self.by_instructor.get(instructor_id, set()))
+                names = sorted(set.intersection(*sorted(sets, key=len)))
+            else:
+                names = self.names
+            start = bisect_right(names, cursor) if cursor else 0
+
+            result = []
+            more = False
+            for index in range(start, len(names)):
+                name = names[index]
+                thesis = self.theses[name]
+                if thesis.instructor_id is None or \
+                        (year is not None and thesis.year != year) or \
+                        (difficulty_min is not None and
+                         (thesis.difficulty or 0) < difficulty_min) or \
+                        (difficulty_max is not None and
+                         (thesis.difficulty or 0) > difficulty_max) or \
+                        (only_unassigned and thesis.student_id) or \
+                        (instructor_id is not None and
+                         thesis.instructor_id != instructor_id) or \
+                        (tag is not None and tag not in thesis.tags) or \
+                        (department_id is not None and
+                         self._department_of(thesis) != department_id):
+                    continue
+                if len(result) == page_size:
+                    more = True
+                    break
+                item = thesis.to_dict()
+                item['instructor_id'] = thesis.instructor_id
+                result.append(item)
+        next_cursor = result[-1]['thesis_name'] if more else None
+        return result, next_cursor
+
+    def _department_of(self, thesis: ThesisRecord) -> Optional[str]:
+        instructor = self.instructors.get(thesis.instructor_id)
+        return instructor.department_id if instructor is not None else None
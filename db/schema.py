@@ -0,0 +1,89 @@
+"""
+Neo4j schema management: uniqueness constraints and property indexes for
+every key the data layer looks nodes up by.
+
+Usage:
+    python -m db.schema           apply missing constraints and indexes
+    python -m db.schema --check   only report missing ones, exit code 1 if any
+"""
+import argparse
+import sys
+from typing import List, Tuple
+
+from db.db_neo4j import GraphDatabaseClient, Thesis, Instructor, Group, \
+    Department
+
+# (label, property) pairs enforced by a uniqueness constraint, the
+# constraint also backs the property with an index
+CONSTRAINTS = [
+    (Thesis.node_type, 'thesis_name'),
+    (Thesis.node_type, 'id'),
+    (Instructor.node_type, 'id'),
+    (Group.node_type, 'id'),
+    (Department.node_type, 'department_id'),
+    ('Tag', 'name'),
+]
+
+# (label, property) pairs backed by a plain property index
+INDEXES = [
+    (Thesis.node_type, 'update_ts'),
+    (Thesis.tombstone_type, 'update_ts'),
+    (Thesis.node_type, 'status'),
+    (Thesis.node_type, 'year'),
+    (Group.node_type, 'year'),
+]
+
+
+def missing_constraints(client: GraphDatabaseClient) -> List[Tuple[str, str]]:
+    missing = []
+    for label, key in CONSTRAINTS:
+        if key not in client.graph.schema.get_uniqueness_constraints(label):
+            missing.append((label, key))
+    return missing
+
+
+def missing_indexes(client: GraphDatabaseClient) -> List[Tuple[str, str]]:
+    missing = []
+    for label, key in INDEXES:
+        if (key,) not in client.graph.schema.get_indexes(label):
+            missing.append((label, key))
+    return missing
+
+
+def ensure_schema(client: GraphDatabaseClient) -> List[str]:
+    """
+    create every missing constraint and index, existing ones are left as is
+    :return: descriptions of the created schema items
+    """
+    created = []
+    for label, key in missing_constraints(client):
+        client.graph.schema.create_uniqueness_constraint(label, key)
+        created.append(f'CONSTRAINT :{label}({key}) IS UNIQUE')
+    for label, key in missing_indexes(client):
+        client.graph.schema.create_index(label, key)
+        created.append(f'INDEX :{label}({key})')
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--check', action='store_true',
+                        help='only report missing constraints and indexes')
+    args = parser.parse_args()
+
+    client = GraphDatabaseClient()
+    if args.check:
+        missing = [f'CONSTRAINT :{label}({key}) IS UNIQUE'
+                   for label, key in missing_constraints(client)]
+        missing += [f'INDEX :{label}({key})'
+                    for label, key in missing_indexes(client)]
+        for item in missing:
+            print(f'missing: {item}')
+        sys.exit(1 if missing else 0)
+
+    for item in ensure_schema(client):
+        print(f'created: {item}')
+
+
+if __name__ == '__main__':
+    main()
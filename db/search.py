@@ -0,0 +1,238 @@
+"""
+In-memory full-text index over thesis names, descriptions and tags.
+
+The index is loaded once from Neo4j and then kept up to date from catalogue
+events (see db.events), so queries never go to the database. Ranking is
+BM25 computed per field and summed with field weights; query terms also
+match indexed terms they are a prefix of, with a lower weight.
+"""
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Callable, Iterable, Optional, Tuple
+
+from db import events
+
+TOKEN_RE = re.compile(r'\w+')
+APOSTROPHES = str.maketrans('', '', "'’ʼ")
+STOP_WORDS = {
+    'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'into', 'is',
+    'of', 'on', 'or', 'the', 'to', 'with',
+    'в', 'ві', 'для', 'до', 'з', 'за', 'і', 'із', 'й', 'на', 'не', 'по',
+    'та', 'у', 'що', 'як', 'це',
+}
+
+# field name -> weight in the final score
+FIELDS = {'thesis_name': 3.0, 'description': 1.0, 'tags': 2.0}
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 64
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: Optional[str]) -> list:
+    """
+    lowercase words of the text without stop words, apostrophes inside
+    words (ім'я, don't) are dropped so both spellings match
+    """
+    if not text:
+        return []
+    words = TOKEN_RE.findall(text.casefold().translate(APOSTROPHES))
+    return [word for word in words if word not in STOP_WORDS]
+
+
+class SearchIndex:
+    def __init__(self, load: Optional[
+            Callable[[], Iterable[Tuple[dict, list]]]] = None):
+        """
+        :param load: returns (thesis dict, tag names) pairs of the catalogue,
+        called again after another process imported theses
+        """
+        self.load = load
+        self.stale = False
+        self.docs = {}  # doc id -> thesis dict
+        self.doc_ids = {}  # thesis_name -> doc id
+        self.doc_terms = {}  # doc id -> {field: {term: tf}}
+        self.postings = {field: {} for field in FIELDS}  # term -> {doc: tf}
+        self.lengths = {field: {} for field in FIELDS}  # doc id -> length
+        self.total_lengths = {field: 0 for field in FIELDS}
+        self.terms = []  # sorted vocabulary for prefix lookups
+        self.term_counts = {}  # term -> number of postings using it
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def build(self, theses: Iterable[Tuple[dict, list]]):
+        """
+        :param theses: (thesis dict, tag names) pairs, a thesis already
+        updated by a newer event is skipped
+        """
+        with self._lock:
+            for thesis, tags in theses:
+                doc_id = self.doc_ids.get(thesis['thesis_name'])
+                if doc_id is not None and self.docs[doc_id].get('update_ts', 0) \
+                        >= thesis.get('update_ts', 0):
+                    continue
+                self.add(thesis, tags)
+
+    def subscribe(self):
+        # events of other workers and command line tools arrive too
+        events.subscribe(self.on_event, remote=True)
+
+    def refresh(self):
+        """
+        load the theses imported by another process, see on_event
+        """
+        if self.stale and self.load is not None:
+            self.stale = False
+            self.build(self.load())
+
+    def add(self, thesis: dict, tags: Optional[list] = None):
+        with self._lock:
+            self.remove(thesis['thesis_name'])
+            doc_id = self._next_id
+            self._next_id += 1
+
+            doc = dict(thesis)
+            doc['tags'] = list(tags or [])
+            self.docs[doc_id] = doc
+            self.doc_ids[doc['thesis_name']] = doc_id
+
+            fields = {'thesis_name': tokenize(doc['thesis_name']),
+                      'description': tokenize(doc.get('description')),
+                      'tags': tokenize(' '.join(doc['tags']))}
+            self.doc_terms[doc_id] = {}
+            term_counts = self.term_counts
+            for field, tokens in fields.items():
+                frequencies = Counter(tokens)
+                self.doc_terms[doc_id][field] = frequencies
+                self.lengths[field][doc_id] = len(tokens)
+                self.total_lengths[field] += len(tokens)
+                postings = self.postings[field]
+                for term, tf in frequencies.items():
+                    if term in postings:
+                        postings[term][doc_id] = tf
+                    else:
+                        postings[term] = {doc_id: tf}
+                    if term in term_counts:
+                        term_counts[term] += 1
+                    else:
+                        term_counts[term] = 1
+                        insort(self.terms, term)
+
+    def remove(self, thesis_name: str):
+        with self._lock:
+            doc_id = self.doc_ids.pop(thesis_name, None)
+            if doc_id is None:
+                return
+            del self.docs[doc_id]
+            for field, frequencies in self.doc_terms.pop(doc_id).items():
+                self.total_lengths[field] -= self.lengths[field].pop(doc_id)
+                for term in frequencies:
+                    postings = self.postings[field][term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self.postings[field][term]
+                    self._release_term(term)
+
+    def update(self, thesis_name: str, **fields):
+        """
+        update stored fields which are not indexed, e.g. student_id
+        """
+        with self._lock:
+            doc_id = self.doc_ids.get(thesis_name)
+            if doc_id is not None:
+                self.docs[doc_id].update(fields)
+
+    def theses(self) -> list:
+        """
+        :return: (thesis dict, tag names) pairs of all indexed theses
+        """
+        self.refresh()
+        with self._lock:
+            return [(dict(doc), doc['tags']) for doc in self.docs.values()]
+
+    def _release_term(self, term: str):
+        self.term_counts[term] -= 1
+        if not self.term_counts[term]:
+            del self.term_counts[term]
+            del self.terms[bisect_left(self.terms, term)]
+
+    def expand(self, token: str) -> list:
+        """
+        :return: (term, weight) pairs, the token itself and the indexed
+        terms it is a prefix of
+        """
+        result = [(token, 1.0)] if token in self.term_counts else []
+        if len(token) < 2:
+            return result
+        start = bisect_left(self.terms, token)
+        for term in self.terms[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                result.append((term, PREFIX_WEIGHT))
+        return result
+
+    def search(self, query: str, limit: int = 20,
+               only_unassigned: bool = False) -> list:
+        """
+        :return: thesis dicts with a "score" key, best first
+        """
+        self.refresh()
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            scores = {}
+            for token in set(tokenize(query)):
+                for term, term_weight in self.expand(token):
+                    for field, field_weight in FIELDS.items():
+                        postings = self.postings[field].get(term)
+                        if not postings:
+                            continue
+                        idf = math.log(1 + (n - len(postings) + 0.5) /
+                                       (len(postings) + 0.5))
+                        average = self.total_lengths[field] / n or 1
+                        lengths = self.lengths[field]
+                        weight = field_weight * term_weight * idf * (K1 + 1)
+                        # BM25 length norm K1 * (1 - B + B * length / average)
+                        base, per_token = K1 * (1 - B), K1 * B / average
+                        get = scores.get
+                        for doc_id, tf in postings.items():
+                            scores[doc_id] = get(doc_id, 0) + weight * tf / (
+                                tf + base + per_token * lengths[doc_id])
+
+            candidates = scores
+            if only_unassigned:
+                candidates = (doc_id for doc_id in scores
+                              if not self.docs[doc_id].get('student_id'))
+            best = heapq.nlargest(limit, candidates, key=scores.__getitem__)
+            return [dict(self.docs[doc_id], score=round(scores[doc_id], 4))
+                    for doc_id in best]
+
+    def on_event(self, event: str, payload: dict):
+        if event == events.THESIS_CREATED:
+            self.add(payload['thesis'], payload.get('tags'))
+        elif event == events.THESES_IMPORTED and 'rows' not in payload:
+            # relayed from another process without the rows
+            self.stale = True
+        elif event == events.THESES_IMPORTED:
+            with self._lock:
+                for row in payload['rows']:
+                    self.add(row['props'], row['tags'])
+        elif event == events.THESIS_ENROLLED:
+            self.update(payload['thesis_name'],
+                        student_id=payload['student_id'],
+                        student_enrol_ts=payload['ts'],
+                        update_ts=payload['ts'])
+        elif event == events.THESIS_RELEASED:
+            self.update(payload['thesis_name'], student_id=None,
+                        student_enrol_ts=None, update_ts=payload['ts'])
+        elif event == events.THESIS_DELETED:
+            self.remove(payload['thesis_name'])
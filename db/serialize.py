@@ -0,0 +1,99 @@
+"""
+Serialisation of models and list responses.
+
+compile_serializer turns the field list of a model class into its to_dict
+once, instead of scanning vars() on every call. List responses are written
+as a stream of chunks from a generator over the query cursor: a JSON array
+(byte for byte what json.dumps gives for the whole list) or NDJSON, one
+object per line, optionally gzip compressed as it goes. A request holds one
+chunk of the body at a time instead of the whole list and its string.
+"""
+import json
+import zlib
+from operator import attrgetter
+from typing import Callable, Iterable, Iterator, Optional
+
+# bytes collected before a chunk is handed to the server
+CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = 6
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+
+
+def compile_serializer(fields: tuple, drop_falsy: bool = True
+                       ) -> Callable[[object], dict]:
+    """
+    :param fields: attribute names in output order
+    :param drop_falsy: leave out every false value (what the model to_dict
+    methods always did), otherwise only None
+    :return: function of an object returning the dict of its fields
+    """
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        single = getter
+        getter = lambda obj: (single(obj),)  # noqa: E731
+
+    if drop_falsy:
+        def to_dict(obj) -> dict:
+            return {key: value for key, value in zip(fields, getter(obj))
+                    if value}
+    else:
+        def to_dict(obj) -> dict:
+            return {key: value for key, value in zip(fields, getter(obj))
+                    if value is not None}
+    return to_dict
+
+
+def _chunked(pieces: Iterable[str]) -> Iterator[bytes]:
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def json_array(items: Iterable, serialize: Optional[Callable] = None,
+               prefix: str = '', suffix: str = '') -> Iterator[bytes]:
+    """
+    :param serialize: turns an item into something json.dumps takes
+    :param prefix: text before the array, e.g. '{"items": '
+    :param suffix: text after the array
+    """
+    encode = json.JSONEncoder().encode
+
+    def pieces():
+        yield prefix + '['
+        separator = ''
+        for item in items:
+            yield separator
+            yield encode(serialize(item) if serialize else item)
+            separator = ', '
+        yield ']' + suffix
+    return _chunked(pieces())
+
+
+def ndjson(items: Iterable, serialize: Optional[Callable] = None
+           ) -> Iterator[bytes]:
+    encode = json.JSONEncoder().encode
+    return _chunked(encode(serialize(item) if serialize else item) + '\n'
+                    for item in items)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = GZIP_LEVEL
+                ) -> Iterator[bytes]:
+    """
+    compress a stream of chunks into one gzip member
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,216 @@
+"""
+Slow Cypher query log.
+
+GraphDatabaseClient.run_query reports every query slower than
+NEO4J_SLOW_QUERY_MS here. A background thread then fetches the plan of the
+query: read-only queries are re-run with PROFILE (operators with db hits and
+rows), queries that write are only planned with EXPLAIN, so nothing is
+written twice. Every template is profiled at most once per
+NEO4J_SLOW_QUERY_PROFILE_INTERVAL seconds, later slow runs in that interval
+are logged without a plan. Records are JSON lines in a rotating file.
+
+Usage:
+    python -m db.slow_queries [LOG ...] [--top 10]
+"""
+import argparse
+import glob
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+import settings as s
+from db import queries
+
+# operators reading every node of a label or of the whole graph, usually a
+# missing index or constraint (see db.schema)
+SCAN_OPERATORS = {'NodeByLabelScan', 'AllNodesScan'}
+WRITE_CLAUSE = re.compile(r'\b(CREATE|MERGE|SET|DELETE|REMOVE|FOREACH)\b',
+                          re.IGNORECASE)
+QUEUE_SIZE = 100
+
+
+def is_read_only(text: str) -> bool:
+    return WRITE_CLAUSE.search(text) is None
+
+
+def field(item, name: str, default=None):
+    """
+    plan nodes are objects or dicts depending on the driver version
+    """
+    if isinstance(item, dict):
+        return item.get(name, default)
+    return getattr(item, name, default)
+
+
+def walk_plan(plan) -> list:
+    """
+    :return: (operator, db hits, rows) of every operator of the plan
+    """
+    operators = []
+    stack = [plan] if plan is not None else []
+    while stack:
+        node = stack.pop()
+        name = field(node, 'operator_type') or field(node, 'operatorType')
+        operators.append((str(name).split('@')[0],
+                          field(node, 'db_hits') or field(node, 'dbHits') or 0,
+                          field(node, 'rows') or field(node, 'records') or 0))
+        stack.extend(reversed(list(field(node, 'children') or [])))
+    return operators
+
+
+class SlowQueryLog:
+    def __init__(self, path: str = s.NEO4J_SLOW_QUERY_LOG,
+                 profile_interval: float = s.NEO4J_SLOW_QUERY_PROFILE_INTERVAL,
+                 max_bytes: int = s.NEO4J_SLOW_QUERY_LOG_MAX_BYTES,
+                 backups: int = s.NEO4J_SLOW_QUERY_LOG_BACKUPS):
+        self.profile_interval = profile_interval
+        self.logger = logging.getLogger(f'{__name__}.{path}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                          backupCount=backups,
+                                          encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+        self.profiled = {}  # template name -> monotonic time of last plan
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def report(self, graph, name: str, parameters: Optional[dict],
+               elapsed: float):
+        """
+        called in the request thread, the plan is fetched in the background
+        :param graph: py2neo graph to fetch the plan with
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = now - self.profiled.get(name, -self.profile_interval) \
+                >= self.profile_interval
+            if due:
+                self.profiled[name] = now
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='slow-queries', daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait((graph if due else None, name,
+                                   dict(parameters or {}), elapsed, time.time()))
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            graph, name, parameters, elapsed, ts = self.queue.get()
+            record = {'ts': ts, 'query': name,
+                      'elapsed_ms': round(elapsed * 1000, 2),
+                      'parameters': sorted(parameters)}
+            if graph is not None:
+                try:
+                    record.update(self.plan(graph, name, parameters))
+                except Exception as e:
+                    record['plan_error'] = str(e)
+            self.logger.info(json.dumps(record))
+            self.queue.task_done()
+
+    @staticmethod
+    def plan(graph, name: str, parameters: dict) -> dict:
+        text = queries.get(name)
+        mode = 'PROFILE' if is_read_only(text) else 'EXPLAIN'
+        cursor = graph.run(f'{mode} {text}', parameters)
+        cursor.data()
+        plan = cursor.plan() if hasattr(cursor, 'plan') else None
+        if plan is None:
+            summary = cursor.summary()
+            plan = field(summary, 'profile') or field(summary, 'plan')
+        operators = walk_plan(plan)
+        return {
+            'mode': mode,
+            'db_hits': sum(hits for _, hits, _ in operators),
+            'operators': [operator for operator, _, _ in operators],
+            'scans': sorted({operator for operator, _, _ in operators
+                             if operator in SCAN_OPERATORS}),
+        }
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(path: str = s.NEO4J_SLOW_QUERY_LOG) -> SlowQueryLog:
+    """
+    :return: the log of the process writing to the path
+    """
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = SlowQueryLog(path)
+        return _logs[path]
+
+
+def read_records(paths: list):
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def aggregate(records) -> list:
+    """
+    :return: one dict per query template, the slowest first
+    """
+    shapes = {}
+    for record in records:
+        shape = shapes.setdefault(record['query'], {
+            'query': record['query'], 'count': 0, 'elapsed_ms': [],
+            'db_hits': [], 'scans': set()})
+        shape['count'] += 1
+        shape['elapsed_ms'].append(record['elapsed_ms'])
+        if 'db_hits' in record:
+            shape['db_hits'].append(record['db_hits'])
+        shape['scans'].update(record.get('scans', ()))
+
+    result = []
+    for shape in shapes.values():
+        elapsed = sorted(shape['elapsed_ms'])
+        result.append({
+            'query': shape['query'],
+            'count': shape['count'],
+            'total_ms': round(sum(elapsed), 2),
+            'p50_ms': elapsed[len(elapsed) // 2],
+            'max_ms': elapsed[-1],
+            'max_db_hits': max(shape['db_hits']) if shape['db_hits'] else None,
+            'scans': sorted(shape['scans']),
+        })
+    result.sort(key=lambda x: x['total_ms'], reverse=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Worst query templates of the slow query log')
+    parser.add_argument('paths', nargs='*',
+                        help='log files, default the configured log and '
+                             'its rotated files')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(s.NEO4J_SLOW_QUERY_LOG + '*'))
+    for shape in aggregate(read_records(paths))[:args.top]:
+        scans = f'  SCANS: {", ".join(shape["scans"])}' if shape['scans'] \
+            else ''
+        print(f'{shape["query"]:32} {shape["count"]:6}x  total '
+              f'{shape["total_ms"]:10.1f}ms  p50 {shape["p50_ms"]:8.1f}ms  '
+              f'max {shape["max_ms"]:8.1f}ms  db hits '
+              f'{shape["max_db_hits"]}{scans}')
+
+
+if __name__ == '__main__':
+    main()
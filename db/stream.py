@@ -0,0 +1,176 @@
+"""
+Fan-out of thesis catalogue changes to Server-Sent Events clients.
+
+The hub turns db.events into stream events, keeps the latest of them in a
+ring buffer and wakes every listener through one condition variable. The
+events of other workers arrive through the invalidation channel (see
+db.invalidation), so every worker streams the changes of all workers.
+
+A listener sleeps on the condition between events and holds no other
+resources, so an idle connection costs one thread, or one
+greenlet under a gevent worker. A client reconnecting with Last-Event-ID
+gets the events it missed from the buffer; when they are no longer there,
+or the id comes from another worker, it gets a `reset` event and catches up
+with /api/thesis/changes.
+"""
+import json
+import threading
+import uuid
+from collections import deque
+from typing import Iterator, Optional
+
+from db import events
+from db.invalidation import InvalidationChannel
+
+# invalidation message kind, the key is the JSON encoded [event, data]
+STREAM = 'thesis_stream'
+
+# stream event types
+CREATED = 'created'  # data: thesis dict with instructor_id and tags
+ENROLLED = 'enrolled'  # data: thesis_name, student_id
+RELEASED = 'released'  # data: thesis_name
+DELETED = 'deleted'  # data: thesis_name, instructor_id
+RESET = 'reset'  # data: {}, the client has to fetch the changes itself
+
+
+class StreamHub:
+    def __init__(self, buffer_size: int = 1000, max_listeners: int = 1000,
+                 channel: Optional[InvalidationChannel] = None):
+        """
+        :param buffer_size: events kept for reconnecting clients
+        :param max_listeners: open streams allowed in this process
+        :param channel: channel to exchange events with other workers
+        """
+        # event ids are "<hub>-<sequence>", ids of other hubs are unknown
+        self.hub_id = uuid.uuid4().hex[:8]
+        self.buffer = deque(maxlen=buffer_size)  # (sequence, message)
+        self.sequence = 0
+        self.max_listeners = max_listeners
+        self.listeners = 0
+        self.channel = channel or InvalidationChannel()
+        self._condition = threading.Condition()
+
+    def subscribe(self):
+        events.subscribe(self.on_event)
+        self.channel.subscribe(self.on_invalidation)
+
+    def on_event(self, event: str, payload: dict):
+        if event == events.THESIS_CREATED:
+            data = dict(payload['thesis'], instructor_id=payload['instructor_id'],
+                        tags=payload['tags'])
+            message = (CREATED, data)
+        elif event == events.THESIS_ENROLLED:
+            message = (ENROLLED, {'thesis_name': payload['thesis_name'],
+                                  'student_id': payload['student_id']})
+        elif event == events.THESIS_RELEASED:
+            message = (RELEASED, {'thesis_name': payload['thesis_name']})
+        elif event == events.THESIS_DELETED:
+            message = (DELETED, {'thesis_name': payload['thesis_name'],
+                                 'instructor_id': payload['instructor_id']})
+        elif event == events.THESES_IMPORTED:
+            # too large for one message, clients fetch the changes instead
+            message = (RESET, {})
+        else:
+            return
+        self.publish(*message)
+        self.channel.publish(STREAM, json.dumps(message))
+
+    def on_invalidation(self, kind: str, key: str):
+        if kind == STREAM:
+            self.publish(*json.loads(key))
+
+    def publish(self, event: str, data: dict):
+        with self._condition:
+            self.sequence += 1
+            self.buffer.append((self.sequence, format_event(
+                f'{self.hub_id}-{self.sequence}', event, data)))
+            self._condition.notify_all()
+
+    def start_position(self, last_event_id: Optional[str]) -> Optional[int]:
+        """
+        :return: sequence after which the listener continues, None if the
+        events after last_event_id are not in the buffer anymore
+        """
+        with self._condition:
+            if not last_event_id:
+                return self.sequence
+            hub_id, _, sequence = last_event_id.partition('-')
+            if hub_id != self.hub_id or not sequence.isdigit():
+                return None
+            position = min(int(sequence), self.sequence)
+            oldest = self.buffer[0][0] if self.buffer else self.sequence + 1
+            return position if position >= oldest - 1 else None
+
+    def open(self, last_event_id: Optional[str] = None,
+             keepalive: float = 15.0, retry_ms: int = 3000
+             ) -> Optional['Listener']:
+        """
+        :param last_event_id: Last-Event-ID header of a reconnecting client
+        :param keepalive: seconds between comments sent to idle clients, so
+        proxies keep the connection and closed ones are noticed
+        :return: the stream of one client, None if there are max_listeners
+        streams already
+        """
+        with self._condition:
+            if self.listeners >= self.max_listeners:
+                return None
+            self.listeners += 1
+        return Listener(self, last_event_id, keepalive, retry_ms)
+
+    def release(self):
+        with self._condition:
+            self.listeners -= 1
+
+    def wait(self, position: int, keepalive: float) -> tuple:
+        """
+        block until there are events after the position or keepalive passed
+        :return: (new position, serialised events)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.sequence > position,
+                                     keepalive)
+            oldest = self.buffer[0][0] if self.buffer else 0
+            if position < oldest - 1:
+                # the client is too slow, events were dropped from the buffer
+                messages = [self.reset_event()]
+            else:
+                messages = [message for sequence, message in self.buffer
+                            if sequence > position]
+            return self.sequence, messages
+
+    def reset_event(self) -> str:
+        return format_event(f'{self.hub_id}-{self.sequence}', RESET, {})
+
+
+class Listener:
+    """
+    iterable of the serialised events of one client, the WSGI server closes
+    it when the client is gone
+    """
+
+    def __init__(self, hub: StreamHub, last_event_id: Optional[str],
+                 keepalive: float, retry_ms: int):
+        self.hub = hub
+        self.last_event_id = last_event_id
+        self.keepalive = keepalive
+        self.retry_ms = retry_ms
+        self._closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        yield f'retry: {self.retry_ms}\n\n'
+        position = self.hub.start_position(self.last_event_id)
+        if position is None:
+            position = self.hub.sequence
+            yield self.hub.reset_event()
+        while not self._closed:
+            position, messages = self.hub.wait(position, self.keepalive)
+            yield ''.join(messages) if messages else ': keepalive\n\n'
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.hub.release()
+
+
+def format_event(event_id: str, event: str, data: dict) -> str:
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
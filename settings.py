@@ -1,7 +1,21 @@
+import os
+
 NEO4J_HOSTNAME = '192.168.1.81'
 NEO4J_USER = 'neo4j'
 NEO4J_PASSWORD = '1'
 NEO4J_PORT = 32783
+# size of the bolt connection pool of every worker process
+NEO4J_MAX_CONNECTIONS = int(os.environ.get('NEO4J_MAX_CONNECTIONS', 40))
+# create missing constraints and indexes (see db/schema.py) on app start
+NEO4J_ENSURE_SCHEMA = True
+# log queries slower than this many milliseconds with their PROFILE plan
+# (see db/slow_queries.py), off unless set, e.g. NEO4J_SLOW_QUERY_MS=200
+NEO4J_SLOW_QUERY_MS = float(os.environ.get('NEO4J_SLOW_QUERY_MS', 0))  # 0 - off
+NEO4J_SLOW_QUERY_LOG = os.environ.get('NEO4J_SLOW_QUERY_LOG', 'slow_queries.log')
+NEO4J_SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+NEO4J_SLOW_QUERY_LOG_BACKUPS = 5
+# seconds between two PROFILE runs of the same query template
+NEO4J_SLOW_QUERY_PROFILE_INTERVAL = 60
 
 MONGODB_HOSTNAME = '192.168.1.81'
 MONGODB_USER = ''
@@ -9,8 +23,76 @@ MONGODB_PASSWORD = ''
 MONGODB_PORT = 27017
 MONGODB_NAME = 'thesis-enrollment'
 MONGODB_USERS_COLLECTION = 'users'
+# connection pool of every worker process
+MONGODB_MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', 50))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 5000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGODB_SOCKET_TIMEOUT_MS', 10000))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(
+    os.environ.get('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 2000))
+
+# in-process user and session cache
+USER_CACHE_MAX_SIZE = 10000
+SESSION_CACHE_MAX_SIZE = 20000
+USER_CACHE_TTL = 300  # seconds
+# broadcast cache invalidations to other worker processes:
+# None - single process, 'unix' - datagram sockets in
+# CACHE_INVALIDATION_SOCKET_DIR (one host), 'mongo' - capped collection
+CACHE_INVALIDATION = None
+CACHE_INVALIDATION_SOCKET_DIR = '/tmp/thesis-enrollment-invalidation'
+MONGODB_INVALIDATION_COLLECTION = 'cache_invalidations'
+MONGODB_INVALIDATION_COLLECTION_SIZE = 1024 * 1024  # bytes
 
 APP_HOST = 'localhost'
 APP_PORT = 8080
+# connect to both stores in create_app, disable for tests and tools
+APP_WARM_UP = os.environ.get('APP_WARM_UP', '1') == '1'
+
+THESIS_PAGE_SIZE = 50
+THESIS_MAX_PAGE_SIZE = 500
+BULK_IMPORT_BATCH_SIZE = 500
+# threads running the mongodb and Neo4j writes of one request concurrently
+DUAL_WRITE_POOL_SIZE = int(os.environ.get('DUAL_WRITE_POOL_SIZE', 16))
+# number of serialised catalogue responses kept in memory
+CATALOGUE_CACHE_MAX_SIZE = 1000
+# gzip the streamed list responses (see db/serialize.py) of clients
+# accepting it, off when a proxy in front compresses them
+RESPONSE_GZIP = os.environ.get('RESPONSE_GZIP', '1') == '1'
+# add a Server-Timing header with the database time of every request
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+# seconds deleted theses are remembered for /api/thesis/changes, clients
+# asking for older changes must reload the catalogue
+THESIS_TOMBSTONE_TTL = 7 * 24 * 3600
+# admission control of the enrolment and catalogue endpoints (see
+# db/admission.py), per worker: requests served at once, requests waiting,
+# seconds a request waits before it gets 429
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+ADMISSION_ENROL_CONCURRENCY = int(os.environ.get('ADMISSION_ENROL_CONCURRENCY', 8))
+ADMISSION_ENROL_QUEUE = 500
+ADMISSION_ENROL_MAX_WAIT = 10.0
+ADMISSION_CATALOGUE_CONCURRENCY = int(
+    os.environ.get('ADMISSION_CATALOGUE_CONCURRENCY', 16))
+ADMISSION_CATALOGUE_QUEUE = 1000
+ADMISSION_CATALOGUE_MAX_WAIT = 5.0
+# token bucket of every session: requests per second and burst size
+ADMISSION_USER_RATE = 2.0
+ADMISSION_USER_BURST = 10
+# Server-Sent Events at /api/thesis/stream: open streams per worker (each
+# holds a thread, or a greenlet under gevent), events kept for reconnecting
+# clients, seconds between keepalive comments
+STREAM_MAX_LISTENERS = int(os.environ.get('STREAM_MAX_LISTENERS', 1000))
+STREAM_BUFFER_SIZE = 1000
+STREAM_KEEPALIVE = 15.0
+# serve catalogue and instructor reads from an in-memory copy of the graph
+# (see db/replica.py), refreshed every GRAPH_REPLICA_POLL_INTERVAL seconds
+GRAPH_REPLICA = os.environ.get('GRAPH_REPLICA', '0') == '1'
+GRAPH_REPLICA_POLL_INTERVAL = 1.0
+GRAPH_REPLICA_RELOAD_INTERVAL = 60.0
+# students with precomputed thesis recommendations
+RECOMMEND_CACHE_MAX_SIZE = 50000
+# length of the ranked thesis list of a student for the batch assignment
+MATCHING_MAX_PREFERENCES = 20
 
 SECRET_KEY = "Your_secret_string"
\ No newline at end of file
@@ -1,30 +1,123 @@
+import time
+
+# taken before the other imports, the cold start time includes them
+_import_started = time.perf_counter()
+
+import functools
 import json
 import os
 import uuid
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Optional
 
-from flask import Flask, request, render_template, session, redirect, abort
+from flask import Blueprint, Flask, Response, request, render_template, \
+    session, redirect, abort, current_app, make_response
 from flask_cors import CORS
 
 import settings as s
+from db import metrics
+from db.admission import AdmissionPool, RateLimiter
+from db.bulk import import_theses
+from db.catalogue import CatalogueCache
+from db.clients import Clients
 from db.db_mongo import DatabaseClient
-from db.db_neo4j import Instructor, GraphDatabaseClient, Thesis
+from db.db_neo4j import Instructor, GraphDatabaseClient, Thesis, parse_tags, \
+    CLOCK_SKEW
+from db.dual_write import DualWrite
+from db.exceptions import EnrolmentConflictException, ObjectDoesNotExist, \
+    AdmissionRejectedException
+from db.recommend import Recommender, DEPTH as RECOMMEND_DEPTH
+from db.replica import GraphReplica
+from db.search import SearchIndex
+from db.serialize import JSON, NDJSON, gzip_chunks, json_array, ndjson
+from db.stream import StreamHub
+
+root_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+template_folder = os.path.join(root_folder, 'templates')
+static_folder = os.path.join(root_folder, 'static')
+
+bp = Blueprint('main', __name__)
+
+
+def create_app(clients: Optional[Clients] = None,
+               warm_up: bool = s.APP_WARM_UP) -> Flask:
+    """
+    :param clients: database clients, by default created lazily from settings
+    :param warm_up: connect to both stores before returning the app
+    """
+    app = Flask(__name__, template_folder=template_folder, static_folder=static_folder)
+    CORS(app)
+
+    app.config['SECRET_KEY'] = s.SECRET_KEY
+    app.extensions['clients'] = clients or Clients()
+    app.extensions['admission'] = {
+        'enrol': AdmissionPool('enrol', s.ADMISSION_ENROL_CONCURRENCY,
+                               s.ADMISSION_ENROL_QUEUE,
+                               s.ADMISSION_ENROL_MAX_WAIT),
+        'catalogue': AdmissionPool('catalogue',
+                                   s.ADMISSION_CATALOGUE_CONCURRENCY,
+                                   s.ADMISSION_CATALOGUE_QUEUE,
+                                   s.ADMISSION_CATALOGUE_MAX_WAIT),
+    }
+    app.extensions['rate_limiter'] = RateLimiter(
+        s.ADMISSION_USER_RATE, s.ADMISSION_USER_BURST, s.SESSION_CACHE_MAX_SIZE)
+    app.register_blueprint(bp)
+
+    cold_start = {'import': time.perf_counter() - _import_started}
+    if warm_up:
+        cold_start.update(app.extensions['clients'].warm_up())
+    cold_start['total'] = time.perf_counter() - _import_started
+    app.extensions['cold_start'] = cold_start
+    app.logger.info('cold start: %s', ', '.join(
+        f'{key} {value * 1000:.1f}ms' for key, value in cold_start.items()))
+    return app
+
+
+def get_db() -> DatabaseClient:
+    return current_app.extensions['clients'].mongo
+
+
+def get_graph() -> GraphDatabaseClient:
+    return current_app.extensions['clients'].graph
+
+
+def get_replica() -> Optional[GraphReplica]:
+    """
+    :return: in-memory copy of the graph for reads, None when disabled
+    """
+    return current_app.extensions['clients'].replica
+
+
+def get_catalogue() -> CatalogueCache:
+    return current_app.extensions['clients'].catalogue
 
-template_folder = os.path.abspath('../templates')
-static_folder = os.path.abspath('../static')
 
-app = Flask(__name__, template_folder=template_folder, static_folder=static_folder)
-CORS(app)
+def get_search() -> SearchIndex:
+    return current_app.extensions['clients'].search
 
-app.config['SECRET_KEY'] = s.SECRET_KEY
 
-db = DatabaseClient()
-client = GraphDatabaseClient()
+def get_recommender() -> Recommender:
+    return current_app.extensions['clients'].recommender
+
+
+def get_stream() -> StreamHub:
+    return current_app.extensions['clients'].stream
+
+
+def get_executor() -> Executor:
+    return current_app.extensions['clients'].executor
 
 
 def generate_id():
     return uuid.uuid4()
 
 
+def error_response(status: int, message: str):
+    return json.dumps({'error': message}), status, \
+        {'Content-Type': 'application/json'}
+
+
 def get_session_id():
     return session.get('id')
 
@@ -42,15 +135,91 @@ def get_or_set_session_id():
 def get_current_user():
     session_id = get_session_id()
 
-    user = db.user_check_session(session_id)
+    user = get_db().user_check_session(session_id)
     return user
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.before_app_request
+def start_request_metrics():
+    metrics.start_request(request.endpoint)
+
+
+@bp.after_app_request
+def finish_request_metrics(response):
+    stats = metrics.current()
+    if stats is not None:
+        stats.finish(request.method, response.status_code)
+        if s.SERVER_TIMING:
+            response.headers['Server-Timing'] = stats.server_timing()
+    return response
+
+
+@bp.teardown_app_request
+def end_request_metrics(error=None):
+    metrics.end_request()
+
+
+def admission(pool: str):
+    """
+    serve the view through the admission pool (see db.admission) after
+    taking a token of the session, the position the request had in the
+    wait queue is returned in X-Queue-Position
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not s.ADMISSION_CONTROL:
+                return view(*args, **kwargs)
+            key = str(get_session_id() or request.remote_addr)
+            wait = current_app.extensions['rate_limiter'].take(key)
+            if wait:
+                metrics.ADMISSION_WAIT.observe(0.0, pool, 'throttled')
+                raise AdmissionRejectedException(
+                    'Too many requests from this session', wait)
+            admission_pool = current_app.extensions['admission'][pool]
+            position = admission_pool.acquire()
+            started = admission_pool.timer()
+
+            def release():
+                admission_pool.release(admission_pool.timer() - started)
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            # a streamed body is read from the database while it is sent,
+            # the slot is kept until the server closes it
+            if response.is_streamed:
+                response.call_on_close(release)
+            else:
+                release()
+            if position:
+                response.headers['X-Queue-Position'] = str(position)
+            return response
+        return wrapper
+    return decorator
+
+
+@bp.app_errorhandler(AdmissionRejectedException)
+def on_admission_rejected(e: AdmissionRejectedException):
+    retry_after = max(int(round(e.retry_after)), 1)
+    response = make_response(error_response(429, str(e)))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
         session_id = get_session_id()
-        if db.user_check_session(session_id):
+        if get_db().user_check_session(session_id):
             return redirect('/')
 
         return render_template('login.html')
@@ -60,27 +229,27 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
 
-        user = db.user_check_password(email, password)
+        user = get_db().user_check_password(email, password)
 
         if user:
-            db.user_write_session(user['_id'], session_id)
+            get_db().user_write_session(user['_id'], session_id)
             return redirect('/')
         else:  # failed to login
             return render_template('login.html', error=True)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     user = get_current_user()
 
     if not user:
         return redirect('/login')
 
-    db.user_write_session(user['_id'], '')
+    get_db().user_write_session(user['_id'], '')
     return redirect('/')
 
 
-@app.route('/loggedin')
+@bp.route('/loggedin')
 def loggedin():
     user = get_current_user()
 
@@ -89,7 +258,7 @@ def loggedin():
     return 'Not authenticated'
 
 
-@app.route('/api/user')
+@bp.route('/api/user')
 def api_user():
     user = get_current_user()
 
@@ -99,23 +268,229 @@ def api_user():
     return json.dumps(user)
 
 
-@app.route('/api/thesis/all')
+def response_encoding() -> Optional[str]:
+    """
+    :return: 'gzip' if the streamed response is compressed for the client
+    """
+    if s.RESPONSE_GZIP and request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def encode_chunks(chunks, encoding: Optional[str]):
+    return gzip_chunks(chunks) if encoding == 'gzip' else chunks
+
+
+def set_content_encoding(response: Response, encoding: Optional[str]):
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+
+
+def catalogue_response(key: str, build):
+    """
+    serve a catalogue response from the catalogue cache, polls with an
+    up to date ETag get 304 without touching the database
+    """
+    catalogue = get_catalogue()
+    etag = catalogue.etag(catalogue.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        etag, body = catalogue.get_or_build(key, build)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@bp.route('/api/thesis/all')
+@admission('catalogue')
 def api_thesis_all():
     user = get_current_user()
 
     if not user:
         return abort(403)
 
-    result = []
+    return catalogue_list_response('all', theses_iterator())
+
+
+def theses_iterator():
+    """
+    :return: function returning a generator of all thesis dicts, it runs
+    while the response is sent, outside of the request context
+    """
+    replica = get_replica()
+    if replica is not None:
+        return replica.iter_all
+    graph = get_graph()
+    return lambda: Thesis.iter_all(graph)
+
+
+def catalogue_list_response(key: str, items):
+    """
+    catalogue_response of a list streamed while it is read, as a JSON array
+    or, if the client asks for it in Accept, as NDJSON, gzip compressed when
+    accepted, the cache keeps each representation
+    :param items: returns an iterable of the list items
+    """
+    catalogue = get_catalogue()
+    etag = catalogue.etag(catalogue.version)
+    mimetype = request.accept_mimetypes.best_match([JSON, NDJSON], JSON)
+    encoding = response_encoding()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        write = ndjson if mimetype == NDJSON else json_array
+        etag, body = catalogue.get_or_stream(
+            f'{key}:{mimetype}:{encoding}',
+            lambda: encode_chunks(write(items()), encoding))
+        response = Response(body, mimetype=mimetype)
+        set_content_encoding(response, encoding)
+    response.vary.add('Accept')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def get_int_arg(name: str):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return abort(400)
+
+
+def get_bool_arg(name: str):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+@bp.route('/api/thesis')
+@admission('catalogue')
+def api_thesis_page():
+    user = get_current_user()
+
+    if not user:
+        return abort(403)
 
-    query_result = client.find(Thesis.node_type)
-    for i in query_result:
-        result.append(i)
+    page_size = get_int_arg('page_size')
+    if page_size is None:
+        page_size = s.THESIS_PAGE_SIZE
+    if page_size < 1:
+        return abort(400)
+    page_size = min(page_size, s.THESIS_MAX_PAGE_SIZE)
+    filters = dict(
+        year=get_int_arg('year'),
+        difficulty_min=get_int_arg('difficulty_min'),
+        difficulty_max=get_int_arg('difficulty_max'),
+        tag=request.args.get('tag') or None,
+        only_unassigned=get_bool_arg('only_unassigned'),
+        instructor_id=request.args.get('instructor_id') or None,
+        department_id=request.args.get('department_id') or None,
+        thesis_name=request.args.get('thesis_name') or None,
+        cursor=request.args.get('cursor') or None,
+        page_size=page_size)
+
+    def build():
+        replica = get_replica()
+        items, next_cursor = replica.find_page(**filters) \
+            if replica is not None else Thesis.find_page(get_graph(), **filters)
+        return json.dumps({'items': items, 'next_cursor': next_cursor}).encode()
+
+    return catalogue_response(json.dumps(filters, sort_keys=True), build)
+
+
+@bp.route('/api/thesis/changes')
+@admission('catalogue')
+def api_thesis_changes():
+    """
+    theses changed and deleted since the `since` of the previous response,
+    without `since` only the starting point is returned
+    """
+    user = get_current_user()
 
+    if not user:
+        return abort(403)
+
+    try:
+        since = float(request.args['since']) if request.args.get('since') \
+            else None
+    except ValueError:
+        return abort(400)
+
+    now = datetime.now().timestamp()
+    result = {'since': now - CLOCK_SKEW, 'reset': False, 'items': [],
+              'deleted': []}
+    if since is None:
+        return json.dumps(result)
+    if since < now - s.THESIS_TOMBSTONE_TTL:
+        # the tombstones of older deletions are gone
+        result['reset'] = True
+        return json.dumps(result)
+
+    items, deleted = Thesis.find_changes(get_graph(), since)
+    result['items'] = items
+    result['deleted'] = [thesis_name for thesis_name, _ in deleted]
     return json.dumps(result)
 
 
-@app.route('/api/thesis/enrol', methods=['POST'])
+@bp.route('/api/thesis/stream')
+def api_thesis_stream():
+    """
+    Server-Sent Events with the catalogue changes, see db.stream
+    """
+    user = get_current_user()
+
+    if not user:
+        return abort(403)
+
+    listener = get_stream().open(request.headers.get('Last-Event-ID'),
+                                 s.STREAM_KEEPALIVE)
+    if listener is None:
+        # the client falls back to polling /api/thesis/changes
+        return error_response(503, 'Too many open streams')
+    return Response(listener, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/api/thesis/search')
+@admission('catalogue')
+def api_thesis_search():
+    user = get_current_user()
+
+    if not user:
+        return abort(403)
+
+    query = request.args.get('q', '')
+    limit = min(get_int_arg('limit') or s.THESIS_PAGE_SIZE,
+                s.THESIS_MAX_PAGE_SIZE)
+    items = get_search().search(query, limit,
+                                get_bool_arg('only_unassigned'))
+    return json.dumps({'items': items})
+
+
+@bp.route('/api/thesis/recommended')
+@admission('catalogue')
+def api_thesis_recommended():
+    allowed_roles = ['student']
+    user = get_current_user()
+
+    if not user:
+        return abort(403)
+
+    if allowed_roles and user['role'] not in allowed_roles:
+        return abort(403)
+
+    limit = min(get_int_arg('limit') or 20, RECOMMEND_DEPTH)
+    names = get_recommender().recommend(
+        user, limit, lambda: get_db().users_in_group(user.get('group_id')))
+    return json.dumps({'items': names})
+
+
+@bp.route('/api/thesis/enrol', methods=['POST'])
+@admission('enrol')
 def enrol_thesis():
     allowed_roles = ['student']
     user = get_current_user()
@@ -126,16 +501,63 @@ def enrol_thesis():
     if allowed_roles and user['role'] not in allowed_roles:
         return abort(403)
 
-    print(request.json)
     thesis_name = request.json['thesis_name']
 
-    db.user_enrol_thesis(user['_id'], thesis_name)
-    Thesis.thesis_enrol(client, thesis_name, user['_id'])
+    # the student is claimed in mongodb and the thesis in neo4j at the same
+    # time, each claim is atomic and undone if the other one fails; a claim
+    # the student already held (the session copy may be stale) returns False
+    # and is left alone
+    db, graph, user_id = get_db(), get_graph(), user['_id']
+    write = DualWrite(get_executor())
+    write.add('mongo',
+              lambda: db.user_enrol_thesis(user_id, thesis_name),
+              lambda enrolled: enrolled and
+              db.user_unenrol_thesis(user_id, thesis_name))
+    write.add('neo4j',
+              lambda: Thesis.thesis_enrol(graph, thesis_name, user_id),
+              lambda enrolled: enrolled and
+              Thesis.thesis_release(graph, thesis_name, user_id))
+    try:
+        write.run()
+    except EnrolmentConflictException as e:
+        return error_response(409, str(e))
+    except ObjectDoesNotExist as e:
+        return error_response(404, str(e))
+
     user['thesis_id'] = thesis_name
     return json.dumps(user)
 
 
-@app.route('/api/thesis/by_instructor')
+@bp.route('/api/thesis/preferences', methods=['POST'])
+def set_thesis_preferences():
+    """
+    ranked thesis preferences for the batch assignment (see db.matching)
+    """
+    allowed_roles = ['student']
+    user = get_current_user()
+
+    if not user or user.get('thesis_id'):
+        return abort(403)
+
+    if allowed_roles and user['role'] not in allowed_roles:
+        return abort(403)
+
+    preferences = request.json.get('preferences')
+    if not isinstance(preferences, list) or \
+            not all(isinstance(name, str) for name in preferences):
+        return abort(400)
+    if len(preferences) > s.MATCHING_MAX_PREFERENCES:
+        return error_response(
+            400, f'At most {s.MATCHING_MAX_PREFERENCES} preferences allowed')
+    # keep the first occurrence of every thesis
+    preferences = list(dict.fromkeys(preferences))
+
+    user = get_db().user_set_preferences(user['_id'], preferences,
+                                         datetime.now().timestamp())
+    return json.dumps(user)
+
+
+@bp.route('/api/thesis/by_instructor')
 def get_thesis_by_instructor():
     allowed_roles = ['instructor']
     user = get_current_user()
@@ -146,14 +568,25 @@ def get_thesis_by_instructor():
     if allowed_roles and user['role'] not in allowed_roles:
         return abort(403)
 
-    instructor_id = request.args['instructor_id']
-    print(instructor_id)
-    result = Instructor(instructor_id).get_thesis(client)
-    print(result)
-    return json.dumps(result)
-
-
-@app.route('/api/thesis/drop_by_id', methods=['POST'])
+    instructor = Instructor(request.args['instructor_id'])
+    replica = get_replica()
+    if replica is not None:
+        items = replica.instructor_theses(instructor.id)
+        counters = replica.instructor_counters(instructor.id)
+    else:
+        graph = get_graph()
+        counters = instructor.get_counters(graph)
+        items = instructor.iter_theses(graph)
+    # same document as json.dumps({'counters': ..., 'items': [...]})
+    encoding = response_encoding()
+    chunks = json_array(items, prefix=f'{{"counters": {json.dumps(counters)}, '
+                                      f'"items": ', suffix='}')
+    response = Response(encode_chunks(chunks, encoding), mimetype=JSON)
+    set_content_encoding(response, encoding)
+    return response
+
+
+@bp.route('/api/thesis/drop_by_id', methods=['POST'])
 def drop_thesis_by_id():
     allowed_roles = ['instructor']
     user = get_current_user()
@@ -166,13 +599,24 @@ def drop_thesis_by_id():
 
     instructor_id = request.json['instructor_id']
     thesis_id = request.json['thesis_id']
-    print(thesis_id)
-    print(instructor_id)
-    Instructor(instructor_id).delete_thesis(client, thesis_id)
+
+    # the deleted thesis can not be restored, so only the mongodb side is
+    # undone when the deletion fails
+    db, graph = get_db(), get_graph()
+    write = DualWrite(get_executor())
+    write.add('mongo', lambda: db.user_drop_thesis(thesis_id),
+              lambda student_id: student_id and
+              db.user_enrol_thesis(student_id, thesis_id))
+    write.add('neo4j', lambda: Instructor(instructor_id).delete_thesis(
+        graph, thesis_id))
+    try:
+        write.run()
+    except ObjectDoesNotExist as e:
+        return error_response(404, str(e))
     return 'OK'
 
 
-@app.route('/api/profile/update', methods=['POST'])
+@bp.route('/api/profile/update', methods=['POST'])
 def update_profile():
     user = get_current_user()
 
@@ -191,16 +635,20 @@ def update_profile():
         'last_name': last_name,
         'email': email,
     }
-    print('profile update')
-    print(data)
     if password:
         data['password'] = password
-
-    user = db.user_profile_update(user['_id'], data)
+    if 'interests' in request.json:
+        data['interests'] = parse_tags(request.json['interests'])
+
+    user = get_db().user_profile_update(user['_id'], data)
+    # a recommender built later reads the new interests anyway
+    recommender = current_app.extensions['clients'].recommender_if_built()
+    if recommender is not None:
+        recommender.forget(user['_id'])
     return json.dumps(user)
 
 
-@app.route('/api/thesis/add', methods=['POST'])
+@bp.route('/api/thesis/add', methods=['POST'])
 def add_thesis():
     allowed_roles = ['instructor']
     user = get_current_user()
@@ -221,11 +669,36 @@ def add_thesis():
     instructor = Instructor(user['_id'])
     thesis = Thesis(thesis_name=thesis_name, description=description,
                     year=year, difficulty=difficulty)
-    instructor.add_thesis(client, thesis, tags)
+    instructor.add_thesis(get_graph(), thesis, tags)
     return 'Success'
 
 
-@app.route('/')
+@bp.route('/api/thesis/bulk', methods=['POST'])
+def add_thesis_bulk():
+    allowed_roles = ['instructor']
+    user = get_current_user()
+
+    if not user:
+        return abort(403)
+
+    if allowed_roles and user['role'] not in allowed_roles:
+        return abort(403)
+
+    theses = request.json.get('theses')
+    if not isinstance(theses, list):
+        return abort(400)
+    batch_size = request.json.get('batch_size', s.BULK_IMPORT_BATCH_SIZE)
+    if not isinstance(batch_size, int) or isinstance(batch_size, bool) or \
+            not 1 <= batch_size <= s.BULK_IMPORT_BATCH_SIZE:
+        return error_response(400, f'"batch_size" must be an integer in '
+                                   f'[1, {s.BULK_IMPORT_BATCH_SIZE}]')
+
+    report = import_theses(get_graph(), theses, batch_size,
+                           owner_id=str(user['_id']))
+    return json.dumps(report.to_dict())
+
+
+@bp.route('/')
 def main():
     user = get_current_user()
 
@@ -235,7 +708,7 @@ def main():
     return render_template('index.html', user=user)
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def on_notfound(e):
     user = get_current_user()
 
@@ -246,5 +719,6 @@ def on_notfound(e):
 
 
 if __name__ == '__main__':
+    app = create_app()
     app.debug = True
     app.run(host=s.APP_HOST, port=s.APP_PORT)
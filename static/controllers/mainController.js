@@ -1,7 +1,11 @@
 angular.module('myApp')
-  .controller('MainController', ['$scope', '$rootScope', '$http', function($scope, $rootScope, $http) {
+  .controller('MainController', ['$scope', '$rootScope', '$http', '$interval', '$timeout', function($scope, $rootScope, $http, $interval, $timeout) {
 
   $scope.nonstop_thesis = [];
+  $scope.next_cursor = null;
+  // timestamp for /api/thesis/changes, null until the lists are loaded
+  $scope.changes_since = null;
+  var POLL_INTERVAL_MS = 10000;
 
     $scope.refreshAll = function(){
     if(!$rootScope.user){
@@ -13,13 +17,40 @@ angular.module('myApp')
     $scope.showStudentThesis = $scope.showStudent && $rootScope.user.thesis_id;
     $scope.showStudentNoThesis = $scope.showStudent && !$rootScope.user.thesis_id;
     $scope.my_thesis = $rootScope.user.thesis_id;
-    if($scope.showStudent){
-        $http.get('/api/thesis/all').then(
+    if($scope.changes_since === null){
+        return $scope.reloadAll();
+    }
+    $scope.applyChanges();
+  }
+
+  $scope.reloadAll = function(){
+    // the starting point of the deltas is taken before the lists, changes
+    // made in between come again with the first deltas
+    $http.get('/api/thesis/changes').then(
+        function(response){
+            $scope.changes_since = response.data.since;
+            $scope.loadLists();
+        },
+        function(){
+            console.log('error getting thesis changes');
+        }
+    );
+  };
+
+  $scope.loadLists = function(){
+    if($scope.showStudentNoThesis){
+        $scope.nonstop_thesis = [];
+        $scope.next_cursor = null;
+        $scope.loadMoreThesis();
+      }
+    if($scope.showStudentThesis){
+        $http({
+            url: '/api/thesis',
+            method: "GET",
+            params: {thesis_name: $scope.my_thesis}
+         }).then(
             function(response){
-                var data = response.data;
-                $scope.nonstop_thesis = data;
-                $scope.nonstop_thesis_my = $scope.nonstop_thesis.filter(
-                    function(item){return item.thesis_name==$scope.my_thesis});
+                $scope.nonstop_thesis_my = response.data.items;
             },
             function(){
                 console.log('error getting thesis data');
@@ -36,14 +67,180 @@ angular.module('myApp')
          }).then(
             function(response){
                 var data = response.data;
-                $scope.nonstop_thesis_in = data;
+                $scope.nonstop_thesis_in = data.items;
+                $scope.instructor_counters = data.counters;
             },
             function(){
                 console.log('error getting thesis_in data');
             }
         );
       }
+  };
+
+  // replace changed theses of a list sorted by thesis_name, drop deleted
+  // ones and the ones keep() rejects; changed theses after `last` belong to
+  // pages that are not loaded yet
+  function mergeChanges(list, changes, keep, last){
+    var dropped = {};
+    changes.deleted.forEach(function(name){ dropped[name] = true; });
+    changes.items.forEach(function(thesis){ dropped[thesis.thesis_name] = true; });
+    var result = list.filter(function(thesis){
+        return !dropped[thesis.thesis_name];
+    });
+    changes.items.forEach(function(thesis){
+        if(keep(thesis) && (!last || thesis.thesis_name <= last)){
+            result.push(thesis);
+        }
+    });
+    result.sort(function(a, b){
+        return a.thesis_name < b.thesis_name ? -1 : (a.thesis_name > b.thesis_name ? 1 : 0);
+    });
+    return result;
+  }
+
+  $scope.applyChanges = function(){
+    $http({
+        url: '/api/thesis/changes',
+        method: "GET",
+        params: {since: $scope.changes_since}
+     }).then(
+        function(response){
+            var data = response.data;
+            if(data.reset){
+                $scope.changes_since = null;
+                return $scope.refreshAll();
+            }
+            $scope.changes_since = data.since;
+            $scope.mergeAll(data);
+        },
+        function(){
+            console.log('error getting thesis changes');
+        }
+    );
+  };
+
+  // changes: {items: changed theses, deleted: names of deleted theses}
+  $scope.mergeAll = function(changes){
+    if($scope.showStudentNoThesis){
+        $scope.nonstop_thesis = mergeChanges($scope.nonstop_thesis, changes,
+            function(thesis){ return !thesis.student_id; }, $scope.next_cursor);
+    }
+    if($scope.showStudentThesis){
+        $scope.nonstop_thesis_my = mergeChanges($scope.nonstop_thesis_my, changes,
+            function(thesis){ return thesis.thesis_name == $scope.my_thesis; }, null);
+    }
+    if($scope.showInstructor){
+        $scope.nonstop_thesis_in = mergeChanges($scope.nonstop_thesis_in, changes,
+            function(thesis){ return thesis.instructor_id == $rootScope.user._id; }, null);
+        var counters = $scope.instructor_counters;
+        if(counters){
+            counters.theses_offered = $scope.nonstop_thesis_in.length;
+            counters.theses_enrolled = $scope.nonstop_thesis_in.filter(
+                function(thesis){ return thesis.student_id; }).length;
+            counters.remaining = counters.load === null ? null :
+                Math.max(counters.load - counters.theses_enrolled, 0);
+        }
+    }
+  };
+
+  // enrol and release events only name the thesis, the shown copy is
+  // patched; a thesis that is not shown yet is fetched with the changes
+  function patchThesis(thesis_name, patch){
+    var lists = [$scope.nonstop_thesis, $scope.nonstop_thesis_my, $scope.nonstop_thesis_in];
+    for(var i = 0; i < lists.length; i++){
+        var found = lists[i].filter(function(thesis){ return thesis.thesis_name == thesis_name; });
+        if(found.length){
+            return $scope.mergeAll({items: [patch(angular.copy(found[0]))], deleted: []});
+        }
+    }
+    if($scope.changes_since !== null){
+        $scope.applyChanges();
+    }
+  }
+
+  var streamHandlers = {
+    created: function(thesis){
+        $scope.mergeAll({items: [thesis], deleted: []});
+    },
+    enrolled: function(data){
+        patchThesis(data.thesis_name, function(thesis){
+            thesis.student_id = data.student_id;
+            return thesis;
+        });
+    },
+    released: function(data){
+        patchThesis(data.thesis_name, function(thesis){
+            delete thesis.student_id;
+            return thesis;
+        });
+    },
+    deleted: function(data){
+        $scope.mergeAll({items: [], deleted: [data.thesis_name]});
+    },
+    reset: function(){
+        if($scope.changes_since !== null){
+            $scope.applyChanges();
+        }
+    }
+  };
+
+  // pushed changes instead of polling; the browser reconnects with
+  // Last-Event-ID, polling is the fallback when there is no stream
+  var poll = null;
+  function startPolling(){
+    poll = poll || $interval(function(){
+        if($scope.changes_since !== null){
+            $scope.applyChanges();
+        }
+    }, POLL_INTERVAL_MS);
   }
+  var stream = null;
+  if(window.EventSource){
+    stream = new EventSource('/api/thesis/stream');
+    Object.keys(streamHandlers).forEach(function(event){
+        stream.addEventListener(event, function(message){
+            $scope.$apply(function(){
+                streamHandlers[event](JSON.parse(message.data));
+            });
+        });
+    });
+    stream.onerror = function(){
+        if(stream.readyState == EventSource.CLOSED){
+            startPolling();
+        }
+    };
+  } else {
+    startPolling();
+  }
+  $scope.$on('$destroy', function(){
+    if(stream){
+        stream.close();
+    }
+    if(poll){
+        $interval.cancel(poll);
+    }
+  });
+
+  $scope.loadMoreThesis = function(){
+    var params = {only_unassigned: 1};
+    if($scope.next_cursor){
+        params.cursor = $scope.next_cursor;
+    }
+    $http({
+        url: '/api/thesis',
+        method: "GET",
+        params: params
+     }).then(
+        function(response){
+            var data = response.data;
+            $scope.nonstop_thesis = $scope.nonstop_thesis.concat(data.items);
+            $scope.next_cursor = data.next_cursor;
+        },
+        function(){
+            console.log('error getting thesis data');
+        }
+    );
+  };
 
   $scope.requestdo = function(){
   $http.get('/api/user').then(
@@ -99,6 +296,20 @@ angular.module('myApp')
             },
             function(response){
                 console.log(response);
+                if(response.status == 429){
+                    // enrolment is busy, try again when the server says so
+                    var wait = parseInt(response.headers('Retry-After')) || 1;
+                    $scope.enrol_retry_in = wait;
+                    $timeout(function(){
+                        $scope.enrol_retry_in = null;
+                        $scope.onSubmitEnrol(thesis_name);
+                    }, wait * 1000);
+                    return;
+                }
+                if(response.status == 409 || response.status == 404){
+                    alert(response.data.error);
+                    $scope.requestdo();
+                }
             }
         );
     };
@@ -5,6 +5,7 @@ angular.module('myApp')
     $scope.last_name = '';
     $scope.email = '';
     $scope.password = '';
+    $scope.interests = '';
 
     $scope.onSubmit = function(){
         var data = {
@@ -12,6 +13,7 @@ angular.module('myApp')
             middle_name: $scope.middle_name,
             last_name: $scope.last_name,
             email: $scope.email,
+            interests: $scope.interests,
         }
         if($scope.password){
             data.password = $scope.password;
@@ -25,6 +27,7 @@ angular.module('myApp')
                 $scope.middle_name = $rootScope.user.middle_name;
                 $scope.last_name = $rootScope.user.last_name;
                 $scope.email = $rootScope.user.email;
+                $scope.interests = ($rootScope.user.interests || []).join(', ');
                 $scope.password = '';
             },
             function(response){
@@ -40,6 +43,7 @@ angular.module('myApp')
                 $scope.middle_name = $rootScope.user.middle_name;
                 $scope.last_name = $rootScope.user.last_name;
                 $scope.email = $rootScope.user.email;
+                $scope.interests = ($rootScope.user.interests || []).join(', ');
                 $scope.password = '';
     }
     $scope.requestdo = function(){
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from db.admission import AdmissionPool, RateLimiter
+from db.exceptions import AdmissionRejectedException
+
+
+def test_token_bucket_refills_at_the_rate():
+    now = [0.0]
+    limiter = RateLimiter(rate=2, burst=2, max_users=10, timer=lambda: now[0])
+    assert limiter.take('a') == 0
+    assert limiter.take('a') == 0
+    assert limiter.take('a') == pytest.approx(0.5)
+    assert limiter.take('b') == 0
+    now[0] = 0.5
+    assert limiter.take('a') == 0
+
+
+def test_pool_queues_in_order_and_rejects_when_full():
+    pool = AdmissionPool('test', concurrency=1, max_queue=2, max_wait=5)
+    assert pool.acquire() == 0
+
+    order = []
+
+    def wait(name):
+        order.append((name, pool.acquire()))
+        pool.release(0.01)
+
+    threads = []
+    for name in ('first', 'second'):
+        threads.append(threading.Thread(target=wait, args=(name,)))
+        threads[-1].start()
+        while len(pool.queue) < len(threads):
+            pass
+    with pytest.raises(AdmissionRejectedException) as e:
+        pool.acquire()
+    assert e.value.retry_after >= 1
+
+    pool.release(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == [('first', 1), ('second', 2)]
+    assert pool.active == 0 and not pool.queue
+
+
+def test_pool_rejects_after_max_wait():
+    pool = AdmissionPool('test', concurrency=1, max_queue=5, max_wait=0.01)
+    pool.acquire()
+    with pytest.raises(AdmissionRejectedException):
+        pool.acquire()
+    assert not pool.queue
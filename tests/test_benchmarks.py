@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.run import SCENARIOS, compare, run  # noqa: E402
+
+
+def test_scenarios_run_on_standins():
+    result = run(list(SCENARIOS), 5)
+    for name, scenario in result['scenarios'].items():
+        assert scenario['requests'] == 5, name
+        assert set(scenario['statuses']) <= {'200', '302'}, name
+    assert result['scenarios']['catalogue']['round_trips']['mongo'] == 0
+    assert result['scenarios']['enrol']['round_trips'] == \
+        {'mongo': 1, 'neo4j': 1}
+    assert len(compare(result, result)) == len(SCENARIOS) + 1
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.run import Bench  # noqa: E402
+
+
+def test_instructors_import_only_their_own_theses():
+    bench = Bench(1)
+    instructor, other = bench.instructors[:2]
+    client = bench.login(instructor)
+    rows = [{'thesis_name': 'Bulk own', 'year': 4, 'difficulty': 3},
+            {'thesis_name': 'Bulk other', 'year': 4, 'difficulty': 3,
+             'instructor_id': str(other['_id'])}]
+    report = json.loads(client.post('/api/thesis/bulk', json={
+        'theses': rows}).data)
+    assert report['imported'] == 1
+    assert [error['row'] for error in report['errors']] == [2]
+    assert bench.clients.graph.graph.thesis_instructor['Bulk own'] == \
+        str(instructor['_id'])
+    assert 'Bulk other' not in bench.clients.graph.graph.theses
+
+    for batch_size in [0, -1, '10', True, 10 ** 6]:
+        response = client.post('/api/thesis/bulk', json={
+            'theses': rows, 'batch_size': batch_size})
+        assert response.status_code == 400
@@ -0,0 +1,65 @@
+from db.cache import LRUCache, UserSessionCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_expiration():
+    timer = FakeTimer()
+    cache = LRUCache(10, ttl=5, timer=timer)
+    cache.set('a', 1)
+    timer.now = 4
+    assert cache.get('a') == 1
+    timer.now = 5
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 1, 1)
+
+
+def test_drop_user_sessions():
+    cache = UserSessionCache(10, 10)
+    cache.put_user({'_id': 'u1', 'email': 'a@test.com'})
+    cache.put_user({'_id': 'u2', 'email': 'b@test.com'})
+    cache.put_session('s1', 'u1')
+    cache.put_session('s2', 'u1')
+    cache.put_session('s3', 'u2')
+    assert cache.get_user_by_session('s2')['email'] == 'a@test.com'
+
+    cache.drop_user_sessions('u1')
+    assert cache.get_user_by_session('s1') is None
+    assert cache.get_user_by_session('s2') is None
+    assert cache.get_user_by_session('s3')['_id'] == 'u2'
+    assert 'u1' not in cache.user_sessions
+
+
+def test_evicted_session_leaves_reverse_index():
+    cache = UserSessionCache(10, 2)
+    cache.put_session('s1', 'u1')
+    cache.put_session('s2', 'u2')
+    cache.put_session('s3', 'u2')
+    assert cache.user_sessions == {'u2': {'s2', 's3'}}
+
+
+def test_session_moves_to_another_user():
+    cache = UserSessionCache(10, 10)
+    cache.put_session('s1', 'u1')
+    cache.put_session('s1', 'u2')
+    assert cache.user_sessions == {'u2': {'s1'}}
@@ -0,0 +1,53 @@
+from db import events
+from db.catalogue import CatalogueCache, CATALOGUE
+from db.invalidation import InvalidationChannel
+
+
+class RecordingChannel(InvalidationChannel):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, kind, key):
+        self.published.append((kind, key))
+
+
+def test_response_is_rebuilt_after_event():
+    cache = CatalogueCache(10)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return b'[]'
+
+    etag, body = cache.get_or_build('all', build)
+    assert cache.get_or_build('all', build) == (etag, body)
+    assert len(builds) == 1
+
+    events.emit(events.THESIS_DELETED, thesis_name='x', instructor_id='i')
+    new_etag, _ = cache.get_or_build('all', build)
+    assert new_etag != etag
+    assert len(builds) == 2
+    events.unsubscribe(cache.on_event)
+
+
+def test_version_is_shared_with_other_workers():
+    channel = RecordingChannel()
+    writer = CatalogueCache(10, channel)
+    reader = CatalogueCache(10)
+    reader.get_or_build('all', lambda: b'[]')
+
+    writer.on_event(events.THESIS_CREATED, {})
+    kind, version = channel.published[-1]
+    assert kind == CATALOGUE
+    reader.on_invalidation(kind, version)
+    assert reader.version == writer.version
+    assert reader.get('all', reader.version) is None
+
+    # a worker already ahead keeps its version instead of inventing one
+    reader.bump()
+    ahead = reader.version
+    reader.on_invalidation(kind, version)
+    assert reader.version == ahead
+    for cache in (writer, reader):
+        events.unsubscribe(cache.on_event)
@@ -0,0 +1,71 @@
+import gzip
+import json
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.run import Bench  # noqa: E402
+
+
+def test_changes_return_updated_and_deleted_theses():
+    bench = Bench(1)
+    student = next(user for user in bench.students
+                   if not user.get('thesis_id'))
+    client = bench.login(student)
+    since = json.loads(client.get('/api/thesis/changes').data)['since']
+
+    name = next(row['props']['thesis_name'] for row in bench.data['theses']
+                if not row['props'].get('student_id'))
+    assert client.post('/api/thesis/enrol',
+                       json={'thesis_name': name}).status_code == 200
+    changes = json.loads(client.get(f'/api/thesis/changes?since={since}').data)
+    assert not changes['reset']
+    # the test data has just been written, so every thesis is recent
+    changed = {item['thesis_name']: item for item in changes['items']}
+    assert changed[name]['student_id'] == str(student['_id'])
+
+    instructor = bench.instructors[0]
+    thesis = next(row for row in bench.data['theses']
+                  if row['instructor_id'] == str(instructor['_id']))
+    bench.login(instructor).post('/api/thesis/drop_by_id', json={
+        'instructor_id': str(instructor['_id']),
+        'thesis_id': thesis['props']['thesis_name']})
+    changes = json.loads(client.get(f'/api/thesis/changes?since={since}').data)
+    assert changes['deleted'] == [thesis['props']['thesis_name']]
+
+    assert json.loads(client.get('/api/thesis/changes?since=1').data)['reset']
+    assert client.get('/api/thesis/changes?since=x').status_code == 400
+
+
+def test_thesis_list_is_streamed_in_the_accepted_format():
+    bench = Bench(1)
+    client = bench.login(bench.students[0])
+    response = client.get('/api/thesis/all')
+    theses = json.loads(response.data)
+    assert len(theses) == len(bench.data['theses'])
+
+    response = client.get('/api/thesis/all',
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data)) == theses
+    # the second request is answered with the cached body
+    assert client.get('/api/thesis/all', headers={
+        'Accept-Encoding': 'gzip'}).data == response.data
+
+    response = client.get('/api/thesis/all',
+                          headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in
+            response.data.splitlines()] == theses
+
+
+def test_page_size_is_checked():
+    bench = Bench(1)
+    client = bench.login(bench.students[0])
+    page = json.loads(client.get('/api/thesis?page_size=2').data)
+    assert len(page['items']) == 2
+    assert client.get('/api/thesis?page_size=0').status_code == 400
+    assert client.get('/api/thesis?page_size=-1').status_code == 400
+    assert client.get('/api/thesis').status_code == 200
@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.standins import create_clients, create_graph_client, \
+    create_mongo_client  # noqa: E402
+from db import events  # noqa: E402
+from db.clients import Clients  # noqa: E402
+from src.app import create_app  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_connects_on_first_use():
+    # a fresh interpreter, where the modules are imported by the test itself
+    code = textwrap.dedent('''
+        import py2neo, pymongo
+
+        def connect(*args, **kwargs):
+            raise AssertionError('connected before first use')
+
+        pymongo.MongoClient = py2neo.Graph = connect
+        from src.app import create_app
+
+        clients = create_app().extensions['clients']
+        assert clients._mongo is None and clients._graph is None
+    ''')
+    env = dict(os.environ, APP_WARM_UP='0')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    created = []
+    clients = Clients(
+        mongo_factory=lambda: created.append('mongo') or create_mongo_client(),
+        graph_factory=lambda: created.append('neo4j') or create_graph_client())
+    create_app(clients, warm_up=False)
+    assert created == []
+    clients.graph
+    assert created == ['neo4j', 'mongo']  # the relay uses the channel
+    clients.graph
+    assert created == ['neo4j', 'mongo']
+
+
+def test_new_process_rebuilds_clients(monkeypatch):
+    clients = create_clients()
+    mongo, catalogue = clients.mongo, clients.catalogue
+    assert catalogue.on_event in events._listeners
+
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert clients.mongo is not mongo
+    assert clients.catalogue is not catalogue
+    assert catalogue.on_event not in events._listeners
+    assert clients.catalogue.on_event in events._listeners
+
+
+def test_warm_up_records_cold_start():
+    app = create_app(create_clients(), warm_up=True)
+    cold_start = app.extensions['cold_start']
+    assert set(cold_start) == {'import', 'mongo', 'neo4j', 'total'}
+    assert all(value >= 0 for value in cold_start.values())
+    assert app.extensions['clients']._catalogue is not None
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+import create_test_database  # noqa: E402
+from bson import ObjectId  # noqa: E402
+
+from benchmarks.run import Bench  # noqa: E402
+from benchmarks.standins import create_clients  # noqa: E402
+from db.counters import rebuild_counters  # noqa: E402
+from db.db_neo4j import Thesis, Instructor  # noqa: E402
+
+
+@pytest.fixture
+def bench():
+    return Bench(1)
+
+
+def test_fully_loaded_instructor_has_no_places_left(bench):
+    graph = bench.clients.graph.graph._graph
+    name = next(row['props']['thesis_name'] for row in bench.data['theses']
+                if not row['props'].get('student_id'))
+    instructor = graph.instructors[graph.thesis_instructor[name]]
+    instructor['load'] = instructor.get('theses_enrolled', 0)
+    student = next(user for user in bench.students
+                   if not user.get('thesis_id'))
+
+    response = bench.login(student).post('/api/thesis/enrol',
+                                         json={'thesis_name': name})
+    assert response.status_code == 409
+    assert json.loads(response.data) == {
+        'error': f'The instructor of thesis "{name}" has no places left'}
+    assert not graph.theses[name].get('student_id')
+    assert not bench.clients.mongo.users.find_one(
+        {'_id': ObjectId(student['_id'])}).get('thesis_id')
+
+
+def test_release_decrements_the_counter(bench):
+    row = next(row for row in bench.data['theses']
+               if row['props'].get('student_id'))
+    name, student_id = row['props']['thesis_name'], row['props']['student_id']
+    instructor = Instructor(row['instructor_id'])
+    enrolled = instructor.get_counters(bench.clients.graph)['theses_enrolled']
+
+    assert Thesis.thesis_release(bench.clients.graph, name, student_id)
+    assert instructor.get_counters(bench.clients.graph)[
+        'theses_enrolled'] == enrolled - 1
+    # only the student having the thesis releases it
+    assert not Thesis.thesis_release(bench.clients.graph, name, student_id)
+    assert instructor.get_counters(bench.clients.graph)[
+        'theses_enrolled'] == enrolled - 1
+
+
+def test_rebuild_restores_drifted_counters(bench):
+    graph = bench.clients.graph.graph._graph
+    expected = {id: (instructor.get('theses_offered', 0),
+                     instructor.get('theses_enrolled', 0))
+                for id, instructor in graph.instructors.items()}
+    drifted = sorted(expected)[:2]
+    graph.instructors[drifted[0]]['theses_offered'] += 3
+    graph.instructors[drifted[1]]['theses_enrolled'] = 0
+    assert expected[drifted[1]][1] > 0
+
+    assert rebuild_counters(bench.clients.graph, batch_size=3,
+                            check=True) == drifted
+    assert graph.instructors[drifted[0]]['theses_offered'] == \
+        expected[drifted[0]][0] + 3
+
+    assert rebuild_counters(bench.clients.graph, batch_size=3) == drifted
+    assert {id: (instructor['theses_offered'], instructor['theses_enrolled'])
+            for id, instructor in graph.instructors.items()} == expected
+    assert rebuild_counters(bench.clients.graph) == []
+
+
+def test_generated_enrolments_respect_the_load():
+    clients = create_clients()
+    data = create_test_database.generate_university(
+        load_min=1, load_max=1, enrolled_share=1.0)
+    create_test_database.write_university(data, clients.mongo, clients.graph)
+
+    enrolled = {}
+    for row in data['theses']:
+        if row['props'].get('student_id'):
+            enrolled[row['instructor_id']] = \
+                enrolled.get(row['instructor_id'], 0) + 1
+    assert enrolled and max(enrolled.values()) == 1
+    assert rebuild_counters(clients.graph, check=True) == []
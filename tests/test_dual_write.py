@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db.dual_write import DualWrite
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(4) as executor:
+        yield executor
+
+
+def test_steps_run_concurrently(executor):
+    barrier = threading.Barrier(2, timeout=2)
+    write = DualWrite(executor)
+    write.add('mongo', lambda: (barrier.wait(), 'm')[1])
+    write.add('neo4j', lambda: (barrier.wait(), 'n')[1])
+    assert write.run() == {'mongo': 'm', 'neo4j': 'n'}
+
+
+def test_failure_compensates_successful_steps(executor):
+    undone = []
+
+    def fail():
+        raise KeyError('neo4j')
+
+    write = DualWrite(executor)
+    write.add('mongo', lambda: 'user', undone.append)
+    write.add('neo4j', fail, lambda _: undone.append('thesis'))
+    with pytest.raises(KeyError):
+        write.run()
+    assert undone == ['user']
+
+
+def test_failed_compensation_does_not_hide_error(executor):
+    def fail():
+        raise ValueError('mongo')
+
+    def fail_compensation(_):
+        raise RuntimeError('compensation')
+
+    write = DualWrite(executor)
+    write.add('mongo', fail)
+    write.add('neo4j', lambda: None, fail_compensation)
+    with pytest.raises(ValueError):
+        write.run()
@@ -0,0 +1,165 @@
+import json
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from bson import ObjectId  # noqa: E402
+
+from benchmarks.run import Bench  # noqa: E402
+from db import events  # noqa: E402
+from db.db_neo4j import Thesis, ThesisStatus  # noqa: E402
+from db.exceptions import EnrolmentConflictException  # noqa: E402
+
+
+@pytest.fixture
+def bench():
+    return Bench(1)
+
+
+def free_student(bench: Bench):
+    return next(user for user in bench.students if not user.get('thesis_id'))
+
+
+def free_thesis(bench: Bench) -> str:
+    return next(row['props']['thesis_name'] for row in bench.data['theses']
+                if not row['props'].get('student_id'))
+
+
+def mongo_user(bench: Bench, user: dict) -> dict:
+    return bench.clients.mongo.users.find_one({'_id': ObjectId(user['_id'])})
+
+
+def enrolled_student(bench: Bench):
+    """
+    a student holding a thesis in both stores, logged in with a stale
+    session copy that misses the thesis
+    """
+    student = next(user for user in bench.students if user.get('thesis_id'))
+    client = bench.login(student)
+    user = mongo_user(bench, student)
+    user['thesis_id'] = None
+    bench.clients.mongo.cache_user(user)
+    return student, client
+
+
+def assert_still_enrolled(bench: Bench, student: dict):
+    name = student['thesis_id']
+    assert mongo_user(bench, student)['thesis_id'] == name
+    thesis = bench.clients.graph.graph._graph.theses[name]
+    assert thesis['student_id'] == str(student['_id'])
+
+
+def test_neo4j_failure_keeps_enrolment_mongodb_already_had(bench,
+                                                           monkeypatch):
+    student, client = enrolled_student(bench)
+
+    def fail(**_):
+        raise ConnectionError('neo4j is unavailable')
+
+    monkeypatch.setattr(bench.clients.graph.graph._graph, 'q_thesis_enrol',
+                        fail)
+    response = client.post('/api/thesis/enrol',
+                           json={'thesis_name': student['thesis_id']})
+    assert response.status_code == 500
+    assert_still_enrolled(bench, student)
+
+
+def test_mongodb_failure_keeps_enrolment_neo4j_already_had(bench,
+                                                           monkeypatch):
+    student, client = enrolled_student(bench)
+
+    def fail(*_):
+        raise ConnectionError('mongodb is unavailable')
+
+    monkeypatch.setattr(bench.clients.mongo, 'user_enrol_thesis', fail)
+    response = client.post('/api/thesis/enrol',
+                           json={'thesis_name': student['thesis_id']})
+    assert response.status_code == 500
+    assert_still_enrolled(bench, student)
+
+
+def test_enrolling_again_is_a_no_op(bench):
+    student, client = enrolled_student(bench)
+    response = client.post('/api/thesis/enrol',
+                           json={'thesis_name': student['thesis_id']})
+    assert response.status_code == 200
+    assert_still_enrolled(bench, student)
+
+
+def test_enrol_free_thesis(bench):
+    student, name = free_student(bench), free_thesis(bench)
+    graph = bench.clients.graph.graph._graph
+    instructor = graph.instructors[graph.thesis_instructor[name]]
+    enrolled = instructor.get('theses_enrolled', 0)
+
+    response = bench.login(student).post('/api/thesis/enrol',
+                                         json={'thesis_name': name})
+    assert response.status_code == 200
+    assert json.loads(response.data)['thesis_id'] == name
+    assert graph.theses[name]['student_id'] == str(student['_id'])
+    assert graph.theses[name]['status'] == ThesisStatus.ENROLLED
+    assert instructor['theses_enrolled'] == enrolled + 1
+    assert mongo_user(bench, student)['thesis_id'] == name
+
+
+def test_enrol_taken_thesis_is_a_conflict(bench):
+    student = free_student(bench)
+    name = next(row['props']['thesis_name'] for row in bench.data['theses']
+                if row['props'].get('student_id'))
+
+    response = bench.login(student).post('/api/thesis/enrol',
+                                         json={'thesis_name': name})
+    assert response.status_code == 409
+    assert json.loads(response.data) == {
+        'error': f'Thesis "{name}" is already taken by another student'}
+    # the mongodb claim has been undone
+    assert not mongo_user(bench, student).get('thesis_id')
+
+
+def test_enrol_unknown_thesis_is_not_found(bench):
+    student = free_student(bench)
+
+    response = bench.login(student).post('/api/thesis/enrol',
+                                         json={'thesis_name': 'No such'})
+    assert response.status_code == 404
+    assert json.loads(response.data) == {
+        'error': "Object <Thesis> with fields {'thesis_name': 'No such'} "
+                 "dose not exist in the database"}
+    assert not mongo_user(bench, student).get('thesis_id')
+
+
+def test_mongodb_rejects_student_enrolled_elsewhere(bench):
+    student, client = enrolled_student(bench)
+    name = free_thesis(bench)
+    # the stale session copy passes the check of the route, the neo4j claim
+    # is undone
+    response = client.post('/api/thesis/enrol', json={'thesis_name': name})
+    assert response.status_code == 409
+    assert json.loads(response.data) == {
+        'error': 'The student is already enrolled for another thesis'}
+    assert_still_enrolled(bench, student)
+    assert not bench.clients.graph.graph._graph.theses[name].get('student_id')
+
+    with pytest.raises(EnrolmentConflictException):
+        bench.clients.mongo.user_enrol_thesis(student['_id'], name)
+    assert_still_enrolled(bench, student)
+
+
+def test_enrolling_again_emits_no_event(bench):
+    student, name = free_student(bench), free_thesis(bench)
+    emitted = []
+
+    def listener(event, payload):
+        if event == events.THESIS_ENROLLED:
+            emitted.append(payload['thesis_name'])
+
+    events.subscribe(listener)
+    try:
+        assert Thesis.thesis_enrol(bench.clients.graph, name, student['_id'])
+        assert not Thesis.thesis_enrol(bench.clients.graph, name,
+                                       student['_id'])
+    finally:
+        events.unsubscribe(listener)
+    assert emitted == [name]
@@ -0,0 +1,38 @@
+import time
+
+from db.invalidation import UnixSocketChannel, USER
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_unix_socket_channel_broadcast(tmp_path):
+    channels = [UnixSocketChannel(str(tmp_path)) for _ in range(3)]
+    received = [[] for _ in channels]
+    for channel, messages in zip(channels, received):
+        channel.subscribe(lambda kind, key, messages=messages:
+                          messages.append((kind, key)))
+    try:
+        channels[0].publish(USER, 'u1')
+        assert wait_for(lambda: all(received[1:]))
+        assert received[1] == received[2] == [(USER, 'u1')]
+        assert received[0] == []
+    finally:
+        for channel in channels:
+            channel.close()
+
+
+def test_unix_socket_channel_removes_stale_sockets(tmp_path):
+    alive = UnixSocketChannel(str(tmp_path))
+    gone = UnixSocketChannel(str(tmp_path))
+    gone.sock.close()
+    try:
+        alive.publish(USER, 'u1')
+        assert [p.name for p in tmp_path.iterdir()] == \
+            [alive.path.rsplit('/', 1)[1]]
+    finally:
+        alive.close()
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.load import LoadTest, parse_args  # noqa: E402
+
+
+def test_enrolment_burst_leaves_no_double_assignment():
+    args = parse_args(['--students', '40', '--duration', '0.5',
+                       '--enrol-at', '0', '--burst-spread', '0.2',
+                       '--poll-rate', '20', '--instructor-rate', '2',
+                       '--latency', '0', '--threads', '20'])
+    result = LoadTest(args).run()
+    assert result['violations'] == []
+    assert result['enrolled'] > 0
+    enrol = result['requests']['enrol']
+    assert enrol['errors'] == 0
+    assert sum(enrol['statuses'].values()) == enrol['requests']
+    assert result['requests']['catalogue']['errors'] == 0
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip('py2neo')
+
+from db.db_neo4j import Department, Instructor, Thesis, \
+    ThesisStatus  # noqa: E402
+from db.mapper import iter_batches, map_models, map_tuples  # noqa: E402
+
+
+def test_from_record_keeps_the_stored_properties():
+    properties = {'id': 'a1', 'thesis_name': 'Stored', 'description': '',
+                  'year': 9, 'difficulty': 3, 'creation_ts': 1.0,
+                  'status': ThesisStatus.ENROLLED, 'student_id': 's1'}
+    thesis = Thesis.from_record(properties)
+    # no validation, no new id or timestamps
+    assert (thesis.id, thesis.year, thesis.creation_ts) == ('a1', 9, 1.0)
+    assert thesis.update_ts is None
+    assert thesis.to_dict() == {key: value for key, value in
+                                properties.items() if value}
+    assert not hasattr(thesis, '__dict__')
+    with pytest.raises(AttributeError):
+        thesis.instructor_id = 'i1'
+
+    department = Department.from_record({'department_id': 'd1', 'name': 'D'})
+    assert department.to_dict() == {'department_id': 'd1', 'name': 'D'}
+
+
+def test_records_are_mapped_in_batches():
+    records = [{'t': {'id': str(number), 'load': number}}
+               for number in range(25)]
+    batches = list(iter_batches(records, 10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+
+    instructors = map_models(batches[0], Instructor)
+    assert [instructor.load for instructor in instructors] == list(range(10))
+    assert map_tuples(batches[2], ('id', 'load', 'degree')) == \
+        [(str(number), number, None) for number in range(20, 25)]
@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip('py2neo')
+
+from db.matching import solve, ALL_TAKEN, NO_PREFERENCES  # noqa: E402
+
+THESES = {
+    'a': {'year': 4, 'instructor_id': 'i1'},
+    'b': {'year': 4, 'instructor_id': 'i1'},
+    'c': {'year': 4, 'instructor_id': 'i2'},
+    'first-year': {'year': 1, 'instructor_id': 'i2'},
+    'taken': {'year': 4, 'instructor_id': 'i2', 'student_id': 's0'},
+}
+
+
+def student(student_id, preferences, ts, year=4, **fields):
+    return dict(_id=student_id, year=year, preferences=preferences,
+                preferences_ts=ts, **fields)
+
+
+def test_earlier_submissions_get_their_preferences_first():
+    students = [student('s2', ['a', 'c'], 2), student('s1', ['a', 'b'], 1)]
+    report = solve(students, THESES, {'i1': None, 'i2': None})
+    assert report.assigned == {'s1': 'a', 's2': 'c'}
+    assert report.unmatched == []
+
+
+def test_capacity_eligibility_and_taken_theses():
+    students = [
+        student('s1', ['a'], 1),
+        student('s2', ['b', 'first-year', 'taken', 'c'], 2),
+        student('s3', [], 3),
+        student('s4', ['a'], 4, thesis_id='x'),
+    ]
+    # i1 supervises one thesis at most, i2 already has "taken"
+    report = solve(students, THESES, {'i1': 1, 'i2': 1})
+    assert report.assigned == {'s1': 'a'}
+    assert sorted(report.unmatched) == [('s2', ALL_TAKEN),
+                                        ('s3', NO_PREFERENCES)]
+    assert report.already_enrolled == 1
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+from benchmarks.run import Bench  # noqa: E402
+from db import events  # noqa: E402
+from db.catalogue import CATALOGUE  # noqa: E402
+from db.clients import relay_writes  # noqa: E402
+from db.invalidation import InvalidationChannel  # noqa: E402
+from db.matching import MatchingReport, TAKEN, write_assignments  # noqa: E402
+from db.stream import STREAM  # noqa: E402
+
+
+class RecordingChannel(InvalidationChannel):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, kind, key):
+        self.published.append((kind, key))
+
+
+def test_assignment_respects_load_and_reaches_the_workers():
+    bench = Bench(1)
+    graph = bench.clients.graph.graph
+    instructor_id, instructor = next(
+        (key, value) for key, value in graph.instructors.items()
+        if sum(1 for name, owner in graph.thesis_instructor.items()
+               if owner == key and not graph.theses[name].get('student_id'))
+        >= 2)
+    free = [name for name, owner in sorted(graph.thesis_instructor.items())
+            if owner == instructor_id
+            and not graph.theses[name].get('student_id')][:2]
+    # an enrolment through the API took the last free place meanwhile
+    instructor['load'] = instructor.get('theses_enrolled', 0) + 1
+    students = [str(user['_id']) for user in bench.students
+                if not user.get('thesis_id')][:2]
+
+    report = MatchingReport()
+    report.assigned = dict(zip(students, free))
+    channel = RecordingChannel()
+    stop = relay_writes(channel)
+    try:
+        write_assignments(bench.clients.graph, bench.clients.mongo, report)
+    finally:
+        stop()
+
+    assert report.assigned == {students[0]: free[0]}
+    assert report.unmatched == [(students[1], TAKEN)]
+    assert instructor['theses_enrolled'] == instructor['load']
+
+    kinds = [kind for kind, _ in channel.published]
+    assert {CATALOGUE, STREAM, events.REMOTE} <= set(kinds)
+    relayed = [json.loads(key) for kind, key in channel.published
+               if kind == events.REMOTE]
+    assert relayed == [[events.THESIS_ENROLLED, {
+        'thesis_name': free[0], 'student_id': students[0],
+        'ts': relayed[0][1]['ts']}]]
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from db import metrics, queries
+from db.dual_write import DualWrite
+
+mongomock = pytest.importorskip('mongomock')
+
+PING = queries.register('test.metrics_ping', 'RETURN 1 AS metrics_ping')
+
+
+class Graph:
+    def run(self, text, parameters=None):
+        return text
+
+
+def test_calls_are_counted_for_the_request():
+    users = metrics.InstrumentedCollection(
+        mongomock.MongoClient().db.get_collection('users'))
+    graph = metrics.InstrumentedGraph(Graph())
+    stats = metrics.start_request('test_endpoint')
+    try:
+        users.insert_one({'name': 'a'})
+        users.find_one({'name': 'a'})
+        with ThreadPoolExecutor(2) as executor:
+            DualWrite(executor).add('neo4j', lambda: graph.run(
+                queries.get(PING))).run()
+        stats.finish('GET', 200)
+    finally:
+        metrics.end_request()
+
+    assert stats.calls['mongo'][0] == 2
+    assert stats.calls['neo4j'][0] == 1
+    assert stats.server_timing().startswith('mongo;dur=')
+
+    text = metrics.render()
+    assert 'db_call_duration_seconds_count{endpoint="test_endpoint",' \
+           'store="neo4j",operation="test.metrics_ping"} 1' in text
+    assert 'db_round_trips_per_request_bucket{endpoint="test_endpoint",' \
+           'store="mongo",le="2"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'test', ('kind',),
+                                  (1, 2))
+    for value in (0.5, 1.5, 3):
+        histogram.observe(value, 'a"b')
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{kind="a\\"b",le="1"} 1',
+        'test_seconds_bucket{kind="a\\"b",le="2"} 2',
+        'test_seconds_bucket{kind="a\\"b",le="+Inf"} 3',
+        'test_seconds_sum{kind="a\\"b"} 5.0',
+        'test_seconds_count{kind="a\\"b"} 3',
+    ]
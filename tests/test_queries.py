@@ -0,0 +1,82 @@
+import pytest
+
+pytest.importorskip('py2neo')
+
+from db import queries  # noqa: E402
+from db.db_neo4j import GraphDatabaseClient, Thesis, Instructor  # noqa: E402
+from db.exceptions import ObjectDoesNotExist  # noqa: E402
+
+
+class RecordingCursor:
+    def __init__(self, result):
+        self.result = result
+
+    def data(self):
+        return self.result
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def evaluate(self):
+        return self.result[0]['value'] if self.result else None
+
+
+class RecordingGraph:
+    """
+    answers every query with an empty result and records the query texts
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def run(self, text, parameters=None):
+        self.statements.append((text, parameters))
+        return RecordingCursor([])
+
+
+@pytest.fixture
+def client():
+    client = GraphDatabaseClient.__new__(GraphDatabaseClient)
+    client.graph = RecordingGraph()
+    return client
+
+
+def test_query_text_does_not_depend_on_values(client):
+    """
+    Neo4j caches execution plans by query text, so repeated calls with
+    other values must send exactly the same text
+    """
+    for name in ['Lorem "Ipsum"', "it's a test", 'plain']:
+        Instructor(name).get_thesis(client)
+        Thesis.find_page(client, year=2, tag=name, cursor=name)
+        # the recording graph deletes nothing
+        with pytest.raises(ObjectDoesNotExist):
+            Instructor(name).delete_thesis(client, name)
+
+    texts = {}
+    for text, parameters in client.graph.statements:
+        assert text in queries.QUERIES.values()
+        for value in parameters.values():
+            if isinstance(value, str):
+                assert value not in text
+        texts.setdefault(text, 0)
+        texts[text] += 1
+    assert sorted(texts.values()) == [3, 3, 3]
+
+
+def test_page_query_has_only_the_given_filters(client):
+    Thesis.find_page(client, year=2, instructor_id='i1')
+    Thesis.find_page(client)
+    (text, parameters), (plain, _) = client.graph.statements
+    assert queries.name_of(text) == 'thesis.page:year,instructor_id'
+    assert 't.year = $year' in text and 'i.id = $instructor_id' in text
+    assert 'IS NULL OR' not in text
+    assert parameters == {'year': 2, 'instructor_id': 'i1', 'limit': 51}
+    assert 'WHERE' not in plain
+
+
+def test_a_name_is_registered_for_one_text_only():
+    name = queries.register('test.registry', 'RETURN 1 AS value')
+    assert queries.register(name, 'RETURN 1 AS value') == name
+    with pytest.raises(ValueError, match='already registered'):
+        queries.register(name, 'RETURN 2 AS value')
@@ -0,0 +1,84 @@
+import json
+
+from db import events
+from db.invalidation import InvalidationChannel
+from db.recommend import Recommender
+
+THESES = [
+    ({'thesis_name': 'ml', 'year': 4, 'difficulty': 3}, ['ml', 'python']),
+    ({'thesis_name': 'ml-hard', 'year': 4, 'difficulty': 5}, ['ml']),
+    ({'thesis_name': 'java', 'year': 4, 'difficulty': 3}, ['java']),
+    ({'thesis_name': 'ml-first-year', 'year': 1, 'difficulty': 3}, ['ml']),
+    ({'thesis_name': 'taken', 'year': 4, 'difficulty': 3,
+      'student_id': 's9'}, ['ml']),
+]
+
+
+def make_recommender(loads=None):
+    def theses():
+        if loads is not None:
+            loads.append(1)
+        return THESES
+    return Recommender(theses, lambda: {'g4': 4, 'g1': 1}, 100)
+
+
+def test_recommend_by_tags_year_and_difficulty():
+    recommender = make_recommender()
+    student = {'_id': 's1', 'group_id': 'g4', 'interests': ['ml', 'python']}
+    assert recommender.recommend(student, 3) == \
+        ['ml', 'ml-hard', 'ml-first-year']
+
+    first_year = {'_id': 's2', 'group_id': 'g1', 'interests': ['ml']}
+    assert recommender.recommend(first_year, 1) == ['ml-first-year']
+
+
+def test_group_is_scored_in_one_pass():
+    recommender = make_recommender()
+    group = [{'_id': 's1', 'group_id': 'g4', 'interests': ['java']},
+             {'_id': 's2', 'group_id': 'g4', 'interests': ['python']}]
+    calls = []
+
+    def load_group():
+        calls.append(1)
+        return group
+
+    assert recommender.recommend(group[0], 1, load_group) == ['java']
+    assert recommender.recommend(group[1], 1, load_group) == ['ml']
+    assert len(calls) == 1
+
+
+def test_enrolment_events_update_availability_without_rebuild():
+    loads = []
+    recommender = make_recommender(loads)
+    student = {'_id': 's1', 'group_id': 'g4', 'interests': ['ml', 'python']}
+    assert recommender.recommend(student, 1) == ['ml']
+
+    recommender.on_event(events.THESIS_ENROLLED,
+                         {'thesis_name': 'ml', 'student_id': 's2', 'ts': 1})
+    assert recommender.recommend(student, 1) == ['ml-hard']
+    recommender.on_event(events.THESIS_RELEASED,
+                         {'thesis_name': 'ml', 'student_id': 's2', 'ts': 2})
+    assert recommender.recommend(student, 1) == ['ml']
+    assert len(loads) == 1
+
+    recommender.on_event(events.THESIS_DELETED,
+                         {'thesis_name': 'java', 'instructor_id': 'i1'})
+    recommender.recommend(student, 1)
+    assert len(loads) == 2
+
+
+def test_thesis_changes_of_other_processes_mark_it_dirty():
+    recommender = make_recommender()
+    recommender.subscribe()
+    student = {'_id': 's1', 'group_id': 'g4', 'interests': ['ml', 'python']}
+    assert recommender.recommend(student, 1) == ['ml']
+
+    receiver = events.Relay(InvalidationChannel())
+    receiver.on_invalidation(events.REMOTE, json.dumps(
+        [events.THESIS_ENROLLED, {'thesis_name': 'ml', 'student_id': 's2',
+                                  'ts': 1}]))
+    assert recommender.recommend(student, 1) == ['ml-hard']
+    receiver.on_invalidation(events.REMOTE, json.dumps(
+        [events.THESES_IMPORTED, {}]))
+    assert recommender.dirty
+    events.unsubscribe(recommender.on_event)
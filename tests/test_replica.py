@@ -0,0 +1,128 @@
+from bisect import insort
+
+import pytest
+
+pytest.importorskip('py2neo')
+pytest.importorskip('mongomock')
+
+import create_test_database  # noqa: E402
+from benchmarks.run import DATASET  # noqa: E402
+from benchmarks.standins import create_graph_client, \
+    create_mongo_client  # noqa: E402
+from db import events  # noqa: E402
+from db.db_neo4j import Thesis, Instructor  # noqa: E402
+from db.replica import GraphReplica  # noqa: E402
+
+
+@pytest.fixture
+def graph():
+    graph = create_graph_client()
+    data = create_test_database.generate_university(**DATASET)
+    create_test_database.write_university(data, create_mongo_client(), graph)
+    return graph
+
+
+def test_replica_answers_like_the_graph(graph):
+    replica = GraphReplica(graph)
+    replica.reload()
+
+    assert replica.find_all() == sorted(Thesis.find_all(graph),
+                                        key=lambda x: x['thesis_name'])
+    tag = replica.thesis_tags(replica.names[0])[0]
+    for filters in ({}, {'year': 3}, {'only_unassigned': True}, {'tag': tag},
+                    {'department_id': next(iter(replica.departments))}):
+        cursor = None
+        while True:
+            expected = Thesis.find_page(graph, cursor=cursor, page_size=7,
+                                        **filters)
+            page = replica.find_page(cursor=cursor, page_size=7, **filters)
+            assert page == expected, filters
+            cursor = page[1]
+            if cursor is None:
+                break
+
+    instructor_id = next(iter(replica.instructors))
+    assert replica.instructor_counters(instructor_id) == \
+        Instructor(instructor_id).get_counters(graph)
+
+
+def test_replica_pages_like_the_graph(graph):
+    # a thesis left without an instructor and one with a falsy property
+    stored = graph.graph._graph
+    name = 'Thesis 0: without an instructor'
+    stored.theses[name] = {'id': 'orphan', 'thesis_name': name, 'year': 3,
+                           'difficulty': 2, 'status': 'created'}
+    insort(stored.thesis_names, name)
+    stored.thesis_instructor[name] = None
+    stored.thesis_tags[name] = []
+    stored.theses[stored.thesis_names[1]]['score'] = 0
+
+    replica = GraphReplica(graph)
+    replica.reload()
+    expected = Thesis.find_page(graph, page_size=3)
+    assert replica.find_page(page_size=3) == expected
+    assert name not in [thesis['thesis_name'] for thesis in expected[0]]
+    assert expected[0][0]['score'] == 0
+    assert all(value is not None for thesis in expected[0]
+               for value in thesis.values())
+
+
+def test_replica_follows_events_and_polls(graph):
+    changes = []
+    replica = GraphReplica(graph, on_change=lambda: changes.append(1))
+    replica.reload()
+    thesis = next(thesis for thesis in replica.find_all()
+                  if not thesis.get('student_id'))
+    name = thesis['thesis_name']
+
+    replica.on_event(events.THESIS_ENROLLED, {
+        'thesis_name': name, 'student_id': 's1', 'ts': 1})
+    assert replica.find_one(Thesis.node_type,
+                            {'thesis_name': name})['student_id'] == 's1'
+
+    # a change made by another process is picked up by the next poll
+    graph.graph._graph.theses[name].update(student_id='s2',
+                                           update_ts=replica.since + 1)
+    assert replica.poll() == 1
+    assert replica.find_one(Thesis.node_type,
+                            {'thesis_name': name})['student_id'] == 's2'
+    assert replica.poll() == 0
+
+    # deletes leave a tombstone for the next poll
+    Instructor(replica.theses[name].instructor_id).delete_thesis(graph, name)
+    assert replica.poll() == 1
+    assert replica.find(Thesis.node_type, {'thesis_name': name}) == []
+    assert len(changes) == 3
+
+
+def test_reload_notifies_only_on_changes(graph):
+    changes = []
+    replica = GraphReplica(graph, on_change=lambda: changes.append(1))
+    replica.reload()
+    assert len(changes) == 1
+
+    # the periodic reload of an unchanged graph keeps the caches
+    replica.reload()
+    assert len(changes) == 1
+
+    name = replica.names[0]
+    graph.graph._graph.theses[name].update(
+        description='changed', update_ts=replica.theses[name].update_ts + 1)
+    replica.reload()
+    assert len(changes) == 2
+    assert replica.theses[name].description == 'changed'
+
+
+def test_iter_all_keeps_its_snapshot(graph):
+    replica = GraphReplica(graph)
+    replica.reload()
+    thesis = next(thesis for thesis in replica.find_all()
+                  if not thesis.get('student_id'))
+    name = thesis['thesis_name']
+
+    theses = replica.iter_all()
+    replica.on_event(events.THESIS_ENROLLED, {
+        'thesis_name': name, 'student_id': 's1', 'ts': 1})
+    streamed = {thesis['thesis_name']: thesis for thesis in theses}
+    assert streamed[name].get('student_id') is None
+    assert replica.theses[name].student_id == 's1'
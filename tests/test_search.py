@@ -0,0 +1,94 @@
+from db import events
+from db.invalidation import InvalidationChannel
+from db.search import SearchIndex, tokenize
+
+
+class RecordingChannel(InvalidationChannel):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, kind, key):
+        self.published.append((kind, key))
+
+
+def make_index():
+    index = SearchIndex()
+    index.build([
+        ({'thesis_name': 'Deep learning for images',
+          'description': 'Convolutional networks', 'update_ts': 1}, ['ml']),
+        ({'thesis_name': 'Графові бази даних',
+          'description': "Моделювання зв'язків у Neo4j", 'update_ts': 1},
+         ['neo4j', 'databases']),
+        ({'thesis_name': 'Hello world in Java',
+          'description': 'The most spiky hello world', 'update_ts': 1},
+         ['java']),
+    ])
+    return index
+
+
+def names(results):
+    return [item['thesis_name'] for item in results]
+
+
+def test_tokenize():
+    assert tokenize("Моделювання зв'язків у Neo4j") == \
+        ['моделювання', 'звязків', 'neo4j']
+    assert tokenize('The Hello, WORLD!') == ['hello', 'world']
+
+
+def test_search_ranks_name_and_tags():
+    index = make_index()
+    assert names(index.search('java')) == ['Hello world in Java']
+    assert names(index.search('бази')) == ['Графові бази даних']
+    assert names(index.search('neo4j'))[0] == 'Графові бази даних'
+
+
+def test_prefix_matching():
+    index = make_index()
+    assert names(index.search('конв')) == []
+    assert names(index.search('conv')) == ['Deep learning for images']
+    assert names(index.search('граф')) == ['Графові бази даних']
+
+
+def test_incremental_updates():
+    index = make_index()
+    index.on_event(events.THESIS_CREATED, {
+        'thesis': {'thesis_name': 'Java compilers', 'description': ''},
+        'tags': ['java']})
+    assert set(names(index.search('java'))) == \
+        {'Hello world in Java', 'Java compilers'}
+
+    index.on_event(events.THESIS_ENROLLED, {
+        'thesis_name': 'Java compilers', 'student_id': 's1', 'ts': 2})
+    assert names(index.search('java', only_unassigned=True)) == \
+        ['Hello world in Java']
+
+    index.on_event(events.THESIS_DELETED, {
+        'thesis_name': 'Hello world in Java', 'instructor_id': 'i1'})
+    assert names(index.search('java')) == ['Java compilers']
+    assert 'spiky' not in index.terms
+
+
+def test_events_of_other_processes_reach_the_index():
+    writer = RecordingChannel()
+    relay = events.Relay(writer)
+    relay.subscribe(receive=False)
+    events.emit(events.THESIS_CREATED, thesis={
+        'thesis_name': 'Remote compilers', 'description': ''}, tags=['java'])
+    events.emit(events.THESES_IMPORTED, rows=[{
+        'props': {'thesis_name': 'Imported java'}, 'tags': []}])
+    events.unsubscribe(relay.on_event)
+
+    catalogue = [({'thesis_name': 'Imported java', 'update_ts': 1}, [])]
+    index = SearchIndex(lambda: catalogue)
+    index.subscribe()
+    receiver = events.Relay(InvalidationChannel())
+    for kind, key in writer.published:
+        receiver.on_invalidation(kind, key)
+    events.unsubscribe(index.on_event)
+
+    # the import is relayed without its rows, the index reloads
+    assert index.stale
+    assert set(names(index.search('java'))) == \
+        {'Remote compilers', 'Imported java'}
@@ -0,0 +1,44 @@
+import gzip
+import json
+
+from db.serialize import compile_serializer, gzip_chunks, json_array, ndjson
+
+ITEMS = [{'thesis_name': f'Thesis {i}', 'year': i % 6 + 1,
+          'description': 'x' * 100, 'tags': ['a', 'b']} for i in range(2000)]
+
+
+class Point:
+    def __init__(self, x, y, label=None):
+        self.x = x
+        self.y = y
+        self.label = label
+
+
+def test_json_array_is_the_same_as_json_dumps():
+    body = b''.join(json_array(ITEMS))
+    assert body == json.dumps(ITEMS).encode()
+    assert b''.join(json_array([])) == b'[]'
+
+    chunks = list(json_array(ITEMS, prefix='{"items": ', suffix='}'))
+    assert len(chunks) > 1
+    assert json.loads(b''.join(chunks)) == {'items': ITEMS}
+
+
+def test_ndjson_has_one_object_per_line():
+    lines = b''.join(ndjson(ITEMS)).decode().splitlines()
+    assert [json.loads(line) for line in lines] == ITEMS
+
+
+def test_gzip_chunks_decompress_to_the_body():
+    body = gzip.decompress(b''.join(gzip_chunks(json_array(ITEMS))))
+    assert body == json.dumps(ITEMS).encode()
+
+
+def test_compiled_serializer_drops_empty_values():
+    to_dict = compile_serializer(('x', 'y', 'label'))
+    assert to_dict(Point(1, 0)) == {'x': 1}
+    assert list(to_dict(Point(1, 2, 'a'))) == ['x', 'y', 'label']
+
+    to_dict = compile_serializer(('y',), drop_falsy=False)
+    assert to_dict(Point(1, 0)) == {'y': 0}
+    assert b''.join(json_array([Point(1, 0)], to_dict)) == b'[{"y": 0}]'
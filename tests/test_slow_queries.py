@@ -0,0 +1,59 @@
+import time
+
+from db import queries
+from db.slow_queries import SlowQueryLog, aggregate, is_read_only, \
+    read_records
+
+SLOW = queries.register('test.slow', 'MATCH (t:Thesis) RETURN t')
+
+PLAN = {'operatorType': 'ProduceResults@neo4j', 'dbHits': 0, 'rows': 3,
+        'children': [{'operatorType': 'NodeByLabelScan@neo4j', 'dbHits': 4,
+                      'rows': 3, 'children': []}]}
+
+
+class Cursor:
+    def data(self):
+        return []
+
+    def plan(self):
+        return PLAN
+
+
+class Graph:
+    def __init__(self):
+        self.statements = []
+
+    def run(self, text, parameters=None):
+        self.statements.append(text)
+        return Cursor()
+
+
+def test_is_read_only():
+    assert is_read_only(queries.get(SLOW))
+    assert not is_read_only('MATCH (t) SET t.x = 1')
+    assert not is_read_only('MATCH (t) DETACH DELETE t')
+
+
+def test_slow_queries_are_profiled_once_per_interval(tmp_path):
+    path = str(tmp_path / 'slow.log')
+    log = SlowQueryLog(path, profile_interval=60)
+    graph = Graph()
+    log.report(graph, SLOW, {'year': 1}, 0.5)
+    log.report(graph, SLOW, {'year': 2}, 0.25)
+
+    deadline = time.monotonic() + 2
+    while log.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for handler in log.logger.handlers:
+        handler.flush()
+
+    assert graph.statements == ['PROFILE ' + queries.get(SLOW)]
+    records = list(read_records([path]))
+    assert records[0]['scans'] == ['NodeByLabelScan']
+    assert records[0]['db_hits'] == 4
+    assert 'db_hits' not in records[1]
+
+    [shape] = aggregate(records)
+    assert shape['count'] == 2
+    assert shape['max_ms'] == 500
+    assert shape['scans'] == ['NodeByLabelScan']
@@ -0,0 +1,42 @@
+from db import events
+from db.stream import StreamHub, CREATED, DELETED, RESET
+
+
+def test_listeners_get_events_and_replay_after_reconnect():
+    hub = StreamHub(buffer_size=2, max_listeners=1)
+    hub.subscribe()
+    try:
+        listener = hub.open(keepalive=0.01)
+        assert hub.open() is None
+        stream = iter(listener)
+        assert next(stream).startswith('retry:')
+        assert next(stream) == ': keepalive\n\n'
+
+        events.emit(events.THESIS_CREATED, thesis={'thesis_name': 'a'},
+                    instructor_id='i', tags=['x'])
+        message = next(stream)
+        assert f'event: {CREATED}\n' in message
+        assert '"instructor_id": "i"' in message
+        last_id = message.split('\n')[0][len('id: '):]
+        listener.close()
+        assert hub.listeners == 0
+
+        events.emit(events.THESIS_DELETED, thesis_name='a', instructor_id='i')
+        listener = hub.open(last_id, keepalive=0.01)
+        stream = iter(listener)
+        next(stream)
+        assert f'event: {DELETED}\n' in next(stream)
+        listener.close()
+    finally:
+        events.unsubscribe(hub.on_event)
+
+    # the events after the id have left the buffer, or the id comes from
+    # the hub of another worker
+    for _ in range(3):
+        hub.publish(DELETED, {'thesis_name': 'b'})
+    for event_id in (last_id, 'other-1'):
+        listener = hub.open(event_id, keepalive=0.01)
+        stream = iter(listener)
+        next(stream)
+        assert f'event: {RESET}\n' in next(stream)
+        listener.close()
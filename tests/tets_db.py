@@ -3,6 +3,7 @@ import uuid
 
 import pytest
 
+from db.bulk import import_theses
 from db.db_neo4j import GraphDatabaseClient, Thesis, UniversityYear, \
     Department, Group, Degree, Instructor
 
@@ -90,3 +91,22 @@ def test_delete_thesis(database):
     i.delete_thesis(database, 'to delete thesis test')
     assert not database.find_one(Thesis.node_type,
                              {'thesis_name': 'to delete thesis test'})
+
+
+def test_bulk_import(database):
+    i = Instructor('5cb673e70d34e12dab8cd206')
+    name = f'bulk import test {uuid.uuid4()}'
+    rows = [
+        {'thesis_name': name, 'description': 'Some fancy description',
+         'year': 4, 'difficulty': 3, 'tags': 'bulk, import',
+         'instructor_id': i.id},
+        {'thesis_name': name, 'description': 'duplicate',
+         'year': 4, 'difficulty': 3, 'instructor_id': i.id},
+        {'thesis_name': 'bulk import wrong year', 'description': '',
+         'year': 9, 'difficulty': 3, 'instructor_id': i.id},
+    ]
+    report = import_theses(database, rows, batch_size=2)
+    assert report.imported == 1
+    assert [row for row, _ in report.errors] == [2, 3]
+    assert database.find_one(Thesis.node_type, {'thesis_name': name})
+    i.delete_thesis(database, name)